@@ -5,14 +5,34 @@
 """
 
 #   Packages and Libraries
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
-from datetime import datetime, timedelta
+from flask import Flask, Response, render_template, request, redirect, url_for, session, jsonify, stream_with_context
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor
 from flask_session import Session
 from dotenv import load_dotenv
-import random
+from email.message import EmailMessage
+import numpy as np
+from functools import lru_cache
+import multiprocessing
+import threading
+import msgspec
+import queue
 import html
+import json
+import hmac
+import hashlib
+import time
+import click
+import zlib
+import mmap
+import csv
+import io
+import smtplib
+import socket
+import struct
 import sqlite3
 import bcrypt
+import re
 import os
 
 # TODO: DELETE CACHE FILES & TEST
@@ -32,11 +52,671 @@ app.config["SESSION_FILE_DIR"] = "./.sessions"
 Session(app)
 
 
+#   Database Schema
+# Tables and triggers the app maintains itself, created on start up
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customer_versions (
+    customer_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 1,
+    modified_time INTEGER NOT NULL
+);
+
+CREATE TRIGGER IF NOT EXISTS customers_version_insert AFTER INSERT ON customers
+BEGIN
+    INSERT OR IGNORE INTO customer_versions (customer_id, version, modified_time)
+    VALUES (NEW.id, 1, CAST(strftime('%s', 'now') AS INTEGER));
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_version_update AFTER UPDATE OF full_name ON customers
+WHEN OLD.full_name IS NOT NEW.full_name
+BEGIN
+    UPDATE customer_versions SET version = version + 1, modified_time = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE customer_id = NEW.id;
+END;
+
+-- Staff work through pending consultations in preferred date order, optionally within a region
+CREATE INDEX IF NOT EXISTS consultations_pending ON consultations (preferred_date, id) WHERE status = 'pending';
+CREATE INDEX IF NOT EXISTS consultations_pending_region ON consultations (region, preferred_date, id)
+WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS consultations_customer ON consultations (customer_id);
+
+-- Staff search: one document per consultation, with its customer's name and email copied in
+CREATE VIRTUAL TABLE IF NOT EXISTS consultation_search USING fts5 (
+    full_name, email, postcode, property_type, product,
+    tokenize = 'unicode61 remove_diacritics 2', prefix = '1 2 3'
+);
+
+-- Names and postcodes count for more than the product or property type
+INSERT INTO consultation_search (consultation_search, rank) VALUES ('rank', 'bm25(10.0, 8.0, 6.0, 1.0, 2.0)');
+
+INSERT INTO consultation_search (rowid, full_name, email, postcode, property_type, product)
+SELECT c.id, cu.full_name, cu.email, c.postcode, c.property_type, p.type
+FROM consultations c
+JOIN customers cu ON cu.id = c.customer_id
+JOIN products p ON p.id = c.product_id
+WHERE NOT EXISTS (SELECT 1 FROM consultation_search);
+
+CREATE TRIGGER IF NOT EXISTS consultation_search_insert AFTER INSERT ON consultations
+BEGIN
+    INSERT INTO consultation_search (rowid, full_name, email, postcode, property_type, product)
+    SELECT NEW.id, cu.full_name, cu.email, NEW.postcode, NEW.property_type, p.type
+    FROM customers cu, products p
+    WHERE cu.id = NEW.customer_id AND p.id = NEW.product_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS consultation_search_update
+AFTER UPDATE OF postcode, property_type, product_id, customer_id ON consultations
+BEGIN
+    DELETE FROM consultation_search WHERE rowid = OLD.id;
+    INSERT INTO consultation_search (rowid, full_name, email, postcode, property_type, product)
+    SELECT NEW.id, cu.full_name, cu.email, NEW.postcode, NEW.property_type, p.type
+    FROM customers cu, products p
+    WHERE cu.id = NEW.customer_id AND p.id = NEW.product_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS consultation_search_delete AFTER DELETE ON consultations
+BEGIN
+    DELETE FROM consultation_search WHERE rowid = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS customers_search_update AFTER UPDATE OF full_name, email ON customers
+WHEN OLD.full_name IS NOT NEW.full_name OR OLD.email IS NOT NEW.email
+BEGIN
+    UPDATE consultation_search SET full_name = NEW.full_name, email = NEW.email
+    WHERE rowid IN (SELECT id FROM consultations WHERE customer_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS consultations_version_insert AFTER INSERT ON consultations
+BEGIN
+    UPDATE customer_versions SET version = version + 1, modified_time = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE customer_id = NEW.customer_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS consultations_version_update AFTER UPDATE ON consultations
+BEGIN
+    UPDATE customer_versions SET version = version + 1, modified_time = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE customer_id IN (OLD.customer_id, NEW.customer_id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS consultations_version_delete AFTER DELETE ON consultations
+BEGIN
+    UPDATE customer_versions SET version = version + 1, modified_time = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE customer_id = OLD.customer_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bookings_version_insert AFTER INSERT ON bookings
+BEGIN
+    UPDATE customer_versions SET version = version + 1, modified_time = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE customer_id = NEW.customer_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bookings_version_delete AFTER DELETE ON bookings
+BEGIN
+    UPDATE customer_versions SET version = version + 1, modified_time = CAST(strftime('%s', 'now') AS INTEGER)
+    WHERE customer_id = OLD.customer_id;
+END;
+
+INSERT OR IGNORE INTO customer_versions (customer_id, version, modified_time)
+SELECT id, 1, CAST(strftime('%s', 'now') AS INTEGER) FROM customers;
+
+-- Dashboard changes, recorded in the writer's transaction and read by every process's event poller
+CREATE TABLE IF NOT EXISTS change_events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    consultation_id INTEGER NOT NULL,
+    last_cancellation TEXT,
+    created_time REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meter_readings (
+    customer_id INTEGER NOT NULL,
+    day_start INTEGER NOT NULL,
+    wh BLOB NOT NULL,
+    PRIMARY KEY (customer_id, day_start)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS reading_versions (
+    customer_id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS energy_rollups (
+    customer_id INTEGER NOT NULL,
+    resolution TEXT NOT NULL,
+    bucket_start INTEGER NOT NULL,
+    wh INTEGER NOT NULL,
+    readings INTEGER NOT NULL,
+    PRIMARY KEY (customer_id, resolution, bucket_start)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS anomalies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    customer_id INTEGER NOT NULL,
+    start_time INTEGER NOT NULL,
+    end_time INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    peak_score REAL NOT NULL,
+    excess_wh INTEGER NOT NULL,
+    detected_time INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS anomalies_customer ON anomalies (customer_id, end_time);
+
+CREATE TABLE IF NOT EXISTS forecasts (
+    customer_id INTEGER NOT NULL,
+    horizon TEXT NOT NULL,
+    period_start INTEGER NOT NULL,
+    period_end INTEGER NOT NULL,
+    wh INTEGER NOT NULL,
+    segment TEXT NOT NULL,
+    generated_time INTEGER NOT NULL,
+    PRIMARY KEY (customer_id, horizon)
+) WITHOUT ROWID;
+
+-- Mean daily kWh of each region's customers, written by the regional_baselines job
+CREATE TABLE IF NOT EXISTS regional_baselines (
+    region TEXT PRIMARY KEY,
+    daily_kwh REAL NOT NULL,
+    computed_time INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS devices (
+    device_id TEXT PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    created_time TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS installers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    home_postcode TEXT NOT NULL,
+    working_days TEXT NOT NULL DEFAULT '1111100',
+    daily_jobs INTEGER NOT NULL DEFAULT 2,
+    active BOOLEAN NOT NULL DEFAULT TRUE
+);
+
+CREATE TABLE IF NOT EXISTS installer_skills (
+    installer_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    PRIMARY KEY (installer_id, product_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS installer_areas (
+    area TEXT NOT NULL,
+    installer_id INTEGER NOT NULL,
+    PRIMARY KEY (area, installer_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS installer_days_off (
+    installer_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    PRIMARY KEY (installer_id, day)
+) WITHOUT ROWID;
+
+-- Days nobody is booked, such as bank holidays
+CREATE TABLE IF NOT EXISTS blackout_days (
+    day DATE PRIMARY KEY,
+    reason TEXT NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS installer_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    installer_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    consultation_id INTEGER NOT NULL,
+    booking_id INTEGER
+);
+
+CREATE INDEX IF NOT EXISTS installer_jobs_day ON installer_jobs (installer_id, day);
+CREATE INDEX IF NOT EXISTS installer_jobs_by_day ON installer_jobs (day);
+CREATE INDEX IF NOT EXISTS installer_jobs_consultation ON installer_jobs (consultation_id);
+CREATE INDEX IF NOT EXISTS installer_jobs_booking ON installer_jobs (booking_id);
+
+CREATE TABLE IF NOT EXISTS installer_routes (
+    installer_id INTEGER NOT NULL,
+    day DATE NOT NULL,
+    position INTEGER NOT NULL,
+    job_id INTEGER NOT NULL,
+    arrival_minute INTEGER NOT NULL,
+    start_minute INTEGER NOT NULL,
+    travel_km REAL NOT NULL,
+    PRIMARY KEY (installer_id, day, position)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS installer_routes_by_day ON installer_routes (day);
+
+-- Jobs version moves with every reservation, config version with installer or calendar edits
+CREATE TABLE IF NOT EXISTS capacity_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    jobs_version INTEGER NOT NULL,
+    config_version INTEGER NOT NULL
+);
+
+INSERT OR IGNORE INTO capacity_version (id, jobs_version, config_version) VALUES (1, 0, 0);
+
+CREATE TRIGGER IF NOT EXISTS installer_jobs_insert_version AFTER INSERT ON installer_jobs
+BEGIN
+    UPDATE capacity_version SET jobs_version = jobs_version + 1;
+END;
+
+CREATE TRIGGER IF NOT EXISTS installer_jobs_delete_version AFTER DELETE ON installer_jobs
+BEGIN
+    UPDATE capacity_version SET jobs_version = jobs_version + 1;
+END;
+
+-- Cancelling a consultation or booking frees the installer days it held
+CREATE TRIGGER IF NOT EXISTS consultations_delete_jobs AFTER DELETE ON consultations
+BEGIN
+    DELETE FROM installer_jobs WHERE consultation_id = OLD.id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS bookings_delete_jobs AFTER DELETE ON bookings
+BEGIN
+    DELETE FROM installer_jobs WHERE booking_id = OLD.id;
+END;
+
+-- Operations reporting: counts by week (starting Monday), product, status, property type and
+-- postcode area, kept current by REPORT_STATS_TRIGGERS and checked by the reconcile_reports job
+CREATE TABLE IF NOT EXISTS consultation_stats (
+    week DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    property_type TEXT NOT NULL,
+    area TEXT NOT NULL,
+    consultations INTEGER NOT NULL,
+    PRIMARY KEY (week, product_id, status, property_type, area)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS booking_stats (
+    week DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    property_type TEXT NOT NULL,
+    area TEXT NOT NULL,
+    bookings INTEGER NOT NULL,
+    PRIMARY KEY (week, product_id, kind, status, property_type, area)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS report_reconciliations (
+    reconciled_time INTEGER NOT NULL,
+    corrected_rows INTEGER NOT NULL
+);
+
+-- Background work; run_at is pushed past the visibility timeout while a worker holds the job
+CREATE TABLE IF NOT EXISTS job_queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    run_at REAL NOT NULL,
+    enqueued_time REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    claimed_by TEXT,
+    last_error TEXT
+);
+
+CREATE INDEX IF NOT EXISTS job_queue_due ON job_queue (run_at);
+
+CREATE TABLE IF NOT EXISTS dead_jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    payload BLOB NOT NULL,
+    enqueued_time REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    failed_time REAL NOT NULL,
+    error TEXT
+);
+
+CREATE TABLE IF NOT EXISTS periodic_jobs (
+    kind TEXT PRIMARY KEY,
+    next_run REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS job_stats (
+    kind TEXT PRIMARY KEY,
+    completed INTEGER NOT NULL DEFAULT 0,
+    retried INTEGER NOT NULL DEFAULT 0,
+    dead INTEGER NOT NULL DEFAULT 0,
+    wait_seconds REAL NOT NULL DEFAULT 0,
+    max_wait_seconds REAL NOT NULL DEFAULT 0,
+    run_seconds REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+#   Report Summary Keys
+# The summary row a consultation or booking is counted in is defined once here, and both the
+# triggers that keep consultation_stats and booking_stats current and reconcile_report_stats
+# are built from it, so the two can never count a row under different keys
+CONSULTATION_STATS_KEYS = ["week", "product_id", "status", "property_type", "area"]
+BOOKING_STATS_KEYS = ["week", "product_id", "kind", "status", "property_type", "area"]
+
+
+def week_start_sql(day):
+    # The Monday starting the week day falls in
+    return f"date({day}, '-' || ((CAST(strftime('%w', {day}) AS INTEGER) + 6) % 7) || ' days')"
+
+
+def postcode_area_sql(postcode):
+    # The letters before the district number, "B" for B15 2TT and "SW" for SW1A 1AA
+    return (f"CASE WHEN substr(upper({postcode}), 2, 1) BETWEEN 'A' AND 'Z' THEN substr(upper({postcode}), 1, 2) "
+            f"ELSE substr(upper({postcode}), 1, 1) END")
+
+
+def consultation_stats_key(consultation):
+    # Values of CONSULTATION_STATS_KEYS for the consultation row named consultation
+    return ", ".join([week_start_sql(f"{consultation}.preferred_date"), f"{consultation}.product_id",
+                      f"{consultation}.status", f"{consultation}.property_type",
+                      postcode_area_sql(f"{consultation}.postcode")])
+
+
+def booking_stats_key(booking, consultation):
+    # Values of BOOKING_STATS_KEYS for a booking row joined to its consultation
+    return ", ".join([week_start_sql(f"{booking}.date_booked"), f"{consultation}.product_id",
+                      f"CASE WHEN {booking}.maintenance THEN 'maintenance' ELSE 'installation' END",
+                      f"{booking}.status", f"{consultation}.property_type",
+                      postcode_area_sql(f"{consultation}.postcode")])
+
+
+REPORT_STATS_TRIGGERS = {
+    "consultation_stats_insert": f"""CREATE TRIGGER consultation_stats_insert AFTER INSERT ON consultations
+BEGIN
+    INSERT INTO consultation_stats ({", ".join(CONSULTATION_STATS_KEYS)}, consultations)
+    VALUES ({consultation_stats_key("NEW")}, 1)
+    ON CONFLICT DO UPDATE SET consultations = consultations + 1;
+END""",
+    "consultation_stats_update": f"""CREATE TRIGGER consultation_stats_update
+AFTER UPDATE OF preferred_date, product_id, status, property_type, postcode ON consultations
+BEGIN
+    UPDATE consultation_stats SET consultations = consultations - 1
+    WHERE ({", ".join(CONSULTATION_STATS_KEYS)}) = ({consultation_stats_key("OLD")});
+    INSERT INTO consultation_stats ({", ".join(CONSULTATION_STATS_KEYS)}, consultations)
+    VALUES ({consultation_stats_key("NEW")}, 1)
+    ON CONFLICT DO UPDATE SET consultations = consultations + 1;
+END""",
+    "consultation_stats_delete": f"""CREATE TRIGGER consultation_stats_delete AFTER DELETE ON consultations
+BEGIN
+    UPDATE consultation_stats SET consultations = consultations - 1
+    WHERE ({", ".join(CONSULTATION_STATS_KEYS)}) = ({consultation_stats_key("OLD")});
+END""",
+    "booking_stats_insert": f"""CREATE TRIGGER booking_stats_insert AFTER INSERT ON bookings
+BEGIN
+    INSERT INTO booking_stats ({", ".join(BOOKING_STATS_KEYS)}, bookings)
+    SELECT {booking_stats_key("NEW", "c")}, 1
+    FROM consultations c WHERE c.id = NEW.consultation_id
+    ON CONFLICT DO UPDATE SET bookings = bookings + 1;
+END""",
+    "booking_stats_delete": f"""CREATE TRIGGER booking_stats_delete AFTER DELETE ON bookings
+BEGIN
+    UPDATE booking_stats SET bookings = bookings - 1
+    WHERE ({", ".join(BOOKING_STATS_KEYS)}) = (
+        SELECT {booking_stats_key("OLD", "c")} FROM consultations c WHERE c.id = OLD.consultation_id
+    );
+END"""
+}
+
+
+def install_report_triggers(database):
+    # Replaces any report trigger whose stored definition differs from REPORT_STATS_TRIGGERS, in one
+    # transaction so no write slips between dropping a trigger and creating its replacement
+    database.execute("BEGIN IMMEDIATE")
+    try:
+        for name, sql in REPORT_STATS_TRIGGERS.items():
+            current = database.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                       (name,)).fetchone()
+            if current is None or current[0] != sql:
+                database.execute(f"DROP TRIGGER IF EXISTS {name}")
+                database.execute(sql)
+        database.commit()
+    except BaseException:
+        database.rollback()
+        raise
+
+
+def init_database():
+    database = sqlite3.connect("database.db")
+    try:
+        # WAL lets dashboard reads continue while readings are being written
+        database.execute("PRAGMA journal_mode = WAL")
+
+        # Columns added to tables created by scripts/create_tables.py
+        columns = {row[1] for row in database.execute("PRAGMA table_info(consultations)")}
+        if "region" not in columns:
+            database.execute("ALTER TABLE consultations ADD COLUMN region TEXT")
+
+        database.executescript(SCHEMA)
+        database.commit()
+        install_report_triggers(database)
+    finally:
+        database.close()
+
+
+init_database()
+
+
 @app.context_processor  # Integrating account status across all templates
 def logged_in():
     return dict(logged_in="user" in session)
 
 
+#   Customer Data Versions (Conditional GET)
+def get_session_customer_id(cursor):
+    # Customer id is cached in the session after the first lookup by email
+    customer_id = session.get("customer_id")
+    if customer_id is None:
+        cursor.execute("SELECT id FROM customers WHERE email = ?", (session["user"],))
+        customer = cursor.fetchone()
+        if not customer:
+            return None
+        customer_id = session["customer_id"] = customer[0]
+
+    return customer_id
+
+
+def get_customer_version(cursor, customer_id):
+    # Single primary key lookup, bumped by triggers on every consultation/booking change
+    cursor.execute("SELECT version, modified_time FROM customer_versions WHERE customer_id = ?", (customer_id,))
+    version = cursor.fetchone()
+
+    return version if version else (0, 0)
+
+
+def not_modified_response(etag, last_modified):
+    # Returns a 304 response when the client's cached copy is still current
+    if request.if_none_match:
+        is_current = request.if_none_match.contains(etag)
+    elif request.if_modified_since:
+        is_current = last_modified <= request.if_modified_since
+    else:
+        is_current = False
+
+    if not is_current:
+        return None
+
+    return set_validators(Response(status=304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+# Changes are recorded in change_events by whichever process makes them, and one poller thread in each
+# process passes them on to the dashboards connected to it. PRAGMA data_version only moves when another
+# connection commits, so an idle poll costs one pragma
+event_subscribers = {}  # customer_id -> list of subscriber queues
+event_lock = threading.Lock()
+event_poller = None
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_POLL_SECONDS = 0.5
+EVENT_RETENTION_SECONDS = 3600
+
+
+def subscribe_events(customer_id):
+    global event_poller
+
+    subscriber = queue.Queue(maxsize=100)
+    with event_lock:
+        event_subscribers.setdefault(customer_id, []).append(subscriber)
+        # Started on first use so forked workers each run their own
+        if event_poller is None or not event_poller.is_alive():
+            event_poller = threading.Thread(target=poll_change_events, name="event-poller", daemon=True)
+            event_poller.start()
+
+    return subscriber
+
+
+def unsubscribe_events(customer_id, subscriber):
+    with event_lock:
+        subscribers = event_subscribers.get(customer_id, [])
+        if subscriber in subscribers:
+            subscribers.remove(subscriber)
+        if not subscribers:
+            event_subscribers.pop(customer_id, None)
+
+
+def publish_event(customer_id, event_type, payload):
+    # Pushes an event to every dashboard belonging to the customer connected to this process
+    message = f"event: {event_type}\ndata: {json.dumps(payload)}\n\n"
+    with event_lock:
+        subscribers = list(event_subscribers.get(customer_id, []))
+
+    for subscriber in subscribers:
+        try:
+            subscriber.put_nowait(message)
+        except queue.Full:
+            # Slow client, drop the event rather than block the request
+            pass
+
+
+def poll_change_events():
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM change_events")
+        last_id = cursor.fetchone()[0]
+        data_version = None
+
+        while True:
+            time.sleep(EVENT_POLL_SECONDS)
+            try:
+                version = cursor.execute("PRAGMA data_version").fetchone()[0]
+                if version == data_version:
+                    continue
+                data_version = version
+
+                cursor.execute("""
+                    SELECT id, customer_id, action, consultation_id, last_cancellation FROM change_events
+                    WHERE id > ? ORDER BY id
+                """, (last_id,))
+                changes = cursor.fetchall()
+                if not changes:
+                    continue
+                last_id = changes[-1][0]
+
+                with event_lock:
+                    listening = set(event_subscribers)
+                for _, customer_id, action, consultation_id, last_cancellation in changes:
+                    if customer_id in listening:
+                        send_consultation_change(cursor, customer_id, action, consultation_id,
+                                                 json.loads(last_cancellation) if last_cancellation else None)
+            except sqlite3.Error:
+                app.logger.exception("Couldn't read dashboard change events")
+    finally:
+        database.close()
+
+
+def get_request_type(status):
+    # Determine request_type based on status
+    if status == "Installation Scheduled":
+        return "Installation"
+    elif status == "Maintenance Scheduled":
+        return "Maintenance"
+
+    return "Enquiry"
+
+
+def fetch_dashboard_consultations(cursor, customer_id):
+    # Fetch all consultations with product type
+    cursor.execute("""
+        SELECT p.type, c.preferred_date, c.property_type, c.status, c.id
+        FROM consultations c
+        JOIN products p ON c.product_id = p.id
+        WHERE c.customer_id = ?
+        ORDER BY c.preferred_date ASC
+    """, (customer_id,))
+    consultations = cursor.fetchall()
+
+    # Prepare consultation data
+    consultation_data = []
+    today = datetime.now().date()
+    next_consultation = None
+    latest_consultation = None
+
+    for row in consultations:
+        product_type, preferred_date, property_type, status, consultation_id = row
+        date_obj = datetime.strptime(preferred_date, "%Y-%m-%d")
+        formatted_date = date_obj.strftime("%d/%m/%Y")
+
+        consultation = {
+            "product_id": product_type,
+            "request_type": get_request_type(status),
+            "property_type": property_type,
+            "date_scheduled": formatted_date,
+            "date_iso": preferred_date,
+            "status": status,
+            "consultation_id": consultation_id,
+            "date_obj": date_obj
+        }
+        consultation_data.append(consultation)
+
+        # Next closest
+        if date_obj.date() > today and next_consultation is None:
+            next_consultation = consultation
+
+        # Latest updated
+        if latest_consultation is None or date_obj > latest_consultation["date_obj"]:
+            latest_consultation = consultation
+
+    return consultation_data, next_consultation, latest_consultation
+
+
+def publish_consultation_change(cursor, customer_id, action, consultation_id, last_cancellation=None):
+    # Recorded in the caller's transaction, so dashboards only hear about committed changes
+    cursor.execute("""
+        INSERT INTO change_events (customer_id, action, consultation_id, last_cancellation, created_time)
+        VALUES (?, ?, ?, ?, ?)
+    """, (customer_id, action, consultation_id, json.dumps(last_cancellation) if last_cancellation else None,
+          time.time()))
+
+
+def send_consultation_change(cursor, customer_id, action, consultation_id, last_cancellation):
+    # Sends the changed row and refreshed activity panels so dashboards patch in place
+    consultation_data, next_consultation, latest_consultation = fetch_dashboard_consultations(cursor, customer_id)
+
+    def serialise(consultation):
+        if consultation is None:
+            return None
+        return {key: value for key, value in consultation.items() if key != "date_obj"}
+
+    changed = next((consultation for consultation in consultation_data
+                    if consultation["consultation_id"] == consultation_id), None)
+
+    publish_event(customer_id, "consultation", {
+        "action": action,
+        "consultation_id": consultation_id,
+        "consultation": serialise(changed),
+        "next_consultation": serialise(next_consultation),
+        "latest_consultation": serialise(latest_consultation),
+        "last_cancellation": last_cancellation
+    })
+
+
 #   Validation, Security and Authentication
 def sanitise_input(string):
     # Sanitsation method for SQL injection and XSS prevention
@@ -76,6 +756,14 @@ def validate_password(password):
         return False  # Password does not contain one of each
 
 
+def staff_authorised():
+    # Back office tools send STAFF_API_KEY as a bearer token
+    api_key = os.getenv("STAFF_API_KEY")
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+
+    return bool(api_key) and hmac.compare_digest(supplied.encode("utf-8"), api_key.encode("utf-8"))
+
+
 #   Landing Home Page
 @app.route("/")
 def home():
@@ -175,6 +863,7 @@ def login():
         if user:  # Check if user exists in the database
             if verify_password(user[3], password):  # user[3] is the stored hashed password
                 session["user"] = email
+                session["customer_id"] = user[0]
 
                 if stay_logged_in:
                     session.permanent = True  # Permanent session
@@ -219,7 +908,783 @@ def schedule_page():
     return render_template("login.html", error="You must be logged in to continue", next=request.url)
 
 
+#   Postcode Index
+# Area, district and sector codes ("B", "B15", "B15 2") with their region and centroid, held as one
+# sorted structured array in data/postcodes/index.npy. Every worker memory-maps the same file and a
+# postcode resolves to its most specific known code by binary search. The index is built from the
+# bundled area centroids plus any district or sector files given to build-postcode-index, or from the
+# areas alone at start up when there is none. Requests only ever read it
+POSTCODE_DIR = os.path.join("data", "postcodes")
+POSTCODE_INDEX_DTYPE = np.dtype([("code", "S6"), ("region", "S32"), ("latitude", "<f4"), ("longitude", "<f4")])
+POSTCODE_PATTERN = re.compile(r"^([A-Z]{1,2}[0-9][A-Z0-9]?)([0-9][A-Z]{2})$")
+
+postcode_index = {"mtime": None, "codes": None, "table": None}
+
+
+class PostcodeLocation(msgspec.Struct, frozen=True):
+    postcode: str
+    sector: str
+    district: str
+    area: str
+    region: str
+    latitude: float
+    longitude: float
+    precision: str  # Most specific code found: "sector", "district" or "area"
+
+
+def build_postcode_index(paths):
+    # Later files override earlier ones for the same code
+    rows = {}
+    for path in [os.path.join(POSTCODE_DIR, "areas.csv")] + list(paths):
+        with open(path, newline="") as csv_file:
+            for row in csv.DictReader(csv_file):
+                code = " ".join(row["code"].upper().split())
+                region = row["region"].strip()
+                if len(region.encode()) > POSTCODE_INDEX_DTYPE["region"].itemsize:
+                    raise ValueError(f"Region name too long for the index: {region}")
+                rows[code] = (region, float(row["latitude"]), float(row["longitude"]))
+
+    table = np.array([(code.encode(), region.encode(), latitude, longitude)
+                      for code, (region, latitude, longitude) in sorted(rows.items())], dtype=POSTCODE_INDEX_DTYPE)
+
+    # One file written under a name of its own and renamed over the old one, so open maps stay valid
+    # and builders running at once never share a temporary file
+    path = os.path.join(POSTCODE_DIR, "index.npy")
+    temporary_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    with open(temporary_path, "wb") as index_file:
+        np.save(index_file, table)
+    os.replace(temporary_path, path)
+
+    return len(table)
+
+
+def ensure_postcode_index():
+    # Builds the index from the bundled areas when there is none or it is in an older format
+    try:
+        if np.load(os.path.join(POSTCODE_DIR, "index.npy"), mmap_mode="r").dtype == POSTCODE_INDEX_DTYPE:
+            return
+    except FileNotFoundError:
+        pass
+    build_postcode_index([])
+
+
+def open_postcode_index():
+    path = os.path.join(POSTCODE_DIR, "index.npy")
+    mtime = os.stat(path).st_mtime_ns
+    if mtime != postcode_index["mtime"]:
+        table = np.load(path, mmap_mode="r")
+        postcode_index.update(table=table, codes=table["code"], mtime=mtime)
+
+    return postcode_index
+
+
+ensure_postcode_index()
+
+
+def normalise_postcode(postcode):
+    # "b152tt" -> "B15 2TT", None when it is not a UK postcode
+    match = POSTCODE_PATTERN.match("".join((postcode or "").split()).upper())
+
+    return f"{match.group(1)} {match.group(2)}" if match else None
+
+
+@lru_cache(maxsize=65536)
+def lookup_postcode(postcode, index_mtime):
+    outward, inward = postcode.split()
+    sector = f"{outward} {inward[0]}"
+    area = outward[:2] if outward[:2].isalpha() else outward[:1]
+
+    codes = postcode_index["codes"]
+    for code, precision in ((sector, "sector"), (outward, "district"), (area, "area")):
+        position = int(np.searchsorted(codes, code.encode()))
+        if position < len(codes) and codes[position] == code.encode():
+            row = postcode_index["table"][position]
+            return PostcodeLocation(postcode, sector, outward, area, row["region"].decode(),
+                                    round(float(row["latitude"]), 4), round(float(row["longitude"]), 4), precision)
+
+    return None
+
+
+def resolve_postcode(postcode):
+    # PostcodeLocation for a valid postcode in a known area, otherwise None
+    normalised = normalise_postcode(postcode)
+    if normalised is None:
+        return None
+
+    return lookup_postcode(normalised, open_postcode_index()["mtime"])
+
+
+def distance_km(latitude, longitude, latitudes, longitudes):
+    # Great-circle distances from one point to arrays of points
+    latitude, longitude, latitudes, longitudes = map(np.radians, (latitude, longitude, latitudes, longitudes))
+    a = (np.sin((latitudes - latitude) / 2) ** 2 +
+         np.cos(latitude) * np.cos(latitudes) * np.sin((longitudes - longitude) / 2) ** 2)
+
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
+
+
+@app.cli.command("build-postcode-index")
+@click.argument("csv_paths", nargs=-1, type=click.Path(exists=True, dir_okay=False))
+def build_postcode_index_command(csv_paths):
+    """Rebuild the postcode index from the bundled areas plus district/sector CSVs (code,region,latitude,longitude)."""
+    click.echo(f"Indexed {build_postcode_index(csv_paths)} postcode codes")
+    lookup_postcode.cache_clear()
+
+
+#   Installer Capacity
+# Each active installer can take daily_jobs visits on their working days. The calendar is held in
+# memory as an installers x days matrix of remaining visits for CAPACITY_HORIZON_DAYS, with skill
+# and service-area lookups, so slot searches never touch the database. Reservations are checked
+# again in SQL inside the booking transaction, which is what keeps them atomic
+CAPACITY_HORIZON_DAYS = 180
+
+installer_calendar_lock = threading.Lock()
+installer_calendar = {"first_day": None, "jobs_version": None, "config_version": None}
+
+
+def load_installer_config(cursor, first_day):
+    cursor.execute("SELECT id, working_days, daily_jobs, home_postcode FROM installers WHERE active ORDER BY id")
+    installers = cursor.fetchall()
+    installer_ids = np.array([row[0] for row in installers], dtype=np.int64)
+
+    # Home centroids for picking the nearest installer, NaN where the postcode is not known
+    homes = [resolve_postcode(row[3]) for row in installers]
+    home_latitudes = np.array([home.latitude if home else np.nan for home in homes])
+    home_longitudes = np.array([home.longitude if home else np.nan for home in homes])
+
+    # Capacity on each working day of the horizon, before any jobs
+    weekdays = (np.arange(CAPACITY_HORIZON_DAYS) + first_day.weekday()) % 7
+    working = np.array([[day == "1" for day in (row[1] + "0000000")[:7]] for row in installers],
+                       dtype=bool).reshape(len(installers), 7)
+    capacity = np.where(working[:, weekdays], np.array([row[2] for row in installers])[:, None], 0).astype(np.int16)
+
+    cursor.execute("SELECT installer_id, day FROM installer_days_off WHERE day >= ? AND day < ?",
+                   (first_day.isoformat(), (first_day + timedelta(days=CAPACITY_HORIZON_DAYS)).isoformat()))
+    for installer_id, day in cursor.fetchall():
+        position = np.searchsorted(installer_ids, installer_id)
+        if position < len(installer_ids) and installer_ids[position] == installer_id:
+            capacity[position, (date.fromisoformat(day) - first_day).days] = 0
+
+    cursor.execute("SELECT day FROM blackout_days WHERE day >= ? AND day < ?",
+                   (first_day.isoformat(), (first_day + timedelta(days=CAPACITY_HORIZON_DAYS)).isoformat()))
+    capacity[:, [(date.fromisoformat(row[0]) - first_day).days for row in cursor.fetchall()]] = 0
+
+    cursor.execute("SELECT installer_id, product_id FROM installer_skills")
+    skills = {}
+    for installer_id, product_id in cursor.fetchall():
+        skills.setdefault(product_id, set()).add(installer_id)
+
+    cursor.execute("SELECT area, installer_id FROM installer_areas")
+    areas = {}
+    for area, installer_id in cursor.fetchall():
+        areas.setdefault(area, set()).add(installer_id)
+
+    # Sets of ids become sorted row positions in the matrix
+    def positions(ids):
+        ids = np.array(sorted(ids), dtype=np.int64)
+        return np.searchsorted(installer_ids, ids[np.isin(ids, installer_ids)])
+
+    return {
+        "installer_ids": installer_ids,
+        "home_latitudes": home_latitudes,
+        "home_longitudes": home_longitudes,
+        "capacity": capacity,
+        "skills": {product_id: positions(ids) for product_id, ids in skills.items()},
+        "areas": {area: positions(ids) for area, ids in areas.items()}
+    }
+
+
+def load_installer_jobs(cursor, installer_ids, first_day):
+    # Visits already reserved per installer and day in the horizon
+    jobs = np.zeros((len(installer_ids), CAPACITY_HORIZON_DAYS), dtype=np.int16)
+    cursor.execute("""
+        SELECT installer_id, day, COUNT(*) FROM installer_jobs
+        WHERE day >= ? AND day < ?
+        GROUP BY installer_id, day
+    """, (first_day.isoformat(), (first_day + timedelta(days=CAPACITY_HORIZON_DAYS)).isoformat()))
+    rows = cursor.fetchall()
+    if not rows or not len(installer_ids):
+        return jobs
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    days = np.array([(date.fromisoformat(row[1]) - first_day).days for row in rows])
+    counts = np.array([row[2] for row in rows], dtype=np.int16)
+    positions = np.minimum(np.searchsorted(installer_ids, ids), len(installer_ids) - 1)
+    known = installer_ids[positions] == ids  # Jobs of installers since deactivated are left out
+    jobs[positions[known], days[known]] = counts[known]
+
+    return jobs
+
+
+def get_installer_calendar(cursor):
+    # The in-memory calendar, refreshed when jobs or installers change or the day rolls over. A refresh
+    # builds a new calendar and swaps the reference, so callers holding the old one never see it change
+    global installer_calendar
+
+    cursor.execute("SELECT jobs_version, config_version FROM capacity_version")
+    jobs_version, config_version = cursor.fetchone()
+    first_day = datetime.now().date()
+
+    calendar = installer_calendar
+    if (calendar["first_day"], calendar["jobs_version"], calendar["config_version"]) == (first_day, jobs_version,
+                                                                                          config_version):
+        return calendar
+
+    with installer_calendar_lock:
+        calendar = installer_calendar
+        if (calendar["first_day"], calendar["jobs_version"], calendar["config_version"]) == (first_day, jobs_version,
+                                                                                              config_version):
+            return calendar
+
+        if calendar["first_day"] != first_day or calendar["config_version"] != config_version:
+            config = load_installer_config(cursor, first_day)
+        else:
+            config = {key: calendar[key] for key in ("installer_ids", "home_latitudes", "home_longitudes",
+                                                     "capacity", "skills", "areas")}
+        calendar = dict(config, first_day=first_day, jobs_version=jobs_version, config_version=config_version,
+                        availability={})
+        calendar["remaining"] = calendar["capacity"] - load_installer_jobs(cursor, calendar["installer_ids"],
+                                                                           first_day)
+        installer_calendar = calendar
+
+    return calendar
+
+
+def candidate_installers(calendar, product_id, location):
+    # Row positions of installers with the skill who cover the location's sector, district or area
+    empty = np.empty(0, dtype=np.int64)
+    if location is None:
+        return empty
+
+    covering = [calendar["areas"].get(code, empty) for code in (location.sector, location.district, location.area)]
+
+    return np.intersect1d(np.concatenate(covering), calendar["skills"].get(product_id, empty))
+
+
+def postcode_covered(cursor, location):
+    # Whether any installer covers the location, whatever their skills
+    areas = get_installer_calendar(cursor)["areas"]
+
+    return location is not None and any(code in areas for code in (location.sector, location.district, location.area))
+
+
+def find_available_days(cursor, product_id, location, earliest, count):
+    # Earliest days on or after earliest with an installer free, as (date, installers free) pairs
+    calendar = get_installer_calendar(cursor)
+    offset = max((earliest - calendar["first_day"]).days, 0)
+    candidates = candidate_installers(calendar, product_id, location)
+    free = (calendar["remaining"][candidates, offset:] > 0).sum(axis=0)
+    days = np.flatnonzero(free)[:count]
+
+    return [(calendar["first_day"] + timedelta(days=int(offset + day)), int(free[day])) for day in days]
+
+
+def month_availability(calendar, product_id, location, month):
+    # Bit n is set when day n + 1 of the month has an installer free. Bitmaps are shared by every
+    # postcode with the same covering areas and live until the calendar next changes
+    availability = calendar["availability"]
+    remaining = calendar["remaining"]
+    coverage = tuple(code for code in (location.sector, location.district, location.area) if code in calendar["areas"])
+    key = (product_id, coverage, month)
+
+    bitmap = availability.get(key)
+    if bitmap is None:
+        days = ((month + timedelta(days=32)).replace(day=1) - month).days
+        offsets = np.arange(days) + (month - calendar["first_day"]).days
+        bookable = (offsets > 0) & (offsets < CAPACITY_HORIZON_DAYS)  # From tomorrow to the horizon
+        free = np.zeros(days, dtype=bool)
+        free[bookable] = (remaining[candidate_installers(calendar, product_id, location)][:, offsets[bookable]]
+                          > 0).any(axis=0)
+        bitmap = availability[key] = int((free.astype(np.int64) << np.arange(days)).sum())
+
+    return bitmap
+
+
+def capacity_modelled(cursor):
+    # Until installers are set up, bookings are taken without capacity checks as before
+    return len(get_installer_calendar(cursor)["installer_ids"]) > 0
+
+
+def reserve_installer(cursor, product_id, location, day, consultation_id, booking_id=None):
+    # Reserves a visit with the nearest free installer; call inside the booking's write transaction
+    calendar = get_installer_calendar(cursor)
+    offset = (day - calendar["first_day"]).days
+    if location is None or not 0 <= offset < CAPACITY_HORIZON_DAYS:
+        return None
+
+    candidates = candidate_installers(calendar, product_id, location)
+    candidates = candidates[calendar["remaining"][candidates, offset] > 0]
+    distances = np.nan_to_num(distance_km(location.latitude, location.longitude,
+                                          calendar["home_latitudes"][candidates],
+                                          calendar["home_longitudes"][candidates]), nan=np.inf)
+    for position in candidates[np.argsort(distances, kind="stable")].tolist():
+        installer_id = int(calendar["installer_ids"][position])
+        cursor.execute("""
+            INSERT INTO installer_jobs (installer_id, day, consultation_id, booking_id)
+            SELECT ?, ?, ?, ?
+            WHERE (SELECT COUNT(*) FROM installer_jobs WHERE installer_id = ? AND day = ?)
+                < (SELECT daily_jobs FROM installers WHERE id = ? AND active)
+            AND NOT EXISTS (SELECT 1 FROM installer_days_off WHERE installer_id = ? AND day = ?)
+            AND NOT EXISTS (SELECT 1 FROM blackout_days WHERE day = ?)
+        """, (installer_id, day.isoformat(), consultation_id, booking_id, installer_id, day.isoformat(),
+              installer_id, installer_id, day.isoformat(), day.isoformat()))
+        if cursor.rowcount:
+            return installer_id
+
+    return None
+
+
+def unavailable_message(cursor, product_id, location, day):
+    if (day - datetime.now().date()).days >= CAPACITY_HORIZON_DAYS:
+        return "Visits can only be booked up to six months ahead"
+
+    available = find_available_days(cursor, product_id, location, day - timedelta(days=14), 60)
+    # Suggest the free days nearest to the one asked for
+    nearest = sorted((abs((free_day - day).days), free_day) for free_day, _ in available
+                     if free_day > datetime.now().date())[:3]
+    if not nearest:
+        return "No installers cover your postcode for this product in the next six months"
+
+    return (f"No installers are free on {day.strftime('%d/%m/%Y')}. Nearest available dates: "
+            f"{', '.join(free_day.strftime('%d/%m/%Y') for _, free_day in sorted(nearest, key=lambda pair: pair[1]))}")
+
+
+@app.route("/api/slots", methods=["GET"])
+def available_slots():
+    product = request.args.get("product", "")
+    postcode = request.args.get("postcode", "")
+    count = request.args.get("count", 5, type=int)
+    earliest = request.args.get("from", "")
+
+    try:
+        earliest = date.fromisoformat(earliest) if earliest else datetime.now().date() + timedelta(days=1)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    if not 1 <= count <= 60:
+        return jsonify({"success": False, "error": "Count must be between 1 and 60"}), 400
+
+    location = resolve_postcode(postcode)
+    if location is None:
+        return jsonify({"success": False, "error": "Enter a valid UK postcode"}), 400
+
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        cursor.execute("SELECT id FROM products WHERE type = ? OR CAST(id AS TEXT) = ?", (product, product))
+        product_row = cursor.fetchone()
+        if not product_row:
+            return jsonify({"success": False, "error": "Product not found"}), 404
+
+        earliest = max(earliest, datetime.now().date() + timedelta(days=1))
+        days = find_available_days(cursor, product_row[0], location, earliest, count)
+
+        return jsonify({
+            "success": True,
+            "dates": [{"date": day.isoformat(), "installers": installers} for day, installers in days]
+        })
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"})
+    finally:
+        database.close()
+
+
+@app.route("/api/availability", methods=["GET"])
+def availability_calendar():
+    product = request.args.get("product", "")
+    postcode = request.args.get("postcode", "")
+
+    try:
+        month = datetime.strptime(request.args.get("month", ""), "%Y-%m").date()
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid month format. Use YYYY-MM"}), 400
+
+    location = resolve_postcode(postcode)
+    if location is None:
+        return jsonify({"success": False, "error": "Enter a valid UK postcode"}), 400
+
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        cursor.execute("SELECT id FROM products WHERE type = ? OR CAST(id AS TEXT) = ?", (product, product))
+        product_row = cursor.fetchone()
+        if not product_row:
+            return jsonify({"success": False, "error": "Product not found"}), 404
+
+        calendar = get_installer_calendar(cursor)
+        days = ((month + timedelta(days=32)).replace(day=1) - month).days
+        if len(calendar["installer_ids"]):
+            bitmap = month_availability(calendar, product_row[0], location, month)
+        else:
+            # Without installers set up every day after today can be booked
+            first = min(max((calendar["first_day"] - month).days + 1, 0), days)
+            bitmap = (1 << days) - (1 << first)
+
+        return jsonify({"success": True, "month": month.strftime("%Y-%m"), "days": days, "bitmap": bitmap})
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"})
+    finally:
+        database.close()
+
+
+@app.route("/api/postcode", methods=["GET"])
+def check_postcode():
+    location = resolve_postcode(request.args.get("postcode", ""))
+    if location is None:
+        return jsonify({"success": False, "error": "Enter a valid UK postcode, for example B15 2TT"})
+
+    database = sqlite3.connect("database.db")
+    try:
+        covered = postcode_covered(database.cursor(), location) or not capacity_modelled(database.cursor())
+    finally:
+        database.close()
+
+    return jsonify({
+        "success": True,
+        "postcode": location.postcode,
+        "region": location.region,
+        "latitude": location.latitude,
+        "longitude": location.longitude,
+        "covered": covered
+    })
+
+
+def bump_capacity_config(cursor):
+    cursor.execute("UPDATE capacity_version SET config_version = config_version + 1")
+
+
+@app.cli.command("import-installers")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+def import_installers_command(csv_path):
+    """Add installers from a CSV of name,home_postcode,skills,areas,working_days,daily_jobs.
+
+    skills are product types and areas are postcode areas, districts or sectors, both separated by ";".
+    """
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("SELECT type, id FROM products")
+        products = dict(cursor.fetchall())
+
+        with open(csv_path, newline="") as csv_file:
+            rows = list(csv.DictReader(csv_file))
+
+        cursor.execute("BEGIN IMMEDIATE")
+        for row in rows:
+            skills = [skill.strip() for skill in row["skills"].split(";") if skill.strip()]
+            unknown = [skill for skill in skills if skill not in products]
+            if unknown:
+                raise click.ClickException(f"Unknown product for {row['name']}: {', '.join(unknown)}")
+
+            cursor.execute("""
+                INSERT INTO installers (name, home_postcode, working_days, daily_jobs)
+                VALUES (?, ?, ?, ?)
+            """, (row["name"].strip(), row["home_postcode"].strip().upper(),
+                  (row.get("working_days") or "1111100").strip(), int(row.get("daily_jobs") or 2)))
+            installer_id = cursor.lastrowid
+            cursor.executemany("INSERT INTO installer_skills (installer_id, product_id) VALUES (?, ?)",
+                               [(installer_id, products[skill]) for skill in skills])
+            cursor.executemany("INSERT OR IGNORE INTO installer_areas (area, installer_id) VALUES (?, ?)",
+                               [(" ".join(area.upper().split()), installer_id)
+                                for area in row["areas"].split(";") if area.strip()])
+
+        bump_capacity_config(cursor)
+        database.commit()
+        click.echo(f"Imported {len(rows)} installers")
+    finally:
+        database.close()
+
+
+@app.cli.command("installer-day-off")
+@click.argument("installer_id", type=int)
+@click.argument("day", type=click.DateTime(formats=["%Y-%m-%d"]))
+def installer_day_off_command(installer_id, day):
+    """Mark an installer as unavailable on a day."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("INSERT OR IGNORE INTO installer_days_off (installer_id, day) VALUES (?, ?)",
+                       (installer_id, day.date().isoformat()))
+        bump_capacity_config(cursor)
+        database.commit()
+
+        cursor.execute("SELECT COUNT(*) FROM installer_jobs WHERE installer_id = ? AND day = ?",
+                       (installer_id, day.date().isoformat()))
+        click.echo(f"Day off recorded; {cursor.fetchone()[0]} visits already booked that day need moving")
+    finally:
+        database.close()
+
+
+@app.cli.command("blackout-day")
+@click.argument("day", type=click.DateTime(formats=["%Y-%m-%d"]))
+@click.option("--reason", default="", help="Shown to staff, such as the bank holiday's name")
+def blackout_day_command(day, reason):
+    """Stop any visits being booked on a day."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("INSERT OR REPLACE INTO blackout_days (day, reason) VALUES (?, ?)",
+                       (day.date().isoformat(), reason))
+        bump_capacity_config(cursor)
+        database.commit()
+
+        cursor.execute("SELECT COUNT(*) FROM installer_jobs WHERE day = ?", (day.date().isoformat(),))
+        click.echo(f"Blackout recorded; {cursor.fetchone()[0]} visits already booked that day need moving")
+    finally:
+        database.close()
+
+
+#   Installer Routing
+# Plans each installer's day: jobs without an installer go to the nearest one with the skill, the area
+# and capacity left, then every route is ordered by nearest neighbour from home and improved with 2-opt, keeping each
+# visit inside its start window. Regions are planned independently in a process pool
+ROUTE_SPEED_KMH = 40
+ROUTE_DAY_START = 8 * 60  # Minutes after midnight
+ROUTE_DAY_END = 18 * 60
+# Duration in minutes and the window the visit must start in, by kind of job
+ROUTE_JOB_KINDS = {
+    "consultation": (60, 9 * 60, 16 * 60),
+    "installation": (300, 8 * 60, 10 * 60 + 30),
+    "maintenance": (90, 8 * 60, 16 * 60),
+}
+
+
+def route_schedule(order, distances, durations, earliest, latest):
+    # Arrival and start minutes along a route whose stop 0 is home, and whether every window holds
+    arrivals, starts = [], []
+    clock = ROUTE_DAY_START
+    for previous, stop in zip([0] + order[:-1], order):
+        arrival = clock + distances[previous, stop] / ROUTE_SPEED_KMH * 60
+        start = max(arrival, earliest[stop])
+        arrivals.append(arrival)
+        starts.append(start)
+        clock = start + durations[stop]
+
+    feasible = all(start <= latest[stop] for start, stop in zip(starts, order)) and clock <= ROUTE_DAY_END
+
+    return arrivals, starts, feasible
+
+
+def order_route(distances, durations, earliest, latest):
+    # Stops 1..n of a home-first distance matrix, nearest neighbour then 2-opt
+    count = len(distances) - 1
+    unvisited = np.ones(count + 1, dtype=bool)
+    unvisited[0] = False
+    order, current = [], 0
+    for _ in range(count):
+        # Among reachable stops prefer the nearest, but never pass a window that is about to close
+        candidates = np.flatnonzero(unvisited)
+        urgency = latest[candidates] - earliest[candidates]
+        nearest = candidates[np.lexsort((distances[current, candidates], urgency > 120))][0]
+        order.append(int(nearest))
+        unvisited[nearest] = False
+        current = nearest
+
+    # 2-opt: score every segment reversal at once, apply the best feasible improvement, repeat
+    improved = True
+    while improved and count > 2:
+        improved = False
+        tour = np.array([0] + order)
+        i, j = np.triu_indices(count + 1, k=2)
+        after_j = np.where(j + 1 <= count, tour[np.minimum(j + 1, count)], 0)
+        delta = (distances[tour[i], tour[j]] + distances[tour[i + 1], after_j] -
+                 distances[tour[i], tour[i + 1]] - distances[tour[j], after_j])
+        # The return leg home is not driven on the clock, so reversals touching it count only their own legs
+        delta = np.where(j == count, distances[tour[i], tour[j]] - distances[tour[i], tour[i + 1]], delta)
+        for move in np.argsort(delta):
+            if delta[move] >= -1e-9:
+                break
+            candidate = order[:i[move]] + order[i[move]:j[move]][::-1] + order[j[move]:]
+            if route_schedule(candidate, distances, durations, earliest, latest)[2]:
+                order, improved = candidate, True
+                break
+
+    return order
+
+
+def plan_region_routes(region, installers, jobs):
+    # installers: (id, latitude, longitude, spare visits); jobs: (id, kind, latitude, longitude, installer id or 0,
+    # ids of the installers who may take it). Returns route rows and the ids of jobs that could not be fitted in
+    installer_ids = np.array([installer[0] for installer in installers], dtype=np.int64)
+    spare = np.array([installer[3] for installer in installers], dtype=np.int64)
+    job_ids = np.array([job[0] for job in jobs], dtype=np.int64)
+    assigned = np.array([job[4] for job in jobs], dtype=np.int64)
+
+    latitudes = np.array([installer[1] for installer in installers] + [job[2] for job in jobs])
+    longitudes = np.array([installer[2] for installer in installers] + [job[3] for job in jobs])
+    distances = distance_km(latitudes[:, None], longitudes[:, None], latitudes[None, :], longitudes[None, :])
+    home_to_job = distances[:len(installers), len(installers):]
+
+    # Unassigned jobs, longest first, go to the nearest installer with a visit and the time to spare
+    durations = np.array([ROUTE_JOB_KINDS[job[1]][0] for job in jobs])
+    travel_minutes = home_to_job / ROUTE_SPEED_KMH * 60
+    spare_minutes = np.full(len(installers), ROUTE_DAY_END - ROUTE_DAY_START, dtype=np.float64)
+    for job in np.flatnonzero(assigned).tolist():
+        spare_minutes[installer_ids == assigned[job]] -= durations[job]
+    for job in np.flatnonzero(assigned == 0)[np.argsort(-durations[assigned == 0], kind="stable")].tolist():
+        available = np.flatnonzero(np.isin(installer_ids, jobs[job][5]) & (spare > 0) &
+                                   (spare_minutes >= durations[job] + travel_minutes[:, job]))
+        if len(available):
+            nearest = available[np.argmin(home_to_job[available, job])]
+            assigned[job] = installer_ids[nearest]
+            spare[nearest] -= 1
+            spare_minutes[nearest] -= durations[job] + travel_minutes[nearest, job]
+
+    rows, unplanned = [], job_ids[assigned == 0].tolist()
+    for position, installer_id in enumerate(installer_ids.tolist()):
+        stops = np.flatnonzero(assigned == installer_id)
+        if not len(stops):
+            continue
+
+        points = np.concatenate([[position], len(installers) + stops])
+        route_distances = distances[np.ix_(points, points)]
+        route_durations = np.concatenate([[0], durations[stops]])
+        earliest = np.array([0] + [ROUTE_JOB_KINDS[jobs[stop][1]][1] for stop in stops.tolist()])
+        latest = np.array([ROUTE_DAY_END] + [ROUTE_JOB_KINDS[jobs[stop][1]][2] for stop in stops.tolist()])
+
+        order = order_route(route_distances, route_durations, earliest, latest)
+        # Drop the stops that make the day impossible, last first, and report them
+        while order and not route_schedule(order, route_distances, route_durations, earliest, latest)[2]:
+            unplanned.append(int(job_ids[stops[order.pop() - 1]]))
+        arrivals, starts, _ = route_schedule(order, route_distances, route_durations, earliest, latest)
+
+        for sequence, (stop, arrival, start) in enumerate(zip(order, arrivals, starts)):
+            previous = order[sequence - 1] if sequence else 0
+            rows.append((installer_id, sequence, int(job_ids[stops[stop - 1]]), int(arrival), int(start),
+                         round(float(route_distances[previous, stop]), 1)))
+
+    return region, rows, unplanned
+
+
+def load_day_jobs(cursor, day):
+    # Installers working on day and the day's jobs with kinds and coordinates, grouped by region
+    cursor.execute("""
+        SELECT i.id, i.home_postcode, i.daily_jobs, i.working_days,
+               (SELECT COUNT(*) FROM installer_jobs j WHERE j.installer_id = i.id AND j.day = ?)
+        FROM installers i
+        WHERE i.active AND NOT EXISTS (SELECT 1 FROM installer_days_off d WHERE d.installer_id = i.id AND d.day = ?)
+    """, (day.isoformat(), day.isoformat()))
+    installers, home_regions = {}, {}
+    for installer_id, home_postcode, daily_jobs, working_days, booked in cursor.fetchall():
+        home = resolve_postcode(home_postcode)
+        if home and (working_days + "0000000")[day.weekday()] == "1":
+            installers.setdefault(home.region, []).append((installer_id, home.latitude, home.longitude,
+                                                           max(daily_jobs - booked, 0)))
+            home_regions[installer_id] = home.region
+
+    calendar = get_installer_calendar(cursor)
+
+    # Reserved visits plus bookings and consultations from before capacity was tracked
+    cursor.execute("""
+        SELECT j.id, j.installer_id, CASE WHEN b.id IS NULL THEN 'consultation'
+               WHEN b.maintenance THEN 'maintenance' ELSE 'installation' END, c.postcode, c.product_id
+        FROM installer_jobs j
+        JOIN consultations c ON c.id = j.consultation_id
+        LEFT JOIN bookings b ON b.id = j.booking_id
+        WHERE j.day = ?
+        UNION ALL
+        SELECT -b.id, 0, CASE WHEN b.maintenance THEN 'maintenance' ELSE 'installation' END, c.postcode,
+               c.product_id
+        FROM bookings b
+        JOIN consultations c ON c.id = b.consultation_id
+        WHERE b.date_booked = ? AND NOT EXISTS (SELECT 1 FROM installer_jobs j WHERE j.booking_id = b.id)
+        UNION ALL
+        SELECT -1000000000 - c.id, 0, 'consultation', c.postcode, c.product_id
+        FROM consultations c
+        WHERE c.preferred_date = ? AND c.status = 'approved'
+        AND NOT EXISTS (SELECT 1 FROM installer_jobs j WHERE j.consultation_id = c.id AND j.booking_id IS NULL)
+    """, (day.isoformat(), day.isoformat(), day.isoformat()))
+
+    jobs, unlocated = {}, []
+    for job_id, installer_id, kind, postcode, product_id in cursor.fetchall():
+        location = resolve_postcode(postcode)
+        if location is None:
+            unlocated.append(job_id)
+            continue
+        # Reserved jobs are planned with their installer, the rest in the region they are in
+        region = home_regions.get(installer_id, location.region) if installer_id else location.region
+        if installer_id and installer_id not in home_regions:
+            installer_id = 0  # Installer no longer working that day
+        # Jobs without an installer may only go to one with the product's skill who covers the postcode
+        eligible = () if installer_id else tuple(
+            calendar["installer_ids"][candidate_installers(calendar, product_id, location)].tolist())
+        jobs.setdefault(region, []).append((job_id, kind, location.latitude, location.longitude, installer_id,
+                                            eligible))
+
+    return installers, jobs, unlocated
+
+
+def store_day_routes(cursor, day, rows):
+    # Replaces the day's routes and records installers for jobs that had none
+    cursor.execute("DELETE FROM installer_routes WHERE day = ?", (day.isoformat(),))
+    for installer_id, sequence, job_id, arrival, start, travel_km in rows:
+        if job_id < -1000000000:  # Consultation visit without a reservation
+            cursor.execute("INSERT INTO installer_jobs (installer_id, day, consultation_id) VALUES (?, ?, ?)",
+                           (installer_id, day.isoformat(), -1000000000 - job_id))
+            job_id = cursor.lastrowid
+        elif job_id < 0:  # Booking without a reservation
+            cursor.execute("""
+                INSERT INTO installer_jobs (installer_id, day, consultation_id, booking_id)
+                SELECT ?, ?, consultation_id, id FROM bookings WHERE id = ?
+            """, (installer_id, day.isoformat(), -job_id))
+            job_id = cursor.lastrowid
+        else:
+            cursor.execute("UPDATE installer_jobs SET installer_id = ? WHERE id = ?", (installer_id, job_id))
+
+        cursor.execute("""
+            INSERT INTO installer_routes (installer_id, day, position, job_id, arrival_minute, start_minute, travel_km)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (installer_id, day.isoformat(), sequence, job_id, arrival, start, travel_km))
+
+
+def replan_routes_later(cursor, day):
+    # Days that already have routes are planned again by a worker once the change commits
+    cursor.execute("SELECT 1 FROM installer_routes WHERE day = ? LIMIT 1", (day.isoformat(),))
+    if cursor.fetchone():
+        enqueue_job(cursor, "plan_routes", {"day": day.isoformat()})
+
+
+def plan_day_routes(day, workers):
+    # Plans and stores every region's routes for day, returning per-region results and unlocated jobs
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        installers, jobs, unlocated = load_day_jobs(cursor, day)
+
+        regions = sorted(jobs)
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(plan_region_routes, regions, [installers.get(region, []) for region in regions],
+                                    [jobs[region] for region in regions]))
+
+        cursor.execute("BEGIN IMMEDIATE")
+        store_day_routes(cursor, day, [row for _, rows, _ in results for row in rows])
+        database.commit()
+    finally:
+        database.close()
+
+    return results, unlocated
+
+
+@app.cli.command("plan-routes")
+@click.option("--day", type=click.DateTime(formats=["%Y-%m-%d"]), default=None, help="Day to plan, default tomorrow")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Worker processes")
+def plan_routes_command(day, workers):
+    """Assign the day's visits to installers and order each installer's route."""
+    results, unlocated = plan_day_routes(day.date() if day else datetime.now().date() + timedelta(days=1), workers)
+
+    for region, rows, unplanned in results:
+        click.echo(f"{region}: {len(rows)} visits on {len({row[0] for row in rows})} routes, "
+                   f"{sum(row[5] for row in rows):.0f} km, {len(unplanned)} not planned")
+    if unlocated:
+        click.echo(f"{len(unlocated)} jobs have postcodes that could not be located")
+
+
 #   Submit Consultation Request
+PROPERTY_TYPES = ("residential", "commercial")  # The options on the consultation form
+
+
 @app.route("/submit-consultation", methods=["POST"])
 def submit_consultation():
     data = request.get_json()  # Get JSON data from the request
@@ -248,6 +1713,9 @@ def submit_consultation():
         if not customer:
             return jsonify({"success": False, "error": "User not in session"})
 
+        if property_type not in PROPERTY_TYPES:
+            return jsonify({"success": False, "error": "Property type must be residential or commercial"})
+
         # Ensure full_name contains only letters/spaces
         if not all(char.isalpha() or char.isspace() for char in full_name):
             return jsonify({"success": False, "error": "Full name must contain only letters and spaces, no numbers"})
@@ -256,9 +1724,11 @@ def submit_consultation():
         if not full_name.strip() or not any(char.isalpha() for char in full_name):
             return jsonify({"success": False, "error": "Full name must contain at least one letter, not just spaces"})
 
-        # Ensure postcode is 8 characters or fewer
-        if len(postcode) > 8:
-            return jsonify({"success": False, "error": "Postcode must be 8 characters or less"})
+        # Resolve the postcode so it is stored in one canonical form
+        location = resolve_postcode(postcode)
+        if location is None:
+            return jsonify({"success": False, "error": "Enter a valid UK postcode, for example B15 2TT"})
+        postcode = location.postcode
 
         # Ensure preferred date is after today
         today = datetime.now().date()
@@ -277,6 +1747,9 @@ def submit_consultation():
         product_id = product[0]
         customer_id = customer[0]
 
+        # Capacity check and reservation happen under one write lock
+        cursor.execute("BEGIN IMMEDIATE")
+
         # Update full_name in the customers table
         cursor.execute("""
         UPDATE customers
@@ -286,10 +1759,27 @@ def submit_consultation():
 
         # Insert consultation details into database
         cursor.execute("""
-        INSERT INTO consultations (product_id, preferred_date, postcode, property_type, status, customer_id)
-        VALUES (?, ?, ?, ?, ?, ?)
-        """, (product_id, preferred_date, postcode, property_type, "approved", customer_id))
+        INSERT INTO consultations (product_id, preferred_date, postcode, region, property_type, status, customer_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (product_id, preferred_date, postcode, location.region, property_type, "pending", customer_id))
+        consultation_id = cursor.lastrowid
+
+        # Reserve an installer for the consultation visit
+        if capacity_modelled(cursor) and reserve_installer(cursor, product_id, location, date_data,
+                                                           consultation_id) is None:
+            database.rollback()
+            return jsonify({"success": False, "error": unavailable_message(cursor, product_id, location, date_data)})
+
+        # Follow-up work is queued in the same transaction and run by the job workers
+        enqueue_job(cursor, "notify_customer", {
+            "customer_id": customer_id,
+            "subject": "We have your consultation request",
+            "body": f"Your {product_type.lower()} consultation request for {date_data:%d %B %Y} in {postcode} "
+                    f"is with our team, and we will email you once it is confirmed."
+        })
+        replan_routes_later(cursor, date_data)
 
+        publish_consultation_change(cursor, customer_id, "created", consultation_id)
         database.commit()
         # Return JSON with redirect URL instead of redirect
         return jsonify({"success": True, "redirect": url_for("dashboard")})
@@ -307,13 +1797,19 @@ def cancel_consultation():
     consultation_id = request.form.get("consultation_id")
     if not consultation_id:
         return jsonify({"success": False, "error": "Consultation id required"})
+
+    # Ensure consultation_id is an integer
+    try:
+        consultation_id = int(consultation_id)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid consultation ID"})
     try:
         database = sqlite3.connect("database.db")
         cursor = database.cursor()
 
         # Fetch consultation details for cancellation message
         cursor.execute("""
-            SELECT c.status, p.type
+            SELECT c.status, p.type, c.customer_id, c.preferred_date
             FROM consultations c
             JOIN products p ON c.product_id = p.id
             WHERE c.id = ? AND c.customer_id = (SELECT id FROM customers WHERE email = ?)
@@ -323,14 +1819,8 @@ def cancel_consultation():
         if not consultation:
             return jsonify({"success": False, "error": "Consultation not found or does not belong to you"})
 
-        status, product_type = consultation
-
-        # Determine request_type based on status
-        request_type = "Enquiry"
-        if status == "Installation Scheduled":
-            request_type = "Installation"
-        elif status == "Maintenance Scheduled":
-            request_type = "Maintenance"
+        status, product_type, customer_id, preferred_date = consultation
+        request_type = get_request_type(status)
 
         # Delete related bookings
         cursor.execute(
@@ -341,14 +1831,25 @@ def cancel_consultation():
         cursor.execute(
             "DELETE FROM consultations WHERE id = ? AND customer_id = (SELECT id FROM customers WHERE email = ?)",
             (consultation_id, session["user"]))
-        database.commit()
 
-        # Store cancellation details in session
-        session["last_cancellation"] = {
+        enqueue_job(cursor, "notify_customer", {
+            "customer_id": customer_id,
+            "subject": f"Your {request_type.lower()} has been cancelled",
+            "body": f"Your {product_type.lower()} {request_type.lower()} has been cancelled."
+        })
+        replan_routes_later(cursor, date.fromisoformat(preferred_date))
+
+        last_cancellation = {
             "request_type": request_type,
             "product_type": product_type,
             "timestamp": datetime.now().strftime("%H:%M:%S")
         }
+        publish_consultation_change(cursor, customer_id, "cancelled", consultation_id,
+                                    last_cancellation=last_cancellation)
+        database.commit()
+
+        # Store cancellation details in session
+        session["last_cancellation"] = last_cancellation
         return jsonify({"success": True, "message": "Consultation successfully cancelled"})
     except Exception as error:
         return jsonify({"success": False, "error": f"An error occurred: {error}"})
@@ -388,9 +1889,10 @@ def schedule_request():
         database = sqlite3.connect("database.db")
         cursor = database.cursor()
 
-        # Verify the consultation exists
+        # Verify the consultation exists, holding the write lock until the visit is reserved
+        cursor.execute("BEGIN IMMEDIATE")
         cursor.execute("""
-            SELECT status FROM consultations
+            SELECT status, product_id, postcode FROM consultations
             WHERE id = ? AND customer_id = (SELECT id FROM customers WHERE email = ?)
         """, (consultation_id, session["user"]))
         consultation = cursor.fetchone()
@@ -422,6 +1924,15 @@ def schedule_request():
             VALUES (?, ?, ?, ?, ?)
         """, (customer_id, consultation_id, is_maintenance, schedule_date, "Scheduled"))
 
+        # Reserve an installer for the visit
+        _, product_id, postcode = consultation
+        location = resolve_postcode(postcode)
+        if capacity_modelled(cursor) and reserve_installer(cursor, product_id, location, date_data, consultation_id,
+                                                           booking_id=cursor.lastrowid) is None:
+            database.rollback()
+            return jsonify({"success": False,
+                            "error": unavailable_message(cursor, product_id, location, date_data)}), 409
+
         # Update the consultation status and date
         cursor.execute("""
             UPDATE consultations
@@ -429,6 +1940,14 @@ def schedule_request():
             WHERE id = ?
         """, (status, schedule_date, consultation_id))
 
+        enqueue_job(cursor, "notify_customer", {
+            "customer_id": customer_id,
+            "subject": f"Your {service_type} is booked",
+            "body": f"Your {service_type} is booked for {date_data:%d %B %Y}."
+        })
+        replan_routes_later(cursor, date_data)
+        publish_consultation_change(cursor, customer_id, "updated", consultation_id)
+
         database.commit()
         return jsonify({"success": True, "message": f"{service_type.capitalize()} successfully scheduled"})
     except Exception as error:
@@ -437,26 +1956,628 @@ def schedule_request():
         database.close()
 
 
-#   Consultations API
-@app.route("/api/consultations", methods=["GET"])
-def get_consultations():
-    if "user" not in session:
-        return render_template("login.html", error="You must be logged in to continue")
-    try:
-        database = sqlite3.connect("database.db")
-        cursor = database.cursor()
+#   Staff Consultation Queue
+# New consultations wait as "pending" until staff approve or reject them. The queue pages by
+# (preferred_date, id) so each page is an index range scan on the pending-only indexes, and bulk
+# actions are single set-based statements inside one transaction
+STAFF_PAGE_SIZE = 50
+STAFF_MAX_PAGE_SIZE = 500
+STAFF_MAX_BULK = 1000
+STAFF_ACTIONS = {"approve": "approved", "reject": "rejected"}
+
+# What the customer is told after each bulk action, filled with the product and visit date
+STAFF_NOTICES = {
+    "approve": ("Your consultation has been approved",
+                "Your {product} consultation on {day:%d %B %Y} is confirmed."),
+    "reject": ("Your consultation has been rejected",
+               "We are sorry, we cannot take on your {product} consultation on {day:%d %B %Y}."),
+    "reassign": ("Your consultation has a new installer",
+                 "Your {product} consultation on {day:%d %B %Y} will now be with a different installer; "
+                 "the date is unchanged.")
+}
 
-        # Fetch customer id
-        cursor.execute("SELECT id FROM customers WHERE email = ?", (session["user"],))
-        customer = cursor.fetchone()
 
-        if not customer:
-            return jsonify({"success": False, "error": "Customer not found"})
+@app.route("/api/staff/consultations", methods=["GET"])
+def staff_consultation_queue():
+    if not staff_authorised():
+        return jsonify({"success": False, "error": "Invalid staff API key"}), 401
 
-        customer_id = customer[0]
+    limit = request.args.get("limit", STAFF_PAGE_SIZE, type=int)
+    if not 1 <= limit <= STAFF_MAX_PAGE_SIZE:
+        return jsonify({"success": False, "error": f"Limit must be between 1 and {STAFF_MAX_PAGE_SIZE}"}), 400
+
+    # The cursor is the preferred date and id of the last row on the previous page
+    after = request.args.get("after", "")
+    try:
+        after_date, after_id = after.split(",") if after else ("", "0")
+        after_id = int(after_id)
+        if after_date:
+            date.fromisoformat(after_date)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        conditions = ["c.status = 'pending'", "(c.preferred_date, c.id) > (?, ?)"]
+        parameters = [after_date, after_id]
+        if request.args.get("product"):
+            product = request.args["product"]
+            cursor.execute("SELECT id FROM products WHERE type = ? OR CAST(id AS TEXT) = ?", (product, product))
+            product_row = cursor.fetchone()
+            if not product_row:
+                return jsonify({"success": False, "error": "Product not found"}), 404
+            conditions.append("c.product_id = ?")
+            parameters.append(product_row[0])
+        if request.args.get("region"):
+            conditions.append("c.region = ?")
+            parameters.append(request.args["region"])
+        if request.args.get("property_type"):
+            conditions.append("c.property_type = ?")
+            parameters.append(request.args["property_type"])
+
+        cursor.execute(f"""
+            SELECT c.id, c.preferred_date, p.type, c.postcode, c.region, c.property_type, c.customer_id,
+                   cu.full_name, j.installer_id
+            FROM consultations c
+            JOIN products p ON p.id = c.product_id
+            JOIN customers cu ON cu.id = c.customer_id
+            LEFT JOIN installer_jobs j ON j.consultation_id = c.id AND j.booking_id IS NULL
+            WHERE {" AND ".join(conditions)}
+            ORDER BY c.preferred_date, c.id
+            LIMIT ?
+        """, parameters + [limit + 1])
+        rows = cursor.fetchall()
+
+        consultations = [{
+            "id": row[0],
+            "preferred_date": row[1],
+            "product_type": row[2],
+            "postcode": row[3],
+            "region": row[4],
+            "property_type": row[5],
+            "customer_id": row[6],
+            "full_name": row[7],
+            "installer_id": row[8],
+        } for row in rows[:limit]]
+        next_cursor = f"{rows[limit - 1][1]},{rows[limit - 1][0]}" if len(rows) > limit else None
+
+        return jsonify({"success": True, "consultations": consultations, "next": next_cursor})
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"}), 500
+    finally:
+        database.close()
+
+
+def reassign_consultation_visits(cursor, id_list, installer_id):
+    # Moves the pending consultations' visits to installer_id, returning why the move can't stand.
+    # Returns None for the moved ids when there is no such active installer
+    cursor.execute("SELECT working_days, daily_jobs FROM installers WHERE id = ? AND active", (installer_id,))
+    installer = cursor.fetchone()
+    if not installer:
+        return None, ["Installer not found or inactive"]
+    calendar = get_installer_calendar(cursor)
+    position = int(np.searchsorted(calendar["installer_ids"], installer_id))
+    if position == len(calendar["installer_ids"]) or calendar["installer_ids"][position] != installer_id:
+        position = -1  # Not in the calendar, so no consultation is within their skills and areas
+
+    cursor.execute("""
+        UPDATE installer_jobs SET installer_id = ?
+        WHERE booking_id IS NULL AND consultation_id IN (
+            SELECT id FROM consultations WHERE status = 'pending' AND id IN (SELECT value FROM json_each(?))
+        )
+        RETURNING consultation_id, day
+    """, (installer_id, id_list))
+    moved = cursor.fetchall()
+    days = sorted({day for _, day in moved})
+
+    # Reservations are normally counted by the insert and delete triggers
+    cursor.execute("UPDATE capacity_version SET jobs_version = jobs_version + 1")
+
+    working_days = (installer[0] + "0000000")[:7]
+    problems = [f"{day} is not a working day" for day in days if working_days[date.fromisoformat(day).weekday()]
+                != "1"]
+    cursor.execute("""
+        SELECT day, COUNT(*) FROM installer_jobs
+        WHERE installer_id = ? AND day IN (SELECT value FROM json_each(?))
+        GROUP BY day HAVING COUNT(*) > ?
+    """, (installer_id, json.dumps(days), installer[1]))
+    problems.extend(f"{day} would have {count} visits" for day, count in cursor.fetchall())
+    cursor.execute("""
+        SELECT day FROM installer_days_off WHERE installer_id = ? AND day IN (SELECT value FROM json_each(?))
+        UNION SELECT day FROM blackout_days WHERE day IN (SELECT value FROM json_each(?))
+    """, (installer_id, json.dumps(days), json.dumps(days)))
+    problems.extend(f"{row[0]} is a day off" for row in cursor.fetchall())
+
+    # The same skill and area rules as a new reservation
+    cursor.execute("SELECT id, product_id, postcode FROM consultations WHERE id IN (SELECT value FROM json_each(?))",
+                   (json.dumps([consultation_id for consultation_id, _ in moved]),))
+    for consultation_id, product_id, postcode in cursor.fetchall():
+        if position not in candidate_installers(calendar, product_id, resolve_postcode(postcode)):
+            problems.append(f"Consultation {consultation_id} needs a skill or area the installer doesn't cover")
+
+    return [consultation_id for consultation_id, _ in moved], sorted(problems)
+
+
+@app.route("/api/staff/consultations/bulk", methods=["POST"])
+def staff_bulk_action():
+    if not staff_authorised():
+        return jsonify({"success": False, "error": "Invalid staff API key"}), 401
+
+    data = request.get_json(silent=True) or {}
+    action = data.get("action")
+    consultation_ids = data.get("consultation_ids")
+
+    if action not in ("approve", "reject", "reassign"):
+        return jsonify({"success": False, "error": "Action must be approve, reject or reassign"}), 400
+    if not isinstance(consultation_ids, list) or not 1 <= len(consultation_ids) <= STAFF_MAX_BULK \
+            or not all(isinstance(consultation_id, int) for consultation_id in consultation_ids):
+        return jsonify({"success": False,
+                        "error": f"consultation_ids must be a list of 1 to {STAFF_MAX_BULK} ids"}), 400
+    if action == "reassign" and not isinstance(data.get("installer_id"), int):
+        return jsonify({"success": False, "error": "installer_id is required to reassign"}), 400
+
+    id_list = json.dumps(consultation_ids)
+    try:
+        database = sqlite3.connect("database.db", timeout=30)
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+
+        if action == "reassign":
+            changed, problems = reassign_consultation_visits(cursor, id_list, data["installer_id"])
+            if changed is None:
+                database.rollback()
+                return jsonify({"success": False, "error": problems[0]}), 404
+            if problems:
+                database.rollback()
+                return jsonify({"success": False, "error": "The installer can't take these visits",
+                                "problems": problems}), 409
+
+            cursor.execute("""
+                SELECT id, customer_id, (SELECT type FROM products WHERE id = product_id), preferred_date
+                FROM consultations WHERE id IN (SELECT value FROM json_each(?))
+            """, (json.dumps(changed),))
+            rows = cursor.fetchall()
+        else:
+            # Only rows still pending change, so repeating a request or racing another reviewer is harmless
+            cursor.execute("""
+                UPDATE consultations SET status = ?
+                WHERE status = 'pending' AND id IN (SELECT value FROM json_each(?))
+                RETURNING id, customer_id, (SELECT type FROM products WHERE id = product_id), preferred_date
+            """, (STAFF_ACTIONS[action], id_list))
+            rows = cursor.fetchall()
+
+            if action == "reject":
+                # Rejected visits give their installer capacity back; jobs for bookings are left alone
+                cursor.execute("""
+                    DELETE FROM installer_jobs
+                    WHERE booking_id IS NULL AND consultation_id IN (SELECT value FROM json_each(?))
+                """, (json.dumps([row[0] for row in rows]),))
+
+        subject, body = STAFF_NOTICES[action]
+        for _, customer_id, product_type, preferred_date in rows:
+            enqueue_job(cursor, "notify_customer", {
+                "customer_id": customer_id,
+                "subject": subject,
+                "body": body.format(product=product_type.lower(), day=date.fromisoformat(preferred_date))
+            })
+        # One replan per day however many of its visits changed
+        for visit_date in sorted({row[3] for row in rows}):
+            replan_routes_later(cursor, date.fromisoformat(visit_date))
+
+        for row in rows:
+            publish_consultation_change(cursor, row[1], "updated", row[0])
+
+        database.commit()
+
+        return jsonify({"success": True, "updated": len(rows),
+                        "skipped": len(set(consultation_ids)) - len(rows)})
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"}), 500
+    finally:
+        database.close()
+
+
+@app.cli.command("backfill-regions")
+def backfill_regions_command():
+    """Fill in the region of consultations stored before regions were recorded."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("SELECT id, postcode FROM consultations WHERE region IS NULL")
+        rows = [(location.region, consultation_id) for consultation_id, location in
+                ((consultation_id, resolve_postcode(postcode)) for consultation_id, postcode in cursor.fetchall())
+                if location is not None]
+
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany("UPDATE consultations SET region = ? WHERE id = ?", rows)
+        database.commit()
+    finally:
+        database.close()
+
+    click.echo(f"Set the region of {len(rows)} consultations")
+
+
+#   Staff Search
+# Every word typed must prefix a word in the consultation's customer name, email, postcode,
+# property type or product. Results are ordered by bm25 rank then id, and the cursor carries
+# both so later pages continue from the last row without an OFFSET
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_TERMS = 8
+
+
+def search_match_expression(query):
+    # Each word becomes a quoted prefix term, so user input can never be read as FTS5 syntax
+    terms = re.findall(r"[^\W_]+", query.lower())[:SEARCH_MAX_TERMS]
+
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+@app.route("/api/staff/search", methods=["GET"])
+def staff_search():
+    if not staff_authorised():
+        return jsonify({"success": False, "error": "Invalid staff API key"}), 401
+
+    match = search_match_expression(request.args.get("q", ""))
+    if not match:
+        return jsonify({"success": False, "error": "Enter a name, email, postcode or product to search for"}), 400
+
+    limit = request.args.get("limit", SEARCH_PAGE_SIZE, type=int)
+    if not 1 <= limit <= STAFF_MAX_PAGE_SIZE:
+        return jsonify({"success": False, "error": f"Limit must be between 1 and {STAFF_MAX_PAGE_SIZE}"}), 400
+
+    after = request.args.get("after", "")
+    try:
+        after_rank, after_id = (float(after.split(",")[0]), int(after.split(",")[1])) if after else (None, 0)
+    except (ValueError, IndexError):
+        return jsonify({"success": False, "error": "Invalid cursor"}), 400
+
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        conditions = ["consultation_search MATCH ?"]
+        parameters = [match]
+        if after_rank is not None:
+            conditions.append("(rank > ? OR (rank = ? AND rowid > ?))")
+            parameters.extend([after_rank, after_rank, after_id])
+
+        cursor.execute(f"""
+            SELECT s.rowid, s.rank, f.full_name, f.email, f.postcode, f.property_type, f.product,
+                   c.preferred_date, c.status
+            FROM (
+                -- Rank every match but read the stored text back only for the page
+                SELECT rowid, rank FROM consultation_search
+                WHERE {" AND ".join(conditions)}
+                ORDER BY rank, rowid
+                LIMIT ?
+            ) s
+            JOIN consultation_search f ON f.rowid = s.rowid
+            JOIN consultations c ON c.id = s.rowid
+            ORDER BY s.rank, s.rowid
+        """, parameters + [limit + 1])
+        rows = cursor.fetchall()
+
+        results = [{
+            "id": row[0],
+            "full_name": row[2],
+            "email": row[3],
+            "postcode": row[4],
+            "property_type": row[5],
+            "product_type": row[6],
+            "preferred_date": row[7],
+            "status": row[8],
+        } for row in rows[:limit]]
+        # repr keeps every digit of the rank so the next page starts exactly after this one
+        next_cursor = f"{rows[limit - 1][1]!r},{rows[limit - 1][0]}" if len(rows) > limit else None
+
+        return jsonify({"success": True, "results": results, "next": next_cursor})
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"}), 500
+    finally:
+        database.close()
+
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Rebuild the staff search index from the consultations and customers tables."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM consultation_search")
+        cursor.execute("""
+            INSERT INTO consultation_search (rowid, full_name, email, postcode, property_type, product)
+            SELECT c.id, cu.full_name, cu.email, c.postcode, c.property_type, p.type
+            FROM consultations c
+            JOIN customers cu ON cu.id = c.customer_id
+            JOIN products p ON p.id = c.product_id
+        """)
+        indexed = cursor.rowcount
+        cursor.execute("INSERT INTO consultation_search (consultation_search) VALUES ('optimize')")
+        database.commit()
+    finally:
+        database.close()
+
+    click.echo(f"Indexed {indexed} consultations")
+
+
+#   Analytics Replica
+# Batch jobs read a copy of database.db, so long scans don't hold read transactions against the file
+# serving logins and bookings. The operations report reads small summary tables and stays on database.db,
+# so staff always see current counts. refresh_replica copies with the online backup API a few pages at
+# a time into a temporary file that is renamed over the replica when complete, holding a lock file so
+# the CLI and the periodic job never copy at once. Readers open the replica immutable; a rename never
+# changes a file they already have open
+ANALYTICS_REPLICA = os.getenv("ANALYTICS_REPLICA", "analytics.db")
+REPLICA_PAGES_PER_STEP = 256
+REPLICA_STEP_SLEEP = 0.002
+REPLICA_MAX_LAG_SECONDS = 3600
+
+
+def replica_lag():
+    # Seconds since the snapshot the replica holds was taken, or None without a replica
+    try:
+        return max(0.0, time.time() - os.stat(ANALYTICS_REPLICA).st_mtime)
+    except FileNotFoundError:
+        return None
+
+
+def refresh_replica():
+    # Returns pages copied and seconds taken, or None when another refresh holds the lock
+    import fcntl
+
+    with open(f"{ANALYTICS_REPLICA}.lock", "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+
+        # Copies left by a refresh that died can go, since none can be running now
+        directory, prefix = os.path.split(os.path.abspath(ANALYTICS_REPLICA))
+        for entry in os.scandir(directory):
+            if entry.name.startswith(f"{prefix}.") and entry.name.endswith(".tmp"):
+                os.remove(entry.path)
+
+        return copy_replica(f"{ANALYTICS_REPLICA}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+def copy_replica(temporary):
+    source = sqlite3.connect("file:database.db?mode=ro", uri=True, timeout=30, isolation_level=None)
+    target = sqlite3.connect(temporary)
+    try:
+        # Every step reads from one snapshot. Without it the backup restarts whenever another connection
+        # commits, and may never finish on a busy database; in WAL mode the open read doesn't block writers
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        started = time.time()
+        source.backup(target, pages=REPLICA_PAGES_PER_STEP, sleep=REPLICA_STEP_SLEEP)
+        source.execute("ROLLBACK")
+
+        # The copy inherits WAL mode; a plain journal lets mode=ro readers open it without a -shm file
+        target.execute("PRAGMA journal_mode = DELETE")
+        pages = target.execute("PRAGMA page_count").fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+    # The modified time records when the snapshot was taken, which replica_lag measures from
+    os.utime(temporary, (started, started))
+    os.replace(temporary, ANALYTICS_REPLICA)
+
+    return pages, time.time() - started
+
+
+def analytics_connection():
+    # Read-only connection for batch jobs; falls back to database.db when the replica is stale
+    lag = replica_lag()
+    if lag is not None and lag <= REPLICA_MAX_LAG_SECONDS:
+        return sqlite3.connect(f"file:{ANALYTICS_REPLICA}?mode=ro&immutable=1", uri=True)
+
+    return sqlite3.connect("file:database.db?mode=ro", uri=True, timeout=30)
+
+
+@app.route("/api/replica/metrics", methods=["GET"])
+def replica_metrics():
+    if not staff_authorised():
+        return jsonify({"success": False, "error": "Invalid staff API key"}), 401
+
+    lag = replica_lag()
+    return jsonify({"success": True, "metrics": {
+        "lag_seconds": round(lag, 3) if lag is not None else None,
+        "stale": lag is None or lag > REPLICA_MAX_LAG_SECONDS,
+        "size_bytes": os.path.getsize(ANALYTICS_REPLICA) if lag is not None else 0
+    }})
+
+
+@app.cli.command("refresh-replica")
+def refresh_replica_command():
+    """Copy database.db into the read-only analytics replica."""
+    copied = refresh_replica()
+    if copied is None:
+        click.echo("Another replica refresh is running")
+        return
+    click.echo(f"Copied {copied[0]} pages in {copied[1]:.1f}s")
+
+
+#   Operations Reports
+# Consultation and booking counts are read from consultation_stats and booking_stats, which the
+# triggers in SCHEMA keep current, so a report scans a few summary rows per week however many
+# consultations there are. reconcile_report_stats recounts from the live tables to correct drift
+REPORT_DIMENSIONS = {
+    "week": "s.week",
+    "product": "p.type",
+    "status": "s.status",
+    "property_type": "s.property_type",
+    "area": "s.area",
+    "kind": "s.kind",  # Bookings only
+}
+REPORT_MAX_WEEKS = 156
+
+
+def reconcile_summary(cursor, table, count_column, keys, expected_query):
+    # Makes table match expected_query's counts, returning how many rows were wrong
+    cursor.execute("DROP TABLE IF EXISTS temp.expected_stats")
+    cursor.execute(f"CREATE TEMP TABLE expected_stats AS SELECT * FROM {table} WHERE false")
+    cursor.execute(f"INSERT INTO temp.expected_stats {expected_query}")
+    cursor.execute(f"CREATE UNIQUE INDEX temp.expected_stats_keys ON expected_stats ({', '.join(keys)})")
+
+    cursor.execute(f"""
+        INSERT INTO {table} ({", ".join(keys)}, {count_column})
+        SELECT * FROM temp.expected_stats WHERE true
+        ON CONFLICT DO UPDATE SET {count_column} = excluded.{count_column}
+        WHERE {count_column} != excluded.{count_column}
+    """)
+    corrected = cursor.rowcount
+
+    cursor.execute(f"""
+        DELETE FROM {table} WHERE {count_column} != 0 AND NOT EXISTS (
+            SELECT 1 FROM temp.expected_stats e WHERE {" AND ".join(f"e.{key} = {table}.{key}" for key in keys)}
+        )
+    """)
+    corrected += cursor.rowcount
+    cursor.execute(f"DELETE FROM {table} WHERE {count_column} = 0")
+    cursor.execute("DROP TABLE temp.expected_stats")
+
+    return corrected
+
+
+def reconcile_report_stats(cursor):
+    corrected = reconcile_summary(cursor, "consultation_stats", "consultations", CONSULTATION_STATS_KEYS, f"""
+        SELECT {consultation_stats_key("c")}, COUNT(*)
+        FROM consultations c
+        GROUP BY 1, 2, 3, 4, 5
+    """)
+    corrected += reconcile_summary(cursor, "booking_stats", "bookings", BOOKING_STATS_KEYS, f"""
+        SELECT {booking_stats_key("b", "c")}, COUNT(*)
+        FROM bookings b
+        JOIN consultations c ON c.id = b.consultation_id
+        GROUP BY 1, 2, 3, 4, 5, 6
+    """)
+    cursor.execute("INSERT INTO report_reconciliations (reconciled_time, corrected_rows) VALUES (?, ?)",
+                   (int(time.time()), corrected))
+
+    return corrected
+
+
+def summary_report(cursor, table, count_column, group_by, filters, first_week, last_week):
+    # Sums one summary table over a week range, grouped by the dimensions it has
+    dimensions = [name for name in group_by if name != "kind" or table == "booking_stats"]
+    conditions, parameters = ["s.week >= ?", "s.week <= ?"], [first_week.isoformat(), last_week.isoformat()]
+    for name, value in filters.items():
+        if name != "kind" or table == "booking_stats":
+            conditions.append(f"{REPORT_DIMENSIONS[name]} = ?")
+            parameters.append(value)
+
+    columns = ", ".join(REPORT_DIMENSIONS[name] for name in dimensions)
+    cursor.execute(f"""
+        SELECT {columns + ", " if columns else ""}SUM(s.{count_column}) FROM {table} s
+        JOIN products p ON p.id = s.product_id
+        WHERE {" AND ".join(conditions)}
+        {"GROUP BY " + columns if columns else ""}
+        HAVING SUM(s.{count_column}) != 0
+        {"ORDER BY " + columns if columns else ""}
+    """, parameters)
+
+    return [dict(zip(dimensions + ["count"], row)) for row in cursor.fetchall()]
+
+
+@app.route("/api/reports/operations", methods=["GET"])
+def operations_report():
+    if not staff_authorised():
+        return jsonify({"success": False, "error": "Invalid staff API key"}), 401
+
+    group_by = [name for name in request.args.get("group_by", "week,product").split(",") if name]
+    if any(name not in REPORT_DIMENSIONS for name in group_by):
+        return jsonify({"success": False,
+                        "error": f"group_by can include {', '.join(REPORT_DIMENSIONS)}"}), 400
+    filters = {name: request.args[name] for name in REPORT_DIMENSIONS if name != "week" and request.args.get(name)}
+
+    try:
+        today = datetime.now().date()
+        first_week = date.fromisoformat(request.args["from"]) if request.args.get("from") \
+            else today - timedelta(weeks=12)
+        last_week = date.fromisoformat(request.args["to"]) if request.args.get("to") else today + timedelta(weeks=26)
+    except ValueError:
+        return jsonify({"success": False, "error": "Invalid date format. Use YYYY-MM-DD"}), 400
+
+    first_week -= timedelta(days=first_week.weekday())
+    last_week -= timedelta(days=last_week.weekday())
+    if not 0 <= (last_week - first_week).days // 7 < REPORT_MAX_WEEKS:
+        return jsonify({"success": False, "error": f"Reports cover up to {REPORT_MAX_WEEKS} weeks"}), 400
+
+    try:
+        database = sqlite3.connect("file:database.db?mode=ro", uri=True, timeout=30)
+        cursor = database.cursor()
+
+        consultations = summary_report(cursor, "consultation_stats", "consultations", group_by, filters,
+                                       first_week, last_week)
+        bookings = summary_report(cursor, "booking_stats", "bookings", group_by, filters, first_week, last_week)
+        cursor.execute("SELECT MAX(reconciled_time) FROM report_reconciliations")
+        reconciled_time = cursor.fetchone()[0]
+
+        return jsonify({
+            "success": True,
+            "from": first_week.isoformat(),
+            "to": last_week.isoformat(),
+            "group_by": group_by,
+            "consultations": consultations,
+            "bookings": bookings,
+            "reconciled_time": reconciled_time
+        })
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"}), 500
+    finally:
+        database.close()
+
+
+@app.route("/operations")
+def operations_page():
+    return render_template("operations.html")
+
+
+@app.cli.command("reconcile-reports")
+def reconcile_reports_command():
+    """Recount the operations report summaries from the consultations and bookings tables."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        corrected = reconcile_report_stats(cursor)
+        database.commit()
+    finally:
+        database.close()
+
+    click.echo(f"Corrected {corrected} summary rows")
+
+
+#   Consultations API
+@app.route("/api/consultations", methods=["GET"])
+def get_consultations():
+    if "user" not in session:
+        return render_template("login.html", error="You must be logged in to continue")
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        # Fetch customer id
+        customer_id = get_session_customer_id(cursor)
+
+        if customer_id is None:
+            return jsonify({"success": False, "error": "Customer not found"})
+
+        # Answer unchanged requests from the version counter alone
+        version, modified_time = get_customer_version(cursor, customer_id)
+        etag = f"consultations-{customer_id}-{version}"
+        last_modified = datetime.fromtimestamp(modified_time, timezone.utc)
+
+        not_modified = not_modified_response(etag, last_modified)
+        if not_modified:
+            return not_modified
 
         cursor.execute("""
-            SELECT c.id, p.type, c.preferred_date, c.status
+            SELECT c.id, p.type, c.preferred_date, c.status, c.postcode
             FROM consultations c
             JOIN products p ON c.product_id = p.id
             WHERE c.customer_id = ?
@@ -471,17 +2592,54 @@ def get_consultations():
                 "product_type": row[1],
                 "date_scheduled": row[2],
                 "status": row[3],
+                "postcode": row[4],
             }
 
             consultation_data.append(consultation)
 
-        return jsonify({"success": True, "consultations": consultation_data})
+        return set_validators(jsonify({"success": True, "consultations": consultation_data}), etag, last_modified)
     except Exception as error:
         return jsonify({"success": False, "error": f"An error occurred: {error}"})
     finally:
         database.close()
 
 
+#   Dashboard Events Stream (Server-Sent Events)
+@app.route("/api/events", methods=["GET"])
+def dashboard_events():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "You must be logged in to continue"}), 401
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        cursor.execute("SELECT id FROM customers WHERE email = ?", (session["user"],))
+        customer = cursor.fetchone()
+    finally:
+        database.close()
+
+    if not customer:
+        return jsonify({"success": False, "error": "Customer not found"}), 404
+
+    customer_id = customer[0]
+    subscriber = subscribe_events(customer_id)
+
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=EVENT_HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    # Comment line keeps proxies open and detects closed clients
+                    yield ": heartbeat\n\n"
+        finally:
+            unsubscribe_events(customer_id, subscriber)
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 #   Dashboard Page
 @app.route("/dashboard")
 def dashboard():
@@ -504,67 +2662,40 @@ def dashboard():
         customer_id, full_name = customer
         user_name = full_name.strip() if full_name and full_name.strip() else "user"
 
-        # Fetch all consultations with product type
-        cursor.execute("""
-            SELECT p.type, c.preferred_date, c.property_type, c.status, c.id
-            FROM consultations c
-            JOIN products p ON c.product_id = p.id
-            WHERE c.customer_id = ?
-            ORDER BY c.preferred_date ASC
-        """, (customer_id,))
-        consultations = cursor.fetchall()
+        # Get cancellation details from session if available
+        last_cancellation = session.get("last_cancellation")
 
-        # Prepare consultation data
-        consultation_data = []
+        # The page also depends on today's date, so validators roll over at midnight
         today = datetime.now().date()
-        next_consultation = None
-        latest_consultation = None
-
-        for row in consultations:
-            product_type, preferred_date, property_type, status, consultation_id = row
-            date_obj = datetime.strptime(preferred_date, "%Y-%m-%d")
-            formatted_date = date_obj.strftime("%d/%m/%Y")
+        version, modified_time = get_customer_version(cursor, customer_id)
+        etag = f"dashboard-{customer_id}-{version}-{today.isoformat()}"
+        last_modified = max(datetime.fromtimestamp(modified_time, timezone.utc),
+                            datetime.combine(today, datetime.min.time()).astimezone(timezone.utc))
 
-            # Determine request_type based on status
-            request_type = "Enquiry"
-            if status == "Installation Scheduled":
-                request_type = "Installation"
-            elif status == "Maintenance Scheduled":
-                request_type = "Maintenance"
+        if not last_cancellation:
+            not_modified = not_modified_response(etag, last_modified)
+            if not_modified:
+                return not_modified
 
-            consultation = {
-                "product_id": product_type,
-                "request_type": request_type,
-                "property_type": property_type,
-                "date_scheduled": formatted_date,
-                "status": status,
-                "consultation_id": consultation_id,
-                "date_obj": date_obj
-            }
-            consultation_data.append(consultation)
-
-            # Next closest
-            if date_obj.date() > today and next_consultation is None:
-                next_consultation = consultation
-
-            # Latest updated
-            if latest_consultation is None or date_obj > latest_consultation["date_obj"]:
-                latest_consultation = consultation
-
-        # Get cancellation details from session if available
-        last_cancellation = session.get("last_cancellation")
+        consultation_data, next_consultation, latest_consultation = fetch_dashboard_consultations(
+            cursor, customer_id)
 
-        # Clear the cancellation message after rendering to prevent repeated display
-        if last_cancellation:
-            session.pop("last_cancellation", None)
-        return render_template(
+        response = Response(render_template(
             "dashboard.html",
             consultations=consultation_data,
             user_name=user_name,
             next_consultation=next_consultation,
             latest_consultation=latest_consultation,
             last_cancellation=last_cancellation
-        )
+        ))
+
+        # Clear the cancellation message after rendering to prevent repeated display
+        if last_cancellation:
+            session.pop("last_cancellation", None)
+            response.cache_control.no_store = True
+            return response
+
+        return set_validators(response, etag, last_modified)
     except Exception as error:
         print(f"Exception occurred: {error}")
         return render_template("dashboard.html", error=f"An error occurred: {error}", consultations=[])
@@ -596,118 +2727,2880 @@ def get_products():
     return jsonify(product_data)
 
 
-#   Energy Usage
-@app.route("/api/energy-usage", methods=["GET"])
-def track_energy_usage():
-    # Generate current week data
-    today = datetime.now().date()
-    dates = []
-    for x in range(6, -1, -1): dates.append(today - timedelta(days=x))
+#   Energy Readings Store
+# Half-hourly energy use in whole Wh, stored as one row per customer per UTC day holding
+# 48 little-endian int32 slots (-1 where no reading), so a year is 365 rows rather than 17520
+READING_INTERVAL_SECONDS = 1800
+READING_BLOCK_SECONDS = 86400
+READING_SLOTS = READING_BLOCK_SECONDS // READING_INTERVAL_SECONDS
+MISSING_WH = -1
+NATIONAL_AVERAGE_DAILY_KWH = 7.4  # 2700 kWh per year
+
+
+def load_reading_blocks(cursor, block_keys):
+    # Returns {(customer_id, day_start): slot array} for the stored blocks among block_keys
+    blocks = {}
+    block_keys = [(int(customer_id), int(day_start)) for customer_id, day_start in block_keys]
+    for offset in range(0, len(block_keys), 400):
+        chunk = block_keys[offset:offset + 400]
+        cursor.execute(f"""
+            WITH keys (customer_id, day_start) AS (VALUES {", ".join(["(?, ?)"] * len(chunk))})
+            SELECT m.customer_id, m.day_start, m.wh
+            FROM keys k
+            JOIN meter_readings m ON m.customer_id = k.customer_id AND m.day_start = k.day_start
+        """, [value for key in chunk for value in key])
+        for customer_id, day_start, wh in cursor.fetchall():
+            blocks[(customer_id, day_start)] = np.frombuffer(wh, dtype="<i4")
+
+    return blocks
+
+
+def store_meter_readings(cursor, customer_ids, timestamps, wh_values):
+    # customer_ids may be a single id or one per reading; later readings for a half hour win
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    wh_values = np.asarray(wh_values, dtype=np.int64)
+    customer_ids = np.broadcast_to(np.asarray(customer_ids, dtype=np.int64), timestamps.shape)
+    if not len(timestamps):
+        return
+
+    # Keep the last value given for each customer and half hour
+    slot_times = timestamps - timestamps % READING_INTERVAL_SECONDS
+    keys = np.stack([customer_ids[::-1], slot_times[::-1]], axis=1)
+    keys, last_index = np.unique(keys, axis=0, return_index=True)
+    wh_values = wh_values[::-1][last_index]
+    customer_ids, slot_times = keys[:, 0], keys[:, 1]
+
+    # Merge into the stored day blocks
+    day_starts = slot_times - slot_times % READING_BLOCK_SECONDS
+    slots = (slot_times - day_starts) // READING_INTERVAL_SECONDS
+    block_keys, block_index = np.unique(np.stack([customer_ids, day_starts], axis=1), axis=0,
+                                        return_inverse=True)
+    block_index = block_index.reshape(-1)
+
+    stored = load_reading_blocks(cursor, block_keys.tolist())
+    blocks = np.full((len(block_keys), READING_SLOTS), MISSING_WH, dtype="<i4")
+    for position, key in enumerate(map(tuple, block_keys.tolist())):
+        if key in stored:
+            blocks[position] = stored[key]
+
+    # Days that have been archived are brought back into the hot table whole. The archive index says
+    # which days those are, since archive-readings --days can archive newer days than ARCHIVE_AFTER_DAYS
+    archived_ranges = {}
+    for position, (customer_id, day_start) in enumerate(block_keys.tolist()):
+        if (customer_id, day_start) in stored:
+            continue
+        if customer_id not in archived_ranges:
+            archived_ranges[customer_id] = archived_day_range(customer_id)
+        first_day, last_day = archived_ranges[customer_id]
+        if first_day is not None and first_day <= day_start <= last_day:
+            archived_days, archived_blocks = fetch_archived_blocks(customer_id, day_start, day_start + 1)
+            if len(archived_days):
+                blocks[position] = archived_blocks[0]
+
+    # Rollups move by the difference from whatever was stored, so late corrections net out
+    previous = blocks[block_index, slots].astype(np.int64)
+    was_missing = previous == MISSING_WH
+    apply_rollup_deltas(cursor, customer_ids, slot_times, wh_values - np.where(was_missing, 0, previous),
+                        was_missing.astype(np.int64))
+    blocks[block_index, slots] = wh_values
+
+    cursor.executemany("""
+        INSERT INTO meter_readings (customer_id, day_start, wh)
+        VALUES (?, ?, ?)
+        ON CONFLICT (customer_id, day_start) DO UPDATE SET wh = excluded.wh
+    """, [(customer_id, day_start, block.tobytes())
+          for (customer_id, day_start), block in zip(block_keys.tolist(), blocks)])
+
+    # Lets results computed from a customer's readings be cached until they change
+    cursor.executemany("""
+        INSERT INTO reading_versions (customer_id, version) VALUES (?, 1)
+        ON CONFLICT (customer_id) DO UPDATE SET version = version + 1
+    """, [(customer_id,) for customer_id in np.unique(block_keys[:, 0]).tolist()])
+
+
+def fetch_reading_blocks(cursor, customer_id, start, end):
+    # Day blocks overlapping [start, end) from the archive and the hot table, hot slots winning
+    start, end = int(start), int(end)
+    cursor.execute("""
+        SELECT day_start, wh FROM meter_readings
+        WHERE customer_id = ? AND day_start > ? AND day_start < ?
+        ORDER BY day_start
+    """, (customer_id, start - READING_BLOCK_SECONDS, end))
+    rows = cursor.fetchall()
+    day_starts = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    blocks = np.frombuffer(b"".join(row[1] for row in rows), dtype="<i4").reshape(-1, READING_SLOTS)
+
+    archived_days, archived_blocks = fetch_archived_blocks(customer_id, start - READING_BLOCK_SECONDS + 1, end)
+    if not len(archived_days):
+        return day_starts, blocks
+
+    all_days, day_index = np.unique(np.concatenate([archived_days, day_starts]), return_inverse=True)
+    merged = np.full((len(all_days), READING_SLOTS), MISSING_WH, dtype="<i4")
+    merged[day_index[:len(archived_days)]] = archived_blocks
+    hot_index = day_index[len(archived_days):]
+    merged[hot_index] = np.where(blocks != MISSING_WH, blocks, merged[hot_index])
+
+    return all_days, merged
+
+
+def get_reading_version(cursor, customer_id):
+    cursor.execute("SELECT version FROM reading_versions WHERE customer_id = ?", (customer_id,))
+    row = cursor.fetchone()
+
+    return row[0] if row else 0
+
+
+def fetch_meter_readings(cursor, customer_id, start, end):
+    # Readings in [start, end) across hot and archived storage
+    start, end = int(start), int(end)
+    day_starts, wh_values = fetch_reading_blocks(cursor, customer_id, start, end)
+    if not len(day_starts):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    timestamps = day_starts[:, None] + np.arange(READING_SLOTS, dtype=np.int64) * READING_INTERVAL_SECONDS
+    keep = (wh_values != MISSING_WH) & (timestamps >= start) & (timestamps < end)
+
+    return timestamps[keep], wh_values[keep].astype(np.int64)
+
+
+#   Readings Archive
+# Day blocks older than ARCHIVE_AFTER_DAYS move out of database.db into per-shard files:
+#   shard-NN.data       append-only zlib chunks of up to ARCHIVE_CHUNK_DAYS blocks for one customer,
+#                       holding delta-encoded day offsets followed by delta-encoded Wh slots
+#   shard-NN.index.npy  sorted (customer_id, first_day) index of the chunks, memory-mapped on read, with
+#                       the archive run that wrote each chunk so a re-archived day wins over older copies
+ARCHIVE_DIR = "archive"
+ARCHIVE_SHARDS = 64
+ARCHIVE_CHUNK_DAYS = 32
+ARCHIVE_AFTER_DAYS = 400
+ARCHIVE_INDEX_DTYPE = np.dtype([("customer_id", "<i8"), ("first_day", "<i8"), ("last_day", "<i8"),
+                                ("offset", "<i8"), ("length", "<i8"), ("days", "<i4"), ("sequence", "<i8")])
+
+archive_shards = {}  # shard -> (index mtime, index, data mmap)
+archive_lock = threading.Lock()
+
+
+def archive_paths(shard):
+    return (os.path.join(ARCHIVE_DIR, f"shard-{shard:02d}.index.npy"),
+            os.path.join(ARCHIVE_DIR, f"shard-{shard:02d}.data"))
+
+
+def upgrade_archive_index(index):
+    # Indexes written before chunks carried a sequence count as the earliest run
+    if "sequence" in index.dtype.names:
+        return index
+
+    upgraded = np.zeros(len(index), dtype=ARCHIVE_INDEX_DTYPE)
+    for name in index.dtype.names:
+        upgraded[name] = index[name]
 
-    # Generate random energy usage values (kWh)
-    user_values = []
-    for _ in range(7): user_values.append(random.randint(3, 7))
+    return upgraded
 
-    national_average = [7.4] * 7  # 2700 kWh per year
 
-    graph_stuff = {
-        "labels": [date.strftime("%d/%m") for date in dates],
-        "user_values": user_values,
-        "national_average": national_average
-    }
+def open_archive_shard(shard):
+    # Memory maps a shard's index and data, remapping when the index has been replaced
+    index_path, data_path = archive_paths(shard)
+    try:
+        index_mtime = os.stat(index_path).st_mtime_ns
+    except FileNotFoundError:
+        return None, None
 
-    # Calculate statistics and return result
-    daily_usage = user_values[-1]
-    weekly_usage = sum(user_values)
-    monthly_usage = weekly_usage * 4
-    avg_daily_usage = round(weekly_usage / len(user_values), 1)
+    with archive_lock:
+        cached = archive_shards.get(shard)
+        if cached and cached[0] == index_mtime:
+            return cached[1], cached[2]
 
-    return jsonify({
-        "success": True,
-        "graph_data": graph_stuff,
-        "daily_usage": daily_usage,
-        "weekly_usage": weekly_usage,
-        "monthly_usage": round(monthly_usage),
-        "avg_daily_usage": avg_daily_usage
-    })
+        index = upgrade_archive_index(np.load(index_path, mmap_mode="r"))
+        with open(data_path, "rb") as data_file:
+            data = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) if len(index) else b""
+        archive_shards[shard] = (index_mtime, index, data)
 
+    return index, data
 
-#   Products Page
-@app.route("/products")
-def products():
-    return render_template("products.html")
 
+def encode_archive_chunk(day_starts, blocks):
+    day_offsets = np.diff(day_starts // READING_BLOCK_SECONDS, prepend=day_starts[0] // READING_BLOCK_SECONDS)
+    values = blocks.astype(np.int64).reshape(-1)
+    value_deltas = np.diff(values, prepend=0)
 
-#   Carbon Footprint
-carbon_data = {
-    "individual": {
-        "transport_miles": 0.18294,  # kg CO₂e per mile (average UK car, 2023)
-        "electricity_kwh": 0.19338,  # kg CO₂e per kWh (UK grid average, 2023)
-        "meat_meals": 2.0,  # kg CO₂e per meat meal (general estimate)
-    },
-    "commercial": {
-        "electricity_kwh": 0.19338,  # kg CO₂e per kWh (UK grid average, 2023)
-        "gas_kwh": 0.18316,  # kg CO₂e per kWh (natural gas, 2023)
-        "waste_tonnes": 403.0  # kg CO₂e per tonne of waste (general estimate)
-    }
-}
+    return zlib.compress(day_offsets.astype("<i4").tobytes() + value_deltas.astype("<i4").tobytes(), 6)
 
 
-#   Carbon Footprint Page
-@app.route("/carbonfootprint")
-def carbon_footprint():
-    return render_template("carbonfootprint.html")
+def decode_archive_chunk(payload, first_day, days):
+    raw = np.frombuffer(zlib.decompress(payload), dtype="<i4")
+    day_starts = first_day + np.cumsum(raw[:days], dtype=np.int64) * READING_BLOCK_SECONDS
+    blocks = np.cumsum(raw[days:], dtype=np.int64).astype("<i4").reshape(days, READING_SLOTS)
 
+    return day_starts, blocks
+
+
+def fetch_archived_blocks(customer_id, start, end):
+    # Day blocks starting in [start, end), decompressing only the chunks that overlap the range
+    index, data = open_archive_shard(customer_id % ARCHIVE_SHARDS)
+    if index is None or not len(index):
+        return np.empty(0, dtype=np.int64), np.empty((0, READING_SLOTS), dtype="<i4")
+
+    customers = index["customer_id"]
+    lower = np.searchsorted(customers, customer_id, side="left")
+    upper = np.searchsorted(customers, customer_id, side="right")
+    entries = index[lower:upper]
+    entries = entries[(entries["last_day"] >= start) & (entries["first_day"] < end)]
+
+    day_parts, block_parts, sequence_parts = [], [], []
+    for entry in entries:
+        offset, length = int(entry["offset"]), int(entry["length"])
+        day_starts, blocks = decode_archive_chunk(data[offset:offset + length], int(entry["first_day"]),
+                                                  int(entry["days"]))
+        in_range = (day_starts >= start) & (day_starts < end)
+        day_parts.append(day_starts[in_range])
+        block_parts.append(blocks[in_range])
+        sequence_parts.append(np.full(int(in_range.sum()), entry["sequence"], dtype=np.int64))
+
+    if not day_parts:
+        return np.empty(0, dtype=np.int64), np.empty((0, READING_SLOTS), dtype="<i4")
+
+    # The chunk from the latest run wins when a day was archived twice
+    day_starts = np.concatenate(day_parts)
+    order = np.lexsort((np.concatenate(sequence_parts), day_starts))
+    day_starts, blocks = day_starts[order], np.concatenate(block_parts)[order]
+    latest = np.append(day_starts[1:] != day_starts[:-1], True)
+
+    return day_starts[latest], blocks[latest]
 
-@app.route("/get-carbon", methods=["POST"])
-def calculate_carbon():
-    data = request.json
-    user_type = data.get("type")  # "individual" or "commercial"
 
+def archived_day_range(customer_id):
+    # First and last archived day for a customer, read from the index alone
+    index, _ = open_archive_shard(customer_id % ARCHIVE_SHARDS)
+    if index is None:
+        return None, None
+
+    entries = index[np.searchsorted(index["customer_id"], customer_id, side="left"):
+                    np.searchsorted(index["customer_id"], customer_id, side="right")]
+    if not len(entries):
+        return None, None
+
+    return int(entries["first_day"].min()), int(entries["last_day"].max())
+
+
+def archived_customer_ids():
+    customer_ids = set()
+    for shard in range(ARCHIVE_SHARDS):
+        index, _ = open_archive_shard(shard)
+        if index is not None:
+            customer_ids.update(np.unique(index["customer_id"]).tolist())
+
+    return customer_ids
+
+
+def archive_shard_readings(database, shard, cutoff):
+    # Appends every hot block older than cutoff for the shard's customers, then removes the archived rows.
+    # Only rows still holding the archived bytes are deleted, so a late reading stored in between stays
+    # in the table (where it wins on read) and is archived by the next run
+    cursor = database.cursor()
+    cursor.execute("""
+        SELECT DISTINCT customer_id FROM meter_readings
+        WHERE day_start < ? AND customer_id % ? = ?
+    """, (cutoff, ARCHIVE_SHARDS, shard))
+    customer_ids = [row[0] for row in cursor.fetchall()]
+    if not customer_ids:
+        return 0
+
+    index_path, data_path = archive_paths(shard)
+    existing = (upgrade_archive_index(np.load(index_path)) if os.path.exists(index_path)
+                else np.empty(0, dtype=ARCHIVE_INDEX_DTYPE))
+    sequence = int(existing["sequence"].max()) + 1 if len(existing) else 1
+    entries = []
+    archived_rows = []
+    archived_days = 0
+
+    with open(data_path, "ab") as data_file:
+        offset = data_file.tell()
+        for customer_id in customer_ids:
+            cursor.execute("""
+                SELECT day_start, wh FROM meter_readings
+                WHERE customer_id = ? AND day_start < ?
+                ORDER BY day_start
+            """, (customer_id, cutoff))
+            rows = cursor.fetchall()
+
+            for chunk_start in range(0, len(rows), ARCHIVE_CHUNK_DAYS):
+                chunk = rows[chunk_start:chunk_start + ARCHIVE_CHUNK_DAYS]
+                day_starts = np.array([row[0] for row in chunk], dtype=np.int64)
+                blocks = np.frombuffer(b"".join(row[1] for row in chunk), dtype="<i4").reshape(-1, READING_SLOTS)
+                payload = encode_archive_chunk(day_starts, blocks)
+
+                data_file.write(payload)
+                entries.append((customer_id, day_starts[0], day_starts[-1], offset, len(payload), len(chunk),
+                                sequence))
+                offset += len(payload)
+            archived_days += len(rows)
+            archived_rows.extend((customer_id, day_start, wh) for day_start, wh in rows)
+
+        data_file.flush()
+        os.fsync(data_file.fileno())
+
+    # Replace the index atomically so readers only ever see complete chunks
+    index = np.concatenate([existing, np.array(entries, dtype=ARCHIVE_INDEX_DTYPE)])
+    index = index[np.lexsort((index["first_day"], index["customer_id"]))]
+    temporary_path = index_path + ".tmp"
+    with open(temporary_path, "wb") as index_file:
+        np.save(index_file, index)
+    os.replace(temporary_path, index_path)
+
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.executemany("DELETE FROM meter_readings WHERE customer_id = ? AND day_start = ? AND wh = ?",
+                       archived_rows)
+    database.commit()
+
+    return archived_days
+
+
+def archive_readings(days):
+    # Archives readings older than days into every shard, returning {shard: days archived}
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    cutoff = day_start_timestamp(datetime.now().date() - timedelta(days=days))
+    cutoff -= cutoff % READING_BLOCK_SECONDS
+
+    archived = {}
+    database = sqlite3.connect("database.db", timeout=30)
     try:
-        if user_type == "individual":
-            miles = float(data.get("transport_miles") or 0)  # Annual miles
-            kWh = float(data.get("electricity_kwh") or 0)  # Monthly kWh
-            meals = float(data.get("meat_meals") or 0)  # Weekly meals
+        for shard in range(ARCHIVE_SHARDS):
+            archived_days = archive_shard_readings(database, shard, cutoff)
+            if archived_days:
+                archived[shard] = archived_days
+    finally:
+        database.close()
 
-            # Validation ensures no negative values
-            if miles < 0 or kWh < 0 or meals < 0:
-                return jsonify({"error": "Values cannot be negative"}), 400
+    return archived
 
-            # Convert inputs into yearly
-            annual_kWh = kWh * 12  # Convert monthly to annual
-            annual_meals = meals * 52  # Convert weekly to annual
 
-            footprint = (miles * carbon_data["individual"]["transport_miles"] +
-                         annual_kWh * carbon_data["individual"]["electricity_kwh"] +
-                         annual_meals * carbon_data["individual"]["meat_meals"]) / 1000
-            average = 4.6  # UK avg individual footprint in tonnes CO2e (2023 estimate)
+@app.cli.command("archive-readings")
+@click.option("--days", default=ARCHIVE_AFTER_DAYS, show_default=True, help="Archive readings older than this")
+def archive_readings_command(days):
+    """Move old meter readings out of database.db into the columnar archive."""
+    for shard, archived_days in archive_readings(days).items():
+        click.echo(f"Archived {archived_days} days of readings into shard {shard}")
 
-        else:  # Commercial
-            kWh = float(data.get("electricity_kwh") or 0)  # Monthly kWh
-            gas_kWh = float(data.get("gas_kwh") or 0)  # Monthly kWh
-            waste_tonnes = float(data.get("waste_tonnes") or 0)  # Annual tonnes
 
-            # Validation ensures no negative values
-            if kWh < 0 or gas_kWh < 0 or waste_tonnes < 0:
-                return jsonify({"error": "Values cannot be negative"}), 400
+#   Energy Rollups
+# Hourly, daily and monthly totals per customer, kept in step with meter_readings by
+# store_meter_readings. Day and month buckets start at local midnight on the calendar date
+ROLLUP_RESOLUTIONS = ("hour", "day", "month")
 
-            # Convert inputs into yearly
-            annual_kWh = kWh * 12
-            annual_gas_kWh = gas_kWh * 12
 
-            footprint = (annual_kWh * carbon_data["commercial"]["electricity_kwh"] +
-                         annual_gas_kWh * carbon_data["commercial"]["gas_kwh"] +
-                         waste_tonnes * carbon_data["commercial"]["waste_tonnes"]) / 1000
-            average = 15.0  # UK avg household/commercial footprint in tonnes CO2e
+def day_start_timestamp(day):
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
 
-        return jsonify({
-            "footprint": round(footprint, 2),
-            "average": average
-        })
 
-    except ValueError:
-        return jsonify({"error": "Invalid input - please enter numeric values"}), 400
+def month_start_timestamp(day):
+    return day_start_timestamp(day.replace(day=1))
+
+
+def apply_rollup_deltas(cursor, customer_ids, timestamps, delta_wh, delta_readings):
+    # Adds Wh and reading-count changes into every rollup bucket they fall in
+    hour_starts = timestamps - timestamps % 3600
+    unique_hours, hour_index = np.unique(hour_starts, return_inverse=True)
+    hour_dates = [datetime.fromtimestamp(hour).date() for hour in unique_hours.tolist()]
+    buckets = {
+        "hour": unique_hours,
+        "day": np.array([day_start_timestamp(date) for date in hour_dates], dtype=np.int64),
+        "month": np.array([month_start_timestamp(date) for date in hour_dates], dtype=np.int64),
+    }
+
+    rows = []
+    for resolution in ROLLUP_RESOLUTIONS:
+        keys = np.stack([customer_ids, buckets[resolution][hour_index]], axis=1)
+        unique_keys, key_index = np.unique(keys, axis=0, return_inverse=True)
+        key_index = key_index.reshape(-1)
+        wh_totals = np.bincount(key_index, weights=delta_wh, minlength=len(unique_keys)).astype(np.int64)
+        reading_totals = np.bincount(key_index, weights=delta_readings, minlength=len(unique_keys)).astype(np.int64)
+        changed = (wh_totals != 0) | (reading_totals != 0)
+
+        rows.extend((customer_id, resolution, bucket_start, wh, readings)
+                    for (customer_id, bucket_start), wh, readings in zip(unique_keys[changed].tolist(),
+                                                                        wh_totals[changed].tolist(),
+                                                                        reading_totals[changed].tolist()))
+
+    cursor.executemany("""
+        INSERT INTO energy_rollups (customer_id, resolution, bucket_start, wh, readings)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (customer_id, resolution, bucket_start)
+        DO UPDATE SET wh = wh + excluded.wh, readings = readings + excluded.readings
+    """, rows)
+
+
+def fetch_rollups(cursor, customer_id, resolution, start, end):
+    # Pre-aggregated buckets starting in [start, end), as bucket start, Wh and reading count arrays
+    cursor.execute("""
+        SELECT bucket_start, wh, readings FROM energy_rollups
+        WHERE customer_id = ? AND resolution = ? AND bucket_start >= ? AND bucket_start < ?
+        ORDER BY bucket_start
+    """, (customer_id, resolution, int(start), int(end)))
+    rollups = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+
+    return rollups[:, 0], rollups[:, 1], rollups[:, 2]
+
+
+def rebuild_rollups(cursor, customer_id):
+    # Recomputes a customer's rollups from raw readings a year of blocks at a time
+    cursor.execute("DELETE FROM energy_rollups WHERE customer_id = ?", (customer_id,))
+    cursor.execute("SELECT MIN(day_start), MAX(day_start) FROM meter_readings WHERE customer_id = ?", (customer_id,))
+    first_day, last_day = cursor.fetchone()
+
+    archived_first_day, archived_last_day = archived_day_range(customer_id)
+    if archived_first_day is not None:
+        first_day = min(archived_first_day, first_day if first_day is not None else archived_first_day)
+        last_day = max(archived_last_day, last_day if last_day is not None else archived_last_day)
+    if first_day is None:
+        return
+
+    chunk_seconds = 366 * READING_BLOCK_SECONDS
+    for start in range(first_day, last_day + READING_BLOCK_SECONDS, chunk_seconds):
+        timestamps, wh_values = fetch_meter_readings(cursor, customer_id, start, start + chunk_seconds)
+        if len(timestamps):
+            apply_rollup_deltas(cursor, np.full(len(timestamps), customer_id, dtype=np.int64), timestamps,
+                                wh_values, np.ones(len(timestamps), dtype=np.int64))
+
+
+@app.cli.command("rebuild-rollups")
+@click.option("--customer", "customer_id", type=int, default=None, help="Only rebuild this customer")
+def rebuild_rollups_command(customer_id):
+    """Recompute energy rollups from the raw meter readings."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        if customer_id is None:
+            cursor.execute("SELECT DISTINCT customer_id FROM meter_readings")
+            customer_ids = sorted({row[0] for row in cursor.fetchall()} | archived_customer_ids())
+        else:
+            customer_ids = [customer_id]
+
+        for customer in customer_ids:
+            cursor.execute("BEGIN IMMEDIATE")
+            rebuild_rollups(cursor, customer)
+            database.commit()
+            click.echo(f"Rebuilt rollups for customer {customer}")
+    finally:
+        database.close()
+
+
+#   Energy Anomaly Detection
+# Each hour of the latest week is scored against the same hour-of-week over the weeks before
+# it, using a robust z-score (median and MAD), so a stuck EV charger or a failing heat pump
+# stands out from the customer's own weekly pattern
+ANOMALY_WEEKS = 8
+ANOMALY_THRESHOLD = 4.0
+ANOMALY_MIN_HOURS = 3
+ANOMALY_MIN_SPREAD_WH = 100  # Floor on the robust spread so flat profiles don't flag noise
+HOURS_PER_WEEK = 168
+
+
+def load_half_hourly_matrix(cursor, partition, partitions, start, end):
+    # Customers x days x half hours of Wh for UTC days in [start, end), NaN where readings are missing
+    cursor.execute("""
+        SELECT customer_id, day_start, wh FROM meter_readings
+        WHERE day_start >= ? AND day_start < ? AND customer_id % ? = ?
+    """, (start, end, partitions, partition))
+    rows = cursor.fetchall()
+    days = (end - start) // READING_BLOCK_SECONDS
+    if not rows:
+        return np.empty(0, dtype=np.int64), np.empty((0, days, READING_SLOTS))
+
+    customer_ids, customer_index = np.unique(np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows)),
+                                             return_inverse=True)
+    day_index = (np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows)) - start) // 86400
+    blocks = np.frombuffer(b"".join(row[2] for row in rows), dtype="<i4").reshape(-1, READING_SLOTS)
+
+    half_hours = np.full((len(customer_ids), days, READING_SLOTS), np.nan)
+    half_hours[customer_index, day_index] = np.where(blocks == MISSING_WH, np.nan, blocks)
+
+    return customer_ids, half_hours
+
+
+def load_hourly_matrix(cursor, partition, partitions, start, end):
+    # Customers x hours matrix of Wh for [start, end), missing if either half hour is missing
+    customer_ids, half_hours = load_half_hourly_matrix(cursor, partition, partitions, start, end)
+
+    return customer_ids, half_hours.reshape(len(customer_ids), -1, 2).sum(axis=2)
+
+
+def find_anomaly_runs(customer_ids, flagged, scores, excess, kind, hour_starts):
+    # Turns runs of at least ANOMALY_MIN_HOURS flagged hours into anomaly rows
+    previous = np.pad(flagged, ((0, 0), (1, 0)))[:, :-1]
+    following = np.pad(flagged, ((0, 0), (0, 1)))[:, 1:]
+
+    # A padding column per row stops runs joining across customers once flattened
+    width = flagged.shape[1] + 1
+    starts = np.flatnonzero(np.pad(flagged & ~previous, ((0, 0), (0, 1))))
+    ends = np.flatnonzero(np.pad(flagged & ~following, ((0, 0), (0, 1))))
+    if not len(starts):
+        return []
+
+    # Run peaks and totals over the flattened, padded rows
+    score_flat = np.pad(np.where(flagged, np.abs(scores), 0), ((0, 0), (0, 1))).reshape(-1)
+    excess_flat = np.pad(np.where(flagged, excess, 0), ((0, 0), (0, 1))).reshape(-1)
+    peak_scores = np.maximum.reduceat(score_flat, starts)
+    excess_cumulative = np.concatenate([[0], np.cumsum(excess_flat)])
+    run_excess = excess_cumulative[ends + 1] - excess_cumulative[starts]
+    lengths = ends - starts + 1
+
+    long_enough = lengths >= ANOMALY_MIN_HOURS
+    rows = starts[long_enough] // width
+    start_hours = starts[long_enough] % width
+    end_hours = ends[long_enough] % width
+
+    return [(int(customer_ids[row]), int(hour_starts[start_hour]), int(hour_starts[end_hour] + 3600), kind,
+             round(float(peak), 2), int(round(total)))
+            for row, start_hour, end_hour, peak, total in zip(rows, start_hours, end_hours,
+                                                              peak_scores[long_enough], run_excess[long_enough])]
+
+
+def detect_partition_anomalies(partition, partitions, end):
+    # Scores one partition of customers, run inside a worker process
+    start = end - ANOMALY_WEEKS * 7 * 86400
+    database = analytics_connection()
+    try:
+        customer_ids, hourly = load_hourly_matrix(database.cursor(), partition, partitions, start, end)
+    finally:
+        database.close()
+    if not len(customer_ids):
+        return []
+
+    weeks = hourly.reshape(len(customer_ids), ANOMALY_WEEKS, HOURS_PER_WEEK)
+    history, latest = weeks[:, :-1], weeks[:, -1]
+
+    with np.errstate(all="ignore"):
+        baseline = np.nanmedian(history, axis=1)
+        spread = 1.4826 * np.nanmedian(np.abs(history - baseline[:, None]), axis=1)
+        scores = (latest - baseline) / np.fmax(spread, ANOMALY_MIN_SPREAD_WH)
+    scores = np.nan_to_num(scores, nan=0.0)
+    excess = np.nan_to_num(latest - baseline, nan=0.0)
+
+    hour_starts = end - HOURS_PER_WEEK * 3600 + np.arange(HOURS_PER_WEEK) * 3600
+    return (find_anomaly_runs(customer_ids, scores > ANOMALY_THRESHOLD, scores, excess, "high", hour_starts) +
+            find_anomaly_runs(customer_ids, scores < -ANOMALY_THRESHOLD, scores, excess, "low", hour_starts))
+
+
+def detect_anomalies(workers):
+    # Scores every partition in worker processes and replaces the week's anomalies, returning how many
+    end = int(time.time()) // 86400 * 86400
+    partitions = max(workers, 1) * 4
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(detect_partition_anomalies, range(partitions), [partitions] * partitions,
+                           [end] * partitions)
+        anomalies = [anomaly for partition in results for anomaly in partition]
+
+    # Re-running for the same week replaces its results
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM anomalies WHERE end_time > ?", (end - HOURS_PER_WEEK * 3600,))
+        cursor.executemany("""
+            INSERT INTO anomalies (customer_id, start_time, end_time, kind, peak_score, excess_wh, detected_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [anomaly + (int(time.time()),) for anomaly in anomalies])
+        database.commit()
+    finally:
+        database.close()
+
+    return len(anomalies)
+
+
+@app.cli.command("detect-anomalies")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Worker processes")
+def detect_anomalies_command(workers):
+    """Score the last week of every customer's usage and store the anomalies found."""
+    click.echo(f"Stored {detect_anomalies(workers)} anomalies")
+
+
+#   Energy Forecasting
+# Per-segment models (property type plus installed products) predict average daily use over the
+# next week and month from a customer's recent daily rollups. Training and the nightly batch
+# inference run from the CLI; requests only ever read the forecasts table
+FORECAST_DIR = "models"
+FORECAST_HISTORY_DAYS = 800
+FORECAST_HORIZONS = {"week": 7, "month": 30}
+FORECAST_ORIGIN_STEP_DAYS = 7
+FORECAST_MIN_SEGMENT_CUSTOMERS = 20
+FORECAST_MAX_SAMPLES = 500_000
+PRODUCT_CODES = {"Solar panels": "solar", "EV charging stations": "ev", "Smart home energy management": "smart"}
+
+
+def forecast_model_path(segment):
+    # Segments are named from stored data, so the file name is a hash rather than the segment itself
+    return os.path.join(FORECAST_DIR, f"{hashlib.sha256(segment.encode('utf-8')).hexdigest()[:32]}.joblib")
+
+
+def load_customer_segments(cursor):
+    # Segment key per customer from their latest property type and installed products
+    cursor.execute("""
+        SELECT c.id,
+               (SELECT property_type FROM consultations WHERE customer_id = c.id ORDER BY id DESC LIMIT 1),
+               (SELECT group_concat(DISTINCT p.type)
+                FROM bookings b
+                JOIN consultations co ON b.consultation_id = co.id
+                JOIN products p ON co.product_id = p.id
+                WHERE b.customer_id = c.id AND NOT b.maintenance)
+        FROM customers c
+    """)
+    segments = {}
+    for customer_id, property_type, products in cursor.fetchall():
+        codes = sorted(PRODUCT_CODES.get(product, product.lower().replace(" ", "_"))
+                       for product in (products or "").split(",") if product)
+        property_type = property_type if property_type in PROPERTY_TYPES else "unknown"
+        segments[customer_id] = f"{property_type}-{'+'.join(codes) or 'none'}"
+
+    return segments
+
+
+def load_daily_matrix(cursor, first_date, days):
+    # Customers x days matrix of kWh from the daily rollups, NaN where a day has no readings
+    day_starts = np.array([day_start_timestamp(first_date + timedelta(days=day)) for day in range(days + 1)],
+                          dtype=np.int64)
+    cursor.execute("""
+        SELECT customer_id, bucket_start, wh FROM energy_rollups
+        WHERE resolution = 'day' AND bucket_start >= ? AND bucket_start < ?
+    """, (int(day_starts[0]), int(day_starts[-1])))
+    rollups = np.array(cursor.fetchall(), dtype=np.int64).reshape(-1, 3)
+
+    customer_ids, customer_index = np.unique(rollups[:, 0], return_inverse=True)
+    matrix = np.full((len(customer_ids), days), np.nan, dtype=np.float32)
+    matrix[customer_index.reshape(-1), np.searchsorted(day_starts, rollups[:, 1], side="right") - 1] = \
+        rollups[:, 2] / 1000
+
+    return customer_ids, matrix
+
+
+def window_means(matrix, starts, ends, min_days):
+    # Mean of each customer's days [starts[i], ends[i]), NaN with fewer than min_days readings
+    sums = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(np.nan_to_num(matrix), axis=1)], axis=1)
+    counts = np.concatenate([np.zeros((len(matrix), 1)), np.cumsum(~np.isnan(matrix), axis=1)], axis=1)
+    starts = np.clip(starts, 0, matrix.shape[1])
+    ends = np.clip(ends, 0, matrix.shape[1])
+    total = sums[:, ends] - sums[:, starts]
+    count = counts[:, ends] - counts[:, starts]
+
+    with np.errstate(all="ignore"):
+        return np.where(count >= min_days, total / count, np.nan)
+
+
+def forecast_features(matrix, origins, first_date):
+    # Customers x origins x features, using only days before each origin day index
+    day_of_year = np.array([(first_date + timedelta(days=int(origin))).timetuple().tm_yday for origin in origins])
+    angle = np.broadcast_to(2 * np.pi * day_of_year / 365.25, (len(matrix), len(origins)))
+
+    return np.stack([
+        window_means(matrix, origins - 7, origins, 5),
+        window_means(matrix, origins - 28, origins, 20),
+        window_means(matrix, origins - 91, origins, 60),
+        window_means(matrix, origins - 364, origins - 357, 5),  # Same week last year
+        np.sin(angle),
+        np.cos(angle),
+    ], axis=2)
+
+
+def train_segment_model(segment, features, targets):
+    # Fits one model per horizon for a segment, run inside a worker process. Returns no samples,
+    # writing nothing, when a horizon has nothing to learn from
+    from sklearn.ensemble import HistGradientBoostingRegressor
+    import joblib
+
+    usable = {horizon: np.isfinite(target) & np.isfinite(features[:, 1]) for horizon, target in targets.items()}
+    if not all(mask.any() for mask in usable.values()):
+        return segment, 0
+
+    models = {}
+    for horizon, target in targets.items():
+        model = HistGradientBoostingRegressor(max_iter=200, learning_rate=0.1)
+        model.fit(features[usable[horizon]], target[usable[horizon]])
+        models[horizon] = model
+
+    joblib.dump({"models": models, "trained_time": int(time.time())}, forecast_model_path(segment))
+
+    return segment, int(len(features))
+
+
+@app.cli.command("train-forecasts")
+@click.option("--workers", default=os.cpu_count() or 1, show_default=True, help="Worker processes")
+def train_forecasts_command(workers):
+    """Train per-segment energy forecasting models on historical daily usage."""
+    os.makedirs(FORECAST_DIR, exist_ok=True)
+    first_date = datetime.now().date() - timedelta(days=FORECAST_HISTORY_DAYS)
+
+    database = analytics_connection()
+    try:
+        segments = load_customer_segments(database.cursor())
+        customer_ids, matrix = load_daily_matrix(database.cursor(), first_date, FORECAST_HISTORY_DAYS)
+    finally:
+        database.close()
+
+    # Samples are weekly origins with a full quarter of history behind them
+    origins = np.arange(91, FORECAST_HISTORY_DAYS, FORECAST_ORIGIN_STEP_DAYS)
+    features = forecast_features(matrix, origins, first_date)
+    targets = {horizon: window_means(matrix, origins, origins + days, days)
+               for horizon, days in FORECAST_HORIZONS.items()}
+    customer_segments = np.array([segments.get(customer_id, "unknown-none") for customer_id in customer_ids.tolist()])
+
+    # Small segments are only covered by the model trained on everyone
+    jobs = {"all": np.ones(len(customer_ids), dtype=bool)}
+    for segment, count in zip(*np.unique(customer_segments, return_counts=True)):
+        if count >= FORECAST_MIN_SEGMENT_CUSTOMERS:
+            jobs[str(segment)] = customer_segments == segment
+
+    sampler = np.random.default_rng(0)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for segment, members in jobs.items():
+            segment_features = features[members].reshape(-1, features.shape[2])
+            segment_targets = {horizon: target[members].reshape(-1) for horizon, target in targets.items()}
+            if len(segment_features) > FORECAST_MAX_SAMPLES:
+                sample = sampler.choice(len(segment_features), FORECAST_MAX_SAMPLES, replace=False)
+                segment_features = segment_features[sample]
+                segment_targets = {horizon: target[sample] for horizon, target in segment_targets.items()}
+            futures.append(pool.submit(train_segment_model, segment, segment_features, segment_targets))
+
+        for future in futures:
+            segment, samples = future.result()
+            click.echo(f"Trained {segment} on {samples} samples" if samples
+                       else f"Skipped {segment}, no usable samples")
+
+
+def run_forecasts():
+    # Predicts next week and next month for every customer and stores them, returning how many
+    import joblib
+
+    today = datetime.now().date()
+    first_date = today - timedelta(days=365)
+
+    database = analytics_connection()
+    try:
+        segments = load_customer_segments(database.cursor())
+        customer_ids, matrix = load_daily_matrix(database.cursor(), first_date, 365)
+    finally:
+        database.close()
+    features = forecast_features(matrix, np.array([365]), first_date)[:, 0]
+
+    # Customers in segments without their own model fall back to the model trained on everyone
+    model_segments = []
+    for customer_id in customer_ids.tolist():
+        segment = segments.get(customer_id, "unknown-none")
+        model_segments.append(segment if os.path.exists(forecast_model_path(segment)) else "all")
+    model_segments = np.array(model_segments)
+
+    rows = []
+    generated_time = int(time.time())
+    period_start = day_start_timestamp(today)
+    for segment in np.unique(model_segments).tolist():
+        models = joblib.load(forecast_model_path(segment))["models"]
+        usable = (model_segments == segment) & np.isfinite(features[:, 1])
+        if not usable.any():
+            continue
+
+        for horizon, days in FORECAST_HORIZONS.items():
+            daily_kwh = np.clip(models[horizon].predict(features[usable]), 0, None)
+            period_end = day_start_timestamp(today + timedelta(days=days))
+            rows.extend((customer_id, horizon, period_start, period_end, int(round(kwh * days * 1000)), segment,
+                         generated_time)
+                        for customer_id, kwh in zip(customer_ids[usable].tolist(), daily_kwh.tolist()))
+
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.executemany("""
+            INSERT OR REPLACE INTO forecasts (customer_id, horizon, period_start, period_end, wh, segment,
+                                              generated_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, rows)
+        database.commit()
+    finally:
+        database.close()
+
+    return len(rows)
+
+
+@app.cli.command("run-forecasts")
+def run_forecasts_command():
+    """Nightly batch inference: store next week and next month forecasts for every customer."""
+    click.echo(f"Stored {run_forecasts()} forecasts")
+
+
+#   Energy Usage
+# Customers are compared with others in their region (from their latest consultation's postcode)
+# once enough of them have readings, and with the UK average otherwise. The regional figures are
+# computed nightly by the regional_baselines job, so requests read one row
+REGIONAL_BASELINE_DAYS = 90
+REGIONAL_MIN_CUSTOMERS = 5
+
+
+def customer_region(cursor, customer_id):
+    cursor.execute("SELECT postcode FROM consultations WHERE customer_id = ? ORDER BY id DESC LIMIT 1",
+                   (customer_id,))
+    row = cursor.fetchone()
+    location = resolve_postcode(row[0]) if row else None
+
+    return location.region if location else None
+
+
+def refresh_regional_baselines():
+    # Mean of customers' average daily use by region, replacing the stored figures; returns how many
+    today = datetime.now().date()
+    database = analytics_connection()
+    try:
+        cursor = database.cursor()
+        cursor.execute("""
+            SELECT c.postcode, SUM(r.wh) * 1.0 / COUNT(*)
+            FROM energy_rollups r
+            JOIN consultations c ON c.id = (SELECT MAX(id) FROM consultations WHERE customer_id = r.customer_id)
+            WHERE r.resolution = 'day' AND r.bucket_start >= ? AND r.bucket_start < ?
+            GROUP BY r.customer_id
+        """, (day_start_timestamp(today - timedelta(days=REGIONAL_BASELINE_DAYS)), day_start_timestamp(today)))
+        rows = cursor.fetchall()
+    finally:
+        database.close()
+
+    by_region = {}
+    for postcode, daily_wh in rows:
+        location = resolve_postcode(postcode)
+        if location:
+            by_region.setdefault(location.region, []).append(daily_wh / 1000)
+    computed_time = int(time.time())
+    baselines = [(name, round(float(np.mean(values)), 2), computed_time)
+                 for name, values in by_region.items() if len(values) >= REGIONAL_MIN_CUSTOMERS]
+
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("DELETE FROM regional_baselines")
+        cursor.executemany("INSERT INTO regional_baselines (region, daily_kwh, computed_time) VALUES (?, ?, ?)",
+                           baselines)
+        database.commit()
+    finally:
+        database.close()
+
+    return len(baselines)
+
+
+def regional_daily_kwh(cursor, region):
+    cursor.execute("SELECT daily_kwh FROM regional_baselines WHERE region = ?", (region,))
+    row = cursor.fetchone()
+
+    return row[0] if row else None
+
+
+@app.cli.command("refresh-regional-baselines")
+def refresh_regional_baselines_command():
+    """Recompute each region's average daily use for the usage comparison."""
+    click.echo(f"Stored baselines for {refresh_regional_baselines()} regions")
+
+
+def usage_baseline(cursor, customer_id):
+    # (daily kWh, label) for the comparison line on the customer's charts
+    region = customer_region(cursor, customer_id)
+    daily_kwh = regional_daily_kwh(cursor, region) if region else None
+    if daily_kwh is None:
+        return NATIONAL_AVERAGE_DAILY_KWH, "UK Average"
+
+    return daily_kwh, f"{region} Average"
+
+
+@app.route("/api/energy-usage", methods=["GET"])
+def track_energy_usage():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "You must be logged in to continue"}), 401
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        customer_id = get_session_customer_id(cursor)
+        if customer_id is None:
+            return jsonify({"success": False, "error": "Customer not found"})
+
+        # Current week as seven local days ending today, read from the daily rollups
+        today = datetime.now().date()
+        dates = [today - timedelta(days=x) for x in range(6, -1, -1)]
+        day_starts = np.array([day_start_timestamp(date) for date in dates], dtype=np.int64)
+
+        bucket_starts, wh_values, _ = fetch_rollups(cursor, customer_id, "day", day_starts[0],
+                                                    day_start_timestamp(today + timedelta(days=1)))
+        daily_wh = np.zeros(len(day_starts), dtype=np.int64)
+        daily_wh[np.searchsorted(day_starts, bucket_starts)] = wh_values
+        user_values = [round(value / 1000, 2) for value in daily_wh.tolist()]
+
+        # Month to date from the calendar month rollup
+        month_start = month_start_timestamp(today)
+        _, month_wh, _ = fetch_rollups(cursor, customer_id, "month", month_start, month_start + 1)
+
+        baseline_kwh, baseline_label = usage_baseline(cursor, customer_id)
+        graph_stuff = {
+            "labels": [date.strftime("%d/%m") for date in dates],
+            "user_values": user_values,
+            "national_average": [baseline_kwh] * 7,
+            "baseline_label": baseline_label
+        }
+
+        # Calculate statistics and return result
+        daily_usage = user_values[-1]
+        weekly_usage = round(sum(user_values), 2)
+        monthly_usage = int(month_wh.sum()) / 1000
+        avg_daily_usage = round(weekly_usage / len(user_values), 1)
+
+        # Unusual usage found by the nightly anomaly job over the past week
+        cursor.execute("""
+            SELECT start_time, end_time, kind, peak_score, excess_wh FROM anomalies
+            WHERE customer_id = ? AND end_time > ?
+            ORDER BY start_time DESC
+            LIMIT 5
+        """, (customer_id, int(day_starts[0])))
+        anomalies = [{
+            "start": datetime.fromtimestamp(start_time).strftime("%d/%m %H:%M"),
+            "end": datetime.fromtimestamp(end_time).strftime("%d/%m %H:%M"),
+            "kind": kind,
+            "score": peak_score,
+            "excess_kwh": round(excess_wh / 1000, 1)
+        } for start_time, end_time, kind, peak_score, excess_wh in cursor.fetchall()]
+
+        # Precomputed by the nightly forecasting job
+        cursor.execute("SELECT horizon, wh FROM forecasts WHERE customer_id = ?", (customer_id,))
+        forecasts = {horizon: round(wh / 1000, 1) for horizon, wh in cursor.fetchall()}
+
+        return jsonify({
+            "success": True,
+            "graph_data": graph_stuff,
+            "anomalies": anomalies,
+            "forecast": {
+                "next_week_kwh": forecasts.get("week"),
+                "next_month_kwh": forecasts.get("month")
+            },
+            "daily_usage": daily_usage,
+            "weekly_usage": weekly_usage,
+            "monthly_usage": round(monthly_usage),
+            "avg_daily_usage": avg_daily_usage
+        })
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"})
+    finally:
+        database.close()
+
+
+#   Energy Chart Series
+# Any date range is served from the coarsest source that still has enough points, then
+# downsampled so the payload never exceeds the requested number of points
+SERIES_DEFAULT_POINTS = 300
+SERIES_MAX_POINTS = 1000
+SERIES_MAX_DAYS = 3660
+SERIES_SOURCES = (("month", None), ("day", 86400), ("hour", 3600), ("half_hour", READING_INTERVAL_SECONDS))
+SERIES_LABEL_FORMATS = {"month": "%b %Y", "day": "%d/%m/%Y", "hour": "%d/%m %H:%M", "half_hour": "%d/%m %H:%M"}
+
+
+def downsample_lttb(x, y, points):
+    # Largest-Triangle-Three-Buckets, returning the indices of the points kept
+    count = len(x)
+    if points >= count or points < 3:
+        return np.arange(count)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, count - 1, points - 1).astype(np.int64)
+
+    # Average point of every bucket, used as the third triangle vertex
+    sums_x = np.add.reduceat(x[1:count - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1:count - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    average_x = np.append(sums_x / sizes, x[-1])
+    average_y = np.append(sums_y / sizes, y[-1])
+
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, count - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        areas = np.abs((x[previous] - average_x[bucket + 1]) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (average_y[bucket + 1] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+
+    return kept
+
+
+def downsample_min_max(y, points):
+    # Keeps the lowest and highest point of each bucket, returning sorted indices
+    count = len(y)
+    if points >= count or points < 2:
+        return np.arange(count)
+
+    buckets = np.arange(count) * (points // 2) // count
+    order = np.lexsort((y, buckets))
+    sorted_buckets = buckets[order]
+    first = np.flatnonzero(np.r_[True, sorted_buckets[1:] != sorted_buckets[:-1]])
+    last = np.r_[first[1:] - 1, count - 1]
+
+    return np.unique(np.concatenate([order[first], order[last]]))
+
+
+def fetch_energy_series(cursor, customer_id, start, end, points):
+    # Picks the coarsest resolution with at least `points` buckets, or raw readings for short ranges
+    span = end - start
+    for resolution, seconds in SERIES_SOURCES:
+        bucket_count = span // (30 * 86400) if seconds is None else span // seconds
+        if bucket_count >= points or resolution == "half_hour":
+            break
+
+    if resolution == "half_hour":
+        timestamps, wh_values = fetch_meter_readings(cursor, customer_id, start, end)
+    else:
+        timestamps, wh_values, _ = fetch_rollups(cursor, customer_id, resolution, start, end)
+
+    return resolution, timestamps, wh_values
+
+
+def national_average_series(resolution, timestamps, daily_kwh=NATIONAL_AVERAGE_DAILY_KWH):
+    # Average daily use (UK or regional) scaled to the length of each bucket
+    if resolution == "month":
+        days = [((datetime.fromtimestamp(timestamp).replace(day=28) + timedelta(days=4)).replace(day=1) -
+                 timedelta(days=1)).day for timestamp in timestamps.tolist()]
+        return [round(daily_kwh * day_count, 2) for day_count in days]
+
+    seconds = dict(SERIES_SOURCES)[resolution]
+    return [round(daily_kwh * seconds / 86400, 3)] * len(timestamps)
+
+
+@app.route("/api/energy-usage/series", methods=["GET"])
+def energy_usage_series():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "You must be logged in to continue"}), 401
+
+    # Range is [start, end) in local dates, defaulting to the last seven days
+    today = datetime.now().date()
+    try:
+        start_date = datetime.strptime(request.args.get("start") or (today - timedelta(days=6)).isoformat(),
+                                       "%Y-%m-%d").date()
+        end_date = datetime.strptime(request.args.get("end") or (today + timedelta(days=1)).isoformat(),
+                                     "%Y-%m-%d").date()
+        points = int(request.args.get("points") or SERIES_DEFAULT_POINTS)
+    except ValueError:
+        return jsonify({"success": False, "error": "Use YYYY-MM-DD dates and a whole number of points"}), 400
+
+    method = request.args.get("method", "lttb")
+    if method not in ("lttb", "minmax"):
+        return jsonify({"success": False, "error": "Method must be lttb or minmax"}), 400
+
+    if not start_date < end_date or (end_date - start_date).days > SERIES_MAX_DAYS:
+        return jsonify({"success": False, "error": "End must be after start and within ten years"}), 400
+
+    points = min(max(points, 3), SERIES_MAX_POINTS)
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        customer_id = get_session_customer_id(cursor)
+        if customer_id is None:
+            return jsonify({"success": False, "error": "Customer not found"})
+
+        resolution, timestamps, wh_values = fetch_energy_series(
+            cursor, customer_id, day_start_timestamp(start_date), day_start_timestamp(end_date), points)
+
+        if method == "lttb":
+            kept = downsample_lttb(timestamps, wh_values, points)
+        else:
+            kept = downsample_min_max(wh_values, points)
+        timestamps, wh_values = timestamps[kept], wh_values[kept]
+
+        label_format = SERIES_LABEL_FORMATS[resolution]
+        baseline_kwh, baseline_label = usage_baseline(cursor, customer_id)
+        return jsonify({
+            "success": True,
+            "resolution": resolution,
+            "timestamps": timestamps.tolist(),
+            "labels": [datetime.fromtimestamp(timestamp).strftime(label_format) for timestamp in timestamps.tolist()],
+            "user_values": (wh_values / 1000).round(3).tolist(),
+            "national_average": national_average_series(resolution, timestamps, baseline_kwh),
+            "baseline_label": baseline_label
+        })
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"})
+    finally:
+        database.close()
+
+
+#   Tariff Comparison
+# Every tariff is a vector of unit rates over (month, half hour of day), so a customer's year of
+# readings folded onto the same 12 x 48 grid prices against the whole catalogue in one product
+TARIFF_DAYS = 365
+DAYS_PER_MONTH = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+ECONOMY_7_SLOTS = np.arange(1, 15)  # 00:30 to 07:30
+AGILE_SHAPE = np.array([0.62, 0.60, 0.57, 0.55, 0.53, 0.52, 0.52, 0.53, 0.56, 0.62, 0.72, 0.85,
+                        0.95, 1.00, 1.00, 0.97, 0.93, 0.90, 0.88, 0.86, 0.84, 0.83, 0.84, 0.88,
+                        0.92, 0.95, 0.98, 1.05, 1.25, 1.30, 1.30, 1.25, 1.45, 1.95, 2.05, 2.00,
+                        1.90, 1.60, 1.30, 1.15, 1.08, 1.02, 0.96, 0.90, 0.82, 0.75, 0.70, 0.65])
+AGILE_SEASONAL = np.array([1.25, 1.20, 1.10, 0.95, 0.85, 0.80, 0.80, 0.82, 0.90, 1.00, 1.15, 1.25])
+tariffs = {
+    "Standard Variable": {"kind": "flat", "standing_charge": 0.6097, "rates": [0.2450]},
+    "Fixed 12 Months": {"kind": "flat", "standing_charge": 0.4950, "rates": [0.2580]},
+    "Low Standing Charge": {"kind": "flat", "standing_charge": 0.2500, "rates": [0.2790]},
+    "Economy 7": {"kind": "economy-7", "standing_charge": 0.5800, "rates": [0.2990, 0.1380]},
+    "Economy 7 Green": {"kind": "economy-7", "standing_charge": 0.6100, "rates": [0.3120, 0.1250]},
+    "EV Night Saver": {"kind": "economy-7", "standing_charge": 0.6097, "rates": [0.2700, 0.0850]},
+    "Agile": {"kind": "agile", "standing_charge": 0.4790, "rates": [0.2050, 1.0000]},
+    "Agile Capped": {"kind": "agile", "standing_charge": 0.4790, "rates": [0.2150, 0.4000]},
+}
+
+
+@lru_cache(maxsize=1)
+def tariff_rate_matrix():
+    # Tariff names, a tariffs x (12 * 48) GBP/kWh rate matrix and daily standing charges
+    names = list(tariffs)
+    rates = np.empty((len(names), 12, READING_SLOTS))
+    for row, name in enumerate(names):
+        tariff = tariffs[name]
+        if tariff["kind"] == "flat":
+            rates[row] = tariff["rates"][0]
+        elif tariff["kind"] == "economy-7":
+            rates[row] = tariff["rates"][0]
+            rates[row][:, ECONOMY_7_SLOTS] = tariff["rates"][1]
+        else:  # Agile: a wholesale-shaped price around the average, capped per kWh
+            average, cap = tariff["rates"]
+            rates[row] = np.minimum(average * AGILE_SEASONAL[:, None] * AGILE_SHAPE[None, :], cap)
+    rates.setflags(write=False)
+
+    return names, rates.reshape(len(names), -1), np.array([tariffs[name]["standing_charge"] for name in names])
+
+
+def price_tariffs(day_starts, blocks):
+    # Annualised cost of the readings under every tariff, cheapest first
+    names, rates, standing_charges = tariff_rate_matrix()
+    months = day_starts.astype("datetime64[s]").astype("datetime64[M]").astype(np.int64) % 12
+    valid = blocks != MISSING_WH
+    totals = np.zeros((12, READING_SLOTS))
+    counts = np.zeros((12, READING_SLOTS))
+    np.add.at(totals, months, np.where(valid, blocks, 0) / 1000)
+    np.add.at(counts, months, valid)
+
+    # Average kWh per half hour by month, months without readings taking the overall average
+    overall = totals.sum(axis=0) / np.maximum(counts.sum(axis=0), 1)
+    average = np.where(counts > 0, totals / np.maximum(counts, 1), overall)
+    usage = average * DAYS_PER_MONTH[:, None]
+    costs = rates @ usage.reshape(-1) + standing_charges * TARIFF_DAYS
+    order = np.argsort(costs)
+
+    return [{
+        "name": names[index],
+        "kind": tariffs[names[index]]["kind"],
+        "annual_cost": round(float(costs[index]), 2),
+        "extra_cost": round(float(costs[index] - costs[order[0]]), 2)
+    } for index in order.tolist()], round(float(usage.sum()), 1)
+
+
+tariff_comparisons = {}  # customer_id -> (cache key, result)
+
+
+@app.route("/api/tariff-comparison", methods=["GET"])
+def tariff_comparison():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "You must be logged in to continue"}), 401
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        customer_id = get_session_customer_id(cursor)
+        if customer_id is None:
+            return jsonify({"success": False, "error": "Customer not found"})
+
+        # Reused until new readings arrive or the year window moves on a day
+        end = int(time.time()) // READING_BLOCK_SECONDS * READING_BLOCK_SECONDS
+        cache_key = (get_reading_version(cursor, customer_id), end)
+        cached = tariff_comparisons.get(customer_id)
+        if cached and cached[0] == cache_key:
+            return jsonify(cached[1])
+
+        day_starts, blocks = fetch_reading_blocks(cursor, customer_id, end - TARIFF_DAYS * READING_BLOCK_SECONDS, end)
+        if not len(day_starts):
+            return jsonify({"success": False, "error": "No meter readings to compare tariffs with yet"})
+
+        comparison, annual_kwh = price_tariffs(day_starts, blocks)
+        result = {
+            "success": True,
+            "days": len(day_starts),
+            "annual_kwh": annual_kwh,
+            "tariffs": comparison
+        }
+        tariff_comparisons[customer_id] = (cache_key, result)
+
+        return jsonify(result)
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"})
+    finally:
+        database.close()
+
+
+#   Smart Home Devices
+@app.route("/api/devices", methods=["GET", "POST"])
+def customer_devices():
+    if "user" not in session:
+        return jsonify({"success": False, "error": "You must be logged in to continue"}), 401
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        customer_id = get_session_customer_id(cursor)
+        if customer_id is None:
+            return jsonify({"success": False, "error": "Customer not found"})
+
+        if request.method == "POST":
+            device_id = (request.form.get("device_id") or "").strip()
+
+            # Device ids are printed on the meter, letters, digits, dashes and underscores only
+            if not device_id or len(device_id) > 64 or not all(
+                    char.isalnum() or char in "-_" for char in device_id):
+                return jsonify({"success": False, "error": "Invalid device ID"}), 400
+
+            cursor.execute("SELECT customer_id FROM devices WHERE device_id = ?", (device_id,))
+            if cursor.fetchone():
+                return jsonify({"success": False, "error": "Device already registered"}), 409
+
+            cursor.execute("""
+                INSERT INTO devices (device_id, customer_id, created_time)
+                VALUES (?, ?, ?)
+            """, (device_id, customer_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            database.commit()
+
+        cursor.execute("SELECT device_id FROM devices WHERE customer_id = ? ORDER BY created_time", (customer_id,))
+
+        return jsonify({"success": True, "devices": [row[0] for row in cursor.fetchall()]})
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"})
+    finally:
+        database.close()
+
+
+#   Meter Reading Ingest
+# Devices are authenticated by the gateway that batches their readings, using INGEST_API_KEY
+INGEST_MAX_BYTES = 16 * 1024 * 1024
+INGEST_MAX_PENDING = 2_000_000  # Readings queued for the writer before answering 429
+INGEST_GROUP_READINGS = 200_000  # Most readings written in one group commit
+INGEST_MAX_AGE_SECONDS = 400 * 86400
+INGEST_MAX_WH = 50_000  # Half-hourly ceiling, a 100 kW supply
+INGEST_COMMIT_ATTEMPTS = 5
+INGEST_DEAD_LETTER_DIR = os.path.join("archive", "dead_readings")
+
+ingest_queue = queue.Queue()
+ingest_lock = threading.Lock()
+ingest_writer = None
+ingest_metrics = {
+    "pending_readings": 0,
+    "accepted_readings": 0,
+    "committed_readings": 0,
+    "rejected_readings": 0,
+    "duplicate_readings": 0,
+    "throttled_requests": 0,
+    "requeued_readings": 0,
+    "dead_lettered_readings": 0,
+    "lost_readings": 0,
+    "group_commits": 0,
+    "failed_commits": 0,
+    "last_commit_lag_seconds": 0.0,
+    "max_commit_lag_seconds": 0.0,
+    "oldest_pending_time": None,
+}
+device_customers = {}  # device_id -> customer_id, filled on first sight
+
+
+class MeterReading(msgspec.Struct):
+    device: str
+    timestamp: int
+    wh: int
+
+
+def parse_readings(body, content_type):
+    # Returns device, timestamp and Wh columns for JSON Lines, CSV or MessagePack bodies
+    if content_type in ("application/msgpack", "application/x-msgpack"):
+        records = msgspec.msgpack.decode(body, type=list[MeterReading])
+    elif content_type == "text/csv":
+        rows = list(csv.reader(io.StringIO(body.decode("utf-8"))))
+        if not rows or [column.strip() for column in rows[0]] != ["device", "timestamp", "wh"]:
+            raise ValueError("CSV header must be device,timestamp,wh")
+        rows = [row for row in rows[1:] if row]
+        if any(len(row) != 3 for row in rows):
+            raise ValueError("Every CSV row needs device, timestamp and wh")
+        if not rows:
+            return np.empty(0, dtype=object), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        devices, timestamps, wh_values = zip(*rows)
+        return (np.array([device.strip() for device in devices], dtype=object),
+                np.char.strip(np.array(timestamps)).astype(np.int64),
+                np.char.strip(np.array(wh_values)).astype(np.int64))
+    else:
+        # JSON Lines, decoded in one pass as a single array
+        lines = [line for line in body.split(b"\n") if line.strip()]
+        records = msgspec.json.decode(b"[" + b",".join(lines) + b"]", type=list[MeterReading])
+
+    return (np.array([record.device for record in records], dtype=object),
+            np.fromiter((record.timestamp for record in records), dtype=np.int64, count=len(records)),
+            np.fromiter((record.wh for record in records), dtype=np.int64, count=len(records)))
+
+
+def resolve_device_customers(cursor, device_ids):
+    # Returns the customer id for each device, 0 where the device is not registered
+    unknown = [device_id for device_id in device_ids if device_id not in device_customers]
+    for offset in range(0, len(unknown), 500):
+        chunk = unknown[offset:offset + 500]
+        cursor.execute(f"SELECT device_id, customer_id FROM devices WHERE device_id IN ({', '.join('?' * len(chunk))})",
+                       chunk)
+        device_customers.update(cursor.fetchall())
+
+    return np.array([device_customers.get(device_id, 0) for device_id in device_ids], dtype=np.int64)
+
+
+def enqueue_readings(customer_ids, timestamps, wh_values):
+    # Hands a validated batch to the group-commit writer, False when the queue is full
+    global ingest_writer
+
+    with ingest_lock:
+        if ingest_metrics["pending_readings"] + len(timestamps) > INGEST_MAX_PENDING:
+            ingest_metrics["throttled_requests"] += 1
+            return False
+
+        enqueued_time = time.time()
+        ingest_metrics["pending_readings"] += len(timestamps)
+        ingest_metrics["accepted_readings"] += len(timestamps)
+        if ingest_metrics["oldest_pending_time"] is None:
+            ingest_metrics["oldest_pending_time"] = enqueued_time
+        ingest_queue.put((enqueued_time, customer_ids, timestamps, wh_values))
+
+        if ingest_writer is None or not ingest_writer.is_alive():
+            ingest_writer = threading.Thread(target=run_ingest_writer, name="ingest-writer", daemon=True)
+            ingest_writer.start()
+
+    return True
+
+
+def commit_ingest_group(database, cursor, batches):
+    # Writes batches in one transaction, retrying while the database is busy
+    customer_ids = np.concatenate([batch[1] for batch in batches])
+    timestamps = np.concatenate([batch[2] for batch in batches])
+    wh_values = np.concatenate([batch[3] for batch in batches])
+
+    for attempt in range(INGEST_COMMIT_ATTEMPTS):
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            store_meter_readings(cursor, customer_ids, timestamps, wh_values)
+            database.commit()
+            return
+        except sqlite3.OperationalError as error:
+            database.rollback()
+            if attempt == INGEST_COMMIT_ATTEMPTS - 1:
+                raise
+            app.logger.warning("Ingest commit failed, retrying: %s", error)
+            time.sleep(0.1 * 2 ** attempt)
+        except Exception:
+            database.rollback()
+            raise
+
+
+def write_dead_readings(batch):
+    # Keeps a batch that can't be stored so replay-dead-readings can load it once the cause is fixed
+    os.makedirs(INGEST_DEAD_LETTER_DIR, exist_ok=True)
+    enqueued_time, customer_ids, timestamps, wh_values = batch
+    path = os.path.join(INGEST_DEAD_LETTER_DIR, f"{enqueued_time:.6f}-{threading.get_ident()}.npz")
+    np.savez(path, customer_ids=customer_ids, timestamps=timestamps, wh_values=wh_values)
+
+
+def run_ingest_writer():
+    # Drains every batch queued while the previous commit ran and writes them in one transaction.
+    # Batches that can't be written yet are held and retried ahead of anything newer, so a later
+    # reading for a half hour always lands after an earlier one. Readings still waiting in memory
+    # are lost if the process exits
+    database = sqlite3.connect("database.db", timeout=30)
+    cursor = database.cursor()
+    held = []  # Oldest first, retried before the queue is read again
+
+    while True:
+        batches, held = held or [ingest_queue.get()], []
+        group_size = sum(len(batch[2]) for batch in batches)
+        while group_size < INGEST_GROUP_READINGS:
+            try:
+                batches.append(ingest_queue.get_nowait())
+            except queue.Empty:
+                break
+            group_size += len(batches[-1][2])
+
+        settled = {"committed": 0, "requeued": 0, "dead_lettered": 0, "lost": 0}
+        try:
+            try:
+                commit_ingest_group(database, cursor, batches)
+                settled["committed"] = group_size
+            except sqlite3.OperationalError as error:
+                # Still busy after every retry, so the group is tried again before newer batches
+                app.logger.warning("Ingest commit failed, holding %d readings: %s", group_size, error)
+                held = batches
+                settled["requeued"] = group_size
+            except Exception:
+                # One bad batch fails the group, so each is tried alone and only the failures set aside.
+                # Once one is held for being busy, every later batch is held behind it
+                app.logger.exception("Ingest group of %d readings failed, storing batches separately", group_size)
+                for batch in batches:
+                    if held:
+                        held.append(batch)
+                        settled["requeued"] += len(batch[2])
+                        continue
+                    try:
+                        commit_ingest_group(database, cursor, [batch])
+                        settled["committed"] += len(batch[2])
+                    except sqlite3.OperationalError:
+                        held.append(batch)
+                        settled["requeued"] += len(batch[2])
+                    except Exception:
+                        app.logger.exception("Dead lettering %d readings", len(batch[2]))
+                        write_dead_readings(batch)
+                        settled["dead_lettered"] += len(batch[2])
+        except Exception:
+            settled["lost"] = group_size - sum(settled.values())
+            app.logger.exception("Ingest writer lost %d readings", settled["lost"])
+        finally:
+            commit_lag = time.time() - batches[0][0]
+            with ingest_lock:
+                ingest_metrics["pending_readings"] -= group_size - settled["requeued"]
+                ingest_metrics["oldest_pending_time"] = (min(batch[0] for batch in held + list(ingest_queue.queue))
+                                                         if ingest_metrics["pending_readings"] else None)
+                ingest_metrics["committed_readings"] += settled["committed"]
+                ingest_metrics["requeued_readings"] += settled["requeued"]
+                ingest_metrics["dead_lettered_readings"] += settled["dead_lettered"]
+                ingest_metrics["lost_readings"] += settled["lost"]
+                if settled["committed"] == group_size:
+                    ingest_metrics["group_commits"] += 1
+                    ingest_metrics["last_commit_lag_seconds"] = round(commit_lag, 3)
+                    ingest_metrics["max_commit_lag_seconds"] = max(ingest_metrics["max_commit_lag_seconds"],
+                                                                   round(commit_lag, 3))
+                else:
+                    ingest_metrics["failed_commits"] += 1
+
+
+@app.cli.command("replay-dead-readings")
+def replay_dead_readings_command():
+    """Store readings the ingest writer set aside, removing each file once it is committed."""
+    if not os.path.isdir(INGEST_DEAD_LETTER_DIR):
+        click.echo("No dead letter readings")
+        return
+
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        for name in sorted(os.listdir(INGEST_DEAD_LETTER_DIR)):
+            path = os.path.join(INGEST_DEAD_LETTER_DIR, name)
+            with np.load(path) as batch:
+                batch = (0.0, batch["customer_ids"], batch["timestamps"], batch["wh_values"])
+            try:
+                commit_ingest_group(database, cursor, [batch])
+            except Exception as error:
+                click.echo(f"{name}: {error}")
+                continue
+            os.remove(path)
+            click.echo(f"{name}: stored {len(batch[2])} readings")
+    finally:
+        database.close()
+
+
+def ingest_authorised():
+    api_key = os.getenv("INGEST_API_KEY")
+    supplied = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+
+    return bool(api_key) and hmac.compare_digest(supplied.encode("utf-8"), api_key.encode("utf-8"))
+
+
+@app.route("/api/readings", methods=["POST"])
+def ingest_readings():
+    if not ingest_authorised():
+        return jsonify({"success": False, "error": "Invalid ingest API key"}), 401
+
+    if request.content_length is None or request.content_length > INGEST_MAX_BYTES:
+        return jsonify({"success": False, "error": "Batch must be sent with a length under 16 MB"}), 413
+
+    # Shed load before parsing when the writer is already behind
+    if ingest_metrics["pending_readings"] >= INGEST_MAX_PENDING:
+        with ingest_lock:
+            ingest_metrics["throttled_requests"] += 1
+        return jsonify({"success": False, "error": "Ingest queue full, retry later"}), 429, {"Retry-After": "5"}
+
+    try:
+        devices, timestamps, wh_values = parse_readings(request.get_data(), request.mimetype)
+    except (ValueError, UnicodeDecodeError, msgspec.ValidationError, msgspec.DecodeError) as error:
+        return jsonify({"success": False, "error": f"Malformed batch: {error}"}), 400
+
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+
+        # Vectorised validation across the whole batch
+        unique_devices, device_index = np.unique(devices.astype(str), return_inverse=True)
+        customer_ids = resolve_device_customers(cursor, unique_devices.tolist())[device_index]
+        now = int(time.time())
+        valid = ((customer_ids > 0) & (timestamps >= now - INGEST_MAX_AGE_SECONDS) & (timestamps <= now + 300) &
+                 (wh_values >= 0) & (wh_values <= INGEST_MAX_WH))
+        rejected = int(len(valid) - valid.sum())
+
+        # Deduplicate on (device, timestamp), keeping the last reading sent
+        device_index, timestamps, wh_values = device_index[valid], timestamps[valid], wh_values[valid]
+        customer_ids = customer_ids[valid]
+        pairs = np.stack([device_index[::-1], timestamps[::-1]], axis=1)
+        _, last_index = np.unique(pairs, axis=0, return_index=True)
+        keep = np.sort(len(timestamps) - 1 - last_index)
+        duplicates = int(len(timestamps) - len(keep))
+
+        if len(keep) and not enqueue_readings(customer_ids[keep], timestamps[keep], wh_values[keep]):
+            return jsonify({"success": False, "error": "Ingest queue full, retry later"}), 429, {"Retry-After": "5"}
+
+        with ingest_lock:
+            ingest_metrics["rejected_readings"] += rejected
+            ingest_metrics["duplicate_readings"] += duplicates
+
+        return jsonify({"success": True, "accepted": int(len(keep)), "duplicates": duplicates,
+                        "rejected": rejected}), 202
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"}), 500
+    finally:
+        database.close()
+
+
+@app.route("/api/readings/metrics", methods=["GET"])
+def ingest_metrics_report():
+    if not ingest_authorised():
+        return jsonify({"success": False, "error": "Invalid ingest API key"}), 401
+
+    with ingest_lock:
+        metrics = dict(ingest_metrics)
+
+    oldest_pending_time = metrics.pop("oldest_pending_time")
+    metrics["queued_batches"] = ingest_queue.qsize()
+    metrics["ingest_lag_seconds"] = round(time.time() - oldest_pending_time, 3) if oldest_pending_time else 0.0
+
+    return jsonify({"success": True, "metrics": metrics})
+
+
+#   Products Page
+@app.route("/products")
+def products():
+    return render_template("products.html")
+
+
+#   Carbon Footprint
+# Emission factors are dated, versioned tables in data/emission_factors/<version>.json, decoded into
+# frozen structs. The newest table already in effect is used unless a caller pins a version, and the
+# directory is re-read whenever a file in it changes, so new factors go live without a restart. A
+# published version is served as immutable, so a reload that edits one or repeats one is refused
+EMISSION_FACTORS_DIR = os.path.join("data", "emission_factors")
+
+
+class IndividualFactors(msgspec.Struct, frozen=True):
+    transport_miles: float  # kg CO₂e per mile
+    electricity_kwh: float  # kg CO₂e per kWh
+    meat_meals: float  # kg CO₂e per meat meal
+
+
+class CommercialFactors(msgspec.Struct, frozen=True):
+    electricity_kwh: float  # kg CO₂e per kWh
+    gas_kwh: float  # kg CO₂e per kWh
+    waste_tonnes: float  # kg CO₂e per tonne of waste
+
+
+class CarbonAverages(msgspec.Struct, frozen=True):
+    individual: float  # UK avg footprint in tonnes CO₂e
+    commercial: float
+
+
+class EmissionFactors(msgspec.Struct, frozen=True):
+    version: str
+    effective_from: date
+    source: str
+    individual: IndividualFactors
+    commercial: CommercialFactors
+    averages: CarbonAverages
+
+
+emission_tables_lock = threading.Lock()
+emission_tables = {"files": None, "versions": {}, "encoded": {}}
+
+
+def load_emission_tables():
+    # Returns {version: EmissionFactors}, re-reading the directory when its files change
+    files = sorted((entry.name, entry.stat().st_mtime_ns) for entry in os.scandir(EMISSION_FACTORS_DIR)
+                   if entry.name.endswith(".json"))
+    if files == emission_tables["files"]:
+        return emission_tables["versions"]
+
+    with emission_tables_lock:
+        if files != emission_tables["files"]:
+            versions, encoded = {}, {}
+            try:
+                for name, _ in files:
+                    with open(os.path.join(EMISSION_FACTORS_DIR, name), "rb") as table_file:
+                        factors = msgspec.json.decode(table_file.read(), type=EmissionFactors)
+                    if factors.version in versions:
+                        raise ValueError(f"{name} repeats version {factors.version}")
+                    versions[factors.version] = factors
+                    encoded[factors.version] = msgspec.json.encode(factors)
+                    published = emission_tables["encoded"].get(factors.version)
+                    if published is not None and published != encoded[factors.version]:
+                        raise ValueError(f"{name} changes published version {factors.version}")
+            except (OSError, ValueError, msgspec.DecodeError, msgspec.ValidationError) as error:
+                # Keep serving the tables already loaded until the directory changes again
+                app.logger.error(f"Emission factors not reloaded: {error}")
+                emission_tables["files"] = files
+                return emission_tables["versions"]
+
+            emission_tables.update(versions=versions, encoded=encoded, files=files)
+
+    return emission_tables["versions"]
+
+
+def get_emission_factors(version=None):
+    # The pinned version, or the newest table in effect today; None for an unknown version
+    versions = load_emission_tables()
+    if version is not None:
+        return versions.get(version)
+    if not versions:
+        raise RuntimeError(f"No emission factors could be loaded from {EMISSION_FACTORS_DIR}")
+
+    today = datetime.now().date()
+    in_effect = [factors for factors in versions.values() if factors.effective_from <= today]
+
+    return max(in_effect or versions.values(), key=lambda factors: factors.effective_from)
+
+
+@app.route("/api/emission-factors", methods=["GET"])
+def current_emission_factors():
+    # Short-lived, so browsers pick up a new version within minutes
+    factors = get_emission_factors()
+    response = Response(emission_tables["encoded"][factors.version], mimetype="application/json")
+    response.set_etag(factors.version)
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+
+    return response.make_conditional(request)
+
+
+@app.route("/api/emission-factors/<version>", methods=["GET"])
+def versioned_emission_factors(version):
+    # A published version never changes, so it can be cached indefinitely
+    factors = get_emission_factors(version)
+    if factors is None:
+        return jsonify({"success": False, "error": "Unknown emission factors version"}), 404
+
+    response = Response(emission_tables["encoded"][version], mimetype="application/json")
+    response.set_etag(version)
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+
+    return response.make_conditional(request)
+
+
+#   Batch Carbon Footprints
+# Many sites priced in one pass: inputs form a sites x inputs matrix that is multiplied by the
+# annualised factor vector for each site's type, matching /get-carbon for a single site
+CARBON_INPUTS = ("transport_miles", "electricity_kwh", "meat_meals", "gas_kwh", "waste_tonnes")
+CARBON_USER_TYPES = ("individual", "commercial")
+CARBON_BATCH_MAX_BYTES = 32 * 1024 * 1024
+CARBON_BATCH_MAX_SITES = 200_000
+CARBON_PERCENTILES = (10, 25, 50, 75, 90, 95, 99)
+
+
+class CarbonSite(msgspec.Struct):
+    type: str = "commercial"
+    site: str | None = None
+    transport_miles: float | None = None
+    electricity_kwh: float | None = None
+    meat_meals: float | None = None
+    gas_kwh: float | None = None
+    waste_tonnes: float | None = None
+
+
+def parse_csv_number(value):
+    # Empty fields count as zero; anything that isn't a number becomes NaN and is reported with its row
+    try:
+        return float(value) if value.strip() else 0.0
+    except ValueError:
+        return np.nan
+
+
+def parse_carbon_sites(body, content_type):
+    # Returns site names, type codes (-1 when unknown) and a sites x CARBON_INPUTS matrix
+    if content_type == "text/csv":
+        rows = [row for row in csv.reader(io.StringIO(body.decode("utf-8"))) if row]
+        header = [column.strip().lower() for column in rows[0]] if rows else []
+        unknown = set(header) - set(CARBON_INPUTS) - {"type", "site"}
+        if not header or unknown:
+            raise ValueError(f"CSV header may only contain type, site and {', '.join(CARBON_INPUTS)}")
+        rows = rows[1:]
+        if any(len(row) != len(header) for row in rows):
+            raise ValueError("Every CSV row needs a value (or an empty field) for each column")
+
+        columns = dict(zip(header, zip(*rows))) if rows else {name: () for name in header}
+        types = np.array([value.strip() for value in columns.get("type", ["commercial"] * len(rows))], dtype=str)
+        sites = [value.strip() for value in columns["site"]] if "site" in columns else None
+        values = np.zeros((len(rows), len(CARBON_INPUTS)))
+        for index, name in enumerate(CARBON_INPUTS):
+            if name in columns:
+                values[:, index] = np.fromiter((parse_csv_number(value) for value in columns[name]),
+                                               dtype=np.float64, count=len(rows))
+    else:
+        records = msgspec.json.decode(body, type=list[CarbonSite])
+        types = np.array([record.type for record in records], dtype=str)
+        sites = [record.site for record in records] if any(record.site is not None for record in records) else None
+        values = np.array([[getattr(record, name) or 0 for name in CARBON_INPUTS] for record in records],
+                          dtype=np.float64).reshape(len(records), len(CARBON_INPUTS))
+
+    type_codes = np.full(len(types), -1, dtype=np.int64)
+    for code, user_type in enumerate(CARBON_USER_TYPES):
+        type_codes[np.char.lower(types) == user_type] = code
+
+    return sites, type_codes, values
+
+
+def carbon_weights(factors):
+    # Annualised kg CO2e per unit of each input, one row per user type
+    return np.array([
+        [factors.individual.transport_miles, 12 * factors.individual.electricity_kwh,
+         52 * factors.individual.meat_meals, 0, 0],
+        [0, 12 * factors.commercial.electricity_kwh, 0, 12 * factors.commercial.gas_kwh,
+         factors.commercial.waste_tonnes]
+    ])
+
+
+def batch_carbon_footprints(type_codes, values, factors):
+    # Tonnes CO2e per site, NaN where the type is unknown or an input is negative or not a number
+    valid = (type_codes >= 0) & np.isfinite(values).all(axis=1) & (values >= 0).all(axis=1)
+    footprints = np.einsum("ij,ij->i", np.where(valid[:, None], values, 0),
+                           carbon_weights(factors)[np.maximum(type_codes, 0)]) / 1000
+
+    return np.where(valid, footprints, np.nan), valid
+
+
+def summarise_footprints(footprints):
+    if not len(footprints):
+        return {"sites": 0, "total": 0.0, "mean": None,
+                "percentiles": {f"p{percentile}": None for percentile in CARBON_PERCENTILES}}
+
+    return {
+        "sites": len(footprints),
+        "total": round(float(footprints.sum()), 2),
+        "mean": round(float(footprints.mean()), 3),
+        "percentiles": dict(zip((f"p{percentile}" for percentile in CARBON_PERCENTILES),
+                                np.round(np.percentile(footprints, CARBON_PERCENTILES), 3).tolist()))
+    }
+
+
+@app.route("/get-carbon/batch", methods=["POST"])
+def calculate_carbon_batch():
+    if request.content_length is None or request.content_length > CARBON_BATCH_MAX_BYTES:
+        return jsonify({"success": False, "error": "Batch must be sent with a length under 32 MB"}), 413
+
+    # A JSON array or CSV body, or a CSV file uploaded from a form
+    upload = request.files.get("file")
+    body, content_type = (upload.read(), "text/csv") if upload else (request.get_data(), request.mimetype)
+
+    try:
+        sites, type_codes, values = parse_carbon_sites(body, content_type)
+    except (ValueError, UnicodeDecodeError, msgspec.ValidationError, msgspec.DecodeError) as error:
+        return jsonify({"success": False, "error": f"Malformed batch: {error}"}), 400
+
+    if len(type_codes) > CARBON_BATCH_MAX_SITES:
+        return jsonify({"success": False, "error": f"At most {CARBON_BATCH_MAX_SITES} sites per batch"}), 413
+
+    factors = get_emission_factors(request.args.get("factors_version"))
+    if factors is None:
+        return jsonify({"success": False, "error": "Unknown emission factors version"}), 400
+
+    footprints, valid = batch_carbon_footprints(type_codes, values, factors)
+
+    invalid = np.flatnonzero(~valid)
+    finite = np.isfinite(values).all(axis=1)
+    errors = [{
+        "index": index,
+        "error": "Type must be individual or commercial" if type_codes[index] < 0
+        else "Values must be finite numbers" if not finite[index] else "Values cannot be negative"
+    } for index in invalid[:100].tolist()]
+
+    summary = {"all": summarise_footprints(footprints[valid])}
+    for code, user_type in enumerate(CARBON_USER_TYPES):
+        summary[user_type] = summarise_footprints(footprints[valid & (type_codes == code)])
+
+    # Encoded with msgspec, which writes the NaN of rejected sites as null and is much faster at this size
+    return Response(msgspec.json.encode({
+        "success": True,
+        "sites": sites,
+        "footprints": np.round(footprints, 3).tolist(),
+        "invalid": len(invalid),
+        "errors": errors,
+        "summary": summary,
+        "average": factors.averages,
+        "factors_version": factors.version
+    }), mimetype="application/json")
+
+
+#   Carbon Scenario Sweep
+# Footprints are linear in each input, so a grid over several inputs is the broadcast sum of one
+# weighted vector per axis. Results come back as axis values plus one flat C-order array
+CARBON_SWEEP_MAX_POINTS = 1_000_000
+CARBON_SWEEP_MAX_STEPS = 1000
+
+
+def parse_sweep_axis(spec):
+    # A list of values, or {"start", "stop", "steps"} for evenly spaced values
+    if isinstance(spec, dict):
+        steps = int(spec.get("steps", 11))
+        if not 1 <= steps <= CARBON_SWEEP_MAX_STEPS:
+            raise ValueError(f"Steps must be between 1 and {CARBON_SWEEP_MAX_STEPS}")
+        values = np.linspace(float(spec["start"]), float(spec["stop"]), steps)
+    else:
+        values = np.asarray(spec, dtype=np.float64).reshape(-1)
+        if not 1 <= len(values) <= CARBON_SWEEP_MAX_STEPS:
+            raise ValueError(f"Each axis needs between 1 and {CARBON_SWEEP_MAX_STEPS} values")
+
+    if not np.all(np.isfinite(values)) or np.any(values < 0):
+        raise ValueError("Values cannot be negative")
+
+    return values
+
+
+@app.route("/get-carbon/scenarios", methods=["POST"])
+def carbon_scenarios():
+    data = request.get_json(silent=True) or {}
+
+    if data.get("type") not in CARBON_USER_TYPES:
+        return jsonify({"success": False, "error": "Type must be individual or commercial"}), 400
+
+    factors = get_emission_factors(data.get("factors_version"))
+    if factors is None:
+        return jsonify({"success": False, "error": "Unknown emission factors version"}), 400
+    weights = carbon_weights(factors)[CARBON_USER_TYPES.index(data["type"])]
+
+    try:
+        base = {name: float(value or 0) for name, value in (data.get("base") or {}).items()}
+        axes = {name: parse_sweep_axis(spec) for name, spec in (data.get("axes") or {}).items()}
+    except (TypeError, ValueError, KeyError) as error:
+        return jsonify({"success": False, "error": f"Invalid scenario: {error}"}), 400
+
+    # Only inputs that count towards this type's footprint can be varied
+    inputs = [name for name, weight in zip(CARBON_INPUTS, weights) if weight]
+    unknown = (set(base) | set(axes)) - set(inputs)
+    if unknown:
+        return jsonify({"success": False, "error": f"{data['type'].capitalize()} footprints only use "
+                                                   f"{', '.join(inputs)}"}), 400
+    if any(value < 0 for value in base.values()):
+        return jsonify({"success": False, "error": "Values cannot be negative"}), 400
+
+    shape = tuple(len(values) for values in axes.values())
+    if int(np.prod(shape, dtype=np.int64)) > CARBON_SWEEP_MAX_POINTS:
+        return jsonify({"success": False, "error": f"At most {CARBON_SWEEP_MAX_POINTS} scenarios per request"}), 413
+
+    # Inputs held at their base value add a constant, each swept input adds one broadcast axis
+    weight_of = dict(zip(CARBON_INPUTS, weights))
+    footprints = np.full(shape, sum(weight_of[name] * value for name, value in base.items() if name not in axes))
+    for position, (name, values) in enumerate(axes.items()):
+        axis_shape = [1] * len(shape)
+        axis_shape[position] = len(values)
+        footprints = footprints + (weight_of[name] * values).reshape(axis_shape)
+
+    return Response(msgspec.json.encode({
+        "success": True,
+        "axes": [{"name": name, "values": values.tolist()} for name, values in axes.items()],
+        "shape": shape,
+        "footprints": np.round(footprints.reshape(-1) / 1000, 3).tolist(),
+        "average": getattr(factors.averages, data["type"]),
+        "factors_version": factors.version
+    }), mimetype="application/json")
+
+
+#   Grid Carbon Intensity
+# Half-hourly grid gCO2/kWh per calendar year. Imported datasets live in data/carbon_intensity/<year>.npy;
+# slots they do not cover use a typical daily and seasonal shape scaled to the annual grid factor
+CARBON_INTENSITY_DIR = os.path.join("data", "carbon_intensity")
+GRID_CARBON_BY_HOUR = np.array([170, 160, 155, 150, 150, 155, 175, 200, 210, 200, 185, 170,
+                                165, 160, 165, 180, 210, 240, 250, 240, 225, 210, 195, 180])
+
+
+@lru_cache(maxsize=8)
+def carbon_intensity_year(year, grid_factor):
+    start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+    end = int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp())
+    times = np.arange(start, end, READING_INTERVAL_SECONDS, dtype=np.int64)
+
+    day_of_year = (times - start) // READING_BLOCK_SECONDS
+    modelled = GRID_CARBON_BY_HOUR[(times // 3600) % 24] * (1 + 0.15 * np.cos(2 * np.pi * (day_of_year + 10) / 365))
+    modelled *= grid_factor * 1000 / modelled.mean()
+
+    path = os.path.join(CARBON_INTENSITY_DIR, f"{year}.npy")
+    if os.path.exists(path):
+        measured = np.load(path)
+        intensity, source = np.where(np.isnan(measured), modelled, measured), "dataset"
+    else:
+        intensity, source = modelled, "modelled"
+    intensity.setflags(write=False)
+
+    return intensity, source
+
+
+def grid_intensity_at(timestamps, factors=None):
+    # gCO2/kWh for each UTC timestamp, and the sources the values came from. Modelled values are scaled
+    # to the grid factor of factors, the table in effect today by default
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    years = timestamps.astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+    grid_factor = (factors or get_emission_factors()).individual.electricity_kwh
+    intensity = np.empty(len(timestamps))
+    sources = set()
+    for year in np.unique(years).tolist():
+        in_year = years == year
+        year_intensity, source = carbon_intensity_year(year, grid_factor)
+        year_start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+        intensity[in_year] = year_intensity[(timestamps[in_year] - year_start) // READING_INTERVAL_SECONDS]
+        sources.add(source)
+
+    return intensity, sources
+
+
+def metered_electricity_carbon(cursor, customer_id, factors, days=365):
+    # Footprint of the customer's own half-hourly use against the grid at the time it was used
+    end = int(time.time()) // READING_BLOCK_SECONDS * READING_BLOCK_SECONDS
+    timestamps, wh_values = fetch_meter_readings(cursor, customer_id, end - days * READING_BLOCK_SECONDS, end)
+    if not len(timestamps):
+        return None
+
+    intensity, sources = grid_intensity_at(timestamps, factors)
+    kwh = wh_values / 1000
+
+    return {
+        "days": len(np.unique(timestamps // READING_BLOCK_SECONDS)),
+        "kwh": round(float(kwh.sum()), 1),
+        "footprint": round(float(kwh @ intensity) / 1e6, 3),
+        "annual_factor_footprint": round(float(kwh.sum()) * factors.individual.electricity_kwh / 1000, 3),
+        "intensity_source": sources.pop() if len(sources) == 1 else "mixed"
+    }
+
+
+@app.cli.command("import-carbon-intensity")
+@click.argument("csv_path", type=click.Path(exists=True, dir_okay=False))
+def import_carbon_intensity_command(csv_path):
+    """Import half-hourly grid intensity (from/datetime and actual/intensity columns) into data/."""
+    with open(csv_path, newline="") as csv_file:
+        reader = csv.DictReader(csv_file)
+        columns = {name.strip().lower(): name for name in reader.fieldnames or []}
+        time_column = next((columns[name] for name in ("from", "datetime", "timestamp") if name in columns), None)
+        value_column = next((columns[name] for name in ("actual", "intensity", "forecast") if name in columns), None)
+        if time_column is None or value_column is None:
+            raise click.ClickException("CSV needs a from/datetime column and an actual/intensity column")
+
+        timestamps, values = [], []
+        for row in reader:
+            if not row[value_column]:
+                continue
+            moment = datetime.fromisoformat(row[time_column].strip().replace("Z", "+00:00"))
+            if moment.tzinfo is None:
+                moment = moment.replace(tzinfo=timezone.utc)
+            timestamps.append(int(moment.timestamp()))
+            values.append(float(row[value_column]))
+
+    timestamps = np.array(timestamps, dtype=np.int64)
+    values = np.array(values)
+    years = timestamps.astype("datetime64[s]").astype("datetime64[Y]").astype(np.int64) + 1970
+    os.makedirs(CARBON_INTENSITY_DIR, exist_ok=True)
+    for year in np.unique(years).tolist():
+        year_start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+        year_end = int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp())
+        path = os.path.join(CARBON_INTENSITY_DIR, f"{year}.npy")
+
+        # New values are merged over anything already imported for the year
+        series = np.load(path) if os.path.exists(path) else np.full(
+            (year_end - year_start) // READING_INTERVAL_SECONDS, np.nan, dtype=np.float32)
+        in_year = years == year
+        series[(timestamps[in_year] - year_start) // READING_INTERVAL_SECONDS] = values[in_year]
+        np.save(path, series)
+        click.echo(f"{year}: {int(np.isfinite(series).sum())} of {len(series)} half hours")
+
+    carbon_intensity_year.cache_clear()
+
+
+#   Carbon Footprint Page
+@app.route("/carbonfootprint")
+def carbon_footprint():
+    return render_template("carbonfootprint.html")
+
+
+@app.route("/get-carbon", methods=["POST"])
+def calculate_carbon():
+    data = request.json
+    user_type = data.get("type")  # "individual" or "commercial"
+
+    # Results can be reproduced against an earlier table by pinning its version
+    factors = get_emission_factors(data.get("factors_version"))
+    if factors is None:
+        return jsonify({"error": "Unknown emission factors version"}), 400
+
+    try:
+        if user_type == "individual":
+            miles = float(data.get("transport_miles") or 0)  # Annual miles
+            kWh = float(data.get("electricity_kwh") or 0)  # Monthly kWh
+            meals = float(data.get("meat_meals") or 0)  # Weekly meals
+
+            # Validation ensures no negative values
+            if miles < 0 or kWh < 0 or meals < 0:
+                return jsonify({"error": "Values cannot be negative"}), 400
+
+            # Convert inputs into yearly
+            annual_kWh = kWh * 12  # Convert monthly to annual
+            annual_meals = meals * 52  # Convert weekly to annual
+
+            footprint = (miles * factors.individual.transport_miles +
+                         annual_kWh * factors.individual.electricity_kwh +
+                         annual_meals * factors.individual.meat_meals) / 1000
+            average = factors.averages.individual
+
+        else:  # Commercial
+            kWh = float(data.get("electricity_kwh") or 0)  # Monthly kWh
+            gas_kWh = float(data.get("gas_kwh") or 0)  # Monthly kWh
+            waste_tonnes = float(data.get("waste_tonnes") or 0)  # Annual tonnes
+
+            # Validation ensures no negative values
+            if kWh < 0 or gas_kWh < 0 or waste_tonnes < 0:
+                return jsonify({"error": "Values cannot be negative"}), 400
+
+            # Convert inputs into yearly
+            annual_kWh = kWh * 12
+            annual_gas_kWh = gas_kWh * 12
+
+            footprint = (annual_kWh * factors.commercial.electricity_kwh +
+                         annual_gas_kWh * factors.commercial.gas_kwh +
+                         waste_tonnes * factors.commercial.waste_tonnes) / 1000
+            average = factors.averages.commercial
+
+        result = {
+            "footprint": round(footprint, 2),
+            "average": average,
+            "factors_version": factors.version
+        }
+
+        # Logged in customers with a smart meter also get a footprint from their actual half-hourly use
+        if "user" in session:
+            database = sqlite3.connect("database.db")
+            try:
+                cursor = database.cursor()
+                customer_id = get_session_customer_id(cursor)
+                if customer_id is not None:
+                    result["metered_electricity"] = metered_electricity_carbon(cursor, customer_id, factors)
+            finally:
+                database.close()
+
+        return jsonify(result)
+
+    except ValueError:
+        return jsonify({"error": "Invalid input - please enter numeric values"}), 400
+
+
+#   Household Load Profile
+# A typical year of hourly kWh for a customer, hour 0 being 00:00 UTC on 1 January
+HOURS_PER_YEAR = 8760
+DEFAULT_ANNUAL_KWH = 2700  # UK typical domestic use, matching the dashboard's national average
+
+
+def typical_load_profile(annual_kwh=DEFAULT_ANNUAL_KWH):
+    # Synthetic UK domestic shape: overnight base, morning and evening peaks, more use in winter
+    hours = np.arange(HOURS_PER_YEAR)
+    hour_of_day = hours % 24
+    day_of_year = hours // 24
+    daily_shape = (0.3 + 0.5 * np.exp(-((hour_of_day - 8) ** 2) / 4) +
+                   1.0 * np.exp(-((hour_of_day - 19) ** 2) / 6))
+    seasonal = 1 + 0.25 * np.cos(2 * np.pi * (day_of_year + 10) / 365)
+    profile = daily_shape * seasonal
+
+    return profile * annual_kwh / profile.sum()
+
+
+def customer_hourly_profile(cursor, customer_id, days=365):
+    # The customer's last year of hourly rollups folded onto hour-of-year, gaps filled by hour of day
+    end = int(time.time()) // 3600 * 3600
+    timestamps, wh_values, _ = fetch_rollups(cursor, customer_id, "hour", end - days * 86400, end)
+    if len(timestamps) < HOURS_PER_YEAR // 2:
+        return typical_load_profile(), False
+
+    moments = timestamps.astype("datetime64[s]")
+    hour_of_year = np.minimum((moments - moments.astype("datetime64[Y]")).astype("timedelta64[h]").astype(np.int64),
+                              HOURS_PER_YEAR - 1)
+    totals = np.bincount(hour_of_year, weights=wh_values / 1000, minlength=HOURS_PER_YEAR)
+    counts = np.bincount(hour_of_year, minlength=HOURS_PER_YEAR)
+
+    hour_of_day = (timestamps // 3600) % 24
+    by_hour = np.bincount(hour_of_day, weights=wh_values / 1000, minlength=24) / np.maximum(
+        np.bincount(hour_of_day, minlength=24), 1)
+    profile = np.where(counts > 0, totals / np.maximum(counts, 1), by_hour[np.arange(HOURS_PER_YEAR) % 24])
+
+    return profile, True
+
+
+#   Solar Panel Simulator
+# Hourly plane-of-array irradiance over a typical year, from solar geometry and monthly UK
+# clearness indices (Erbs diffuse split, isotropic sky), for every tilt/azimuth/size at once
+SOLAR_CLEARNESS = np.array([0.33, 0.38, 0.40, 0.44, 0.46, 0.46, 0.45, 0.44, 0.42, 0.38, 0.34, 0.31])
+SOLAR_PERFORMANCE_RATIO = 0.8
+SOLAR_ALBEDO = 0.2
+SOLAR_IMPORT_PRICE = 0.245  # GBP per kWh
+SOLAR_EXPORT_PRICE = 0.15  # GBP per kWh, Smart Export Guarantee
+SOLAR_COST_PER_KWP = 1600  # GBP installed
+SOLAR_MAX_CONFIGURATIONS = 5000
+UK_CENTRE = (52.5, -1.5)
+
+
+@lru_cache(maxsize=256)
+def solar_irradiance(latitude, longitude):
+    # Returns hourly GHI, DNI and DHI (W/m2) with the sun's zenith and azimuth, cached per location
+    hours = np.arange(HOURS_PER_YEAR) + 0.5
+    day = hours // 24 + 1
+    day_angle = 2 * np.pi * (day - 1) / 365
+
+    declination = np.radians(23.45) * np.sin(2 * np.pi * (284 + day) / 365)
+    equation_of_time = 229.18 * (0.000075 + 0.001868 * np.cos(day_angle) - 0.032077 * np.sin(day_angle) -
+                                 0.014615 * np.cos(2 * day_angle) - 0.04089 * np.sin(2 * day_angle))
+    solar_time = hours % 24 + longitude / 15 + equation_of_time / 60
+    hour_angle = np.radians(15 * (solar_time - 12))
+    phi = np.radians(latitude)
+
+    cos_zenith = np.sin(phi) * np.sin(declination) + np.cos(phi) * np.cos(declination) * np.cos(hour_angle)
+    cos_zenith = np.clip(cos_zenith, -1, 1)
+    zenith = np.arccos(cos_zenith)
+    with np.errstate(all="ignore"):
+        cos_azimuth = (cos_zenith * np.sin(phi) - np.sin(declination)) / (np.sin(zenith) * np.cos(phi))
+    azimuth = np.sign(hour_angle) * np.arccos(np.clip(np.nan_to_num(cos_azimuth), -1, 1))  # From south, west positive
+
+    # Typical-year global horizontal from monthly clearness, split with the Erbs correlation
+    month = np.minimum((day - 1) // 30.42, 11).astype(np.int64)
+    clearness = SOLAR_CLEARNESS[month]
+    extraterrestrial = 1367 * (1 + 0.033 * np.cos(2 * np.pi * day / 365))
+    ghi = np.where(cos_zenith > 0, clearness * extraterrestrial * cos_zenith, 0.0)
+    diffuse_fraction = np.where(clearness <= 0.22, 1 - 0.09 * clearness,
+                                np.where(clearness <= 0.8, 0.9511 - 0.1604 * clearness + 4.388 * clearness ** 2 -
+                                         16.638 * clearness ** 3 + 12.336 * clearness ** 4, 0.165))
+    dhi = ghi * diffuse_fraction
+    dni = np.where(cos_zenith > 0.05, (ghi - dhi) / np.maximum(cos_zenith, 0.05), 0.0)
+    dhi = np.where(cos_zenith > 0.05, dhi, ghi)
+
+    for array in (ghi, dni, dhi, zenith, azimuth):
+        array.flags.writeable = False
+    return ghi, dni, dhi, zenith, azimuth
+
+
+def simulate_solar(latitude, longitude, system_kwp, tilts, azimuths, load_kwh):
+    # Annual generation and self-consumed kWh for every (size, tilt, azimuth)
+    ghi, dni, dhi, zenith, sun_azimuth = solar_irradiance(round(latitude, 2), round(longitude, 2))
+    beta = np.radians(np.repeat(np.asarray(tilts, dtype=np.float64), len(azimuths)))
+    gamma = np.radians(np.tile(np.asarray(azimuths, dtype=np.float64), len(tilts)) - 180)
+
+    # cos(incidence) = cos z cos b + sin z sin b cos(A - g), expanded so every orientation's hours come from
+    # one (orientations, 3) @ (3, hours) product; the diffuse and ground terms are another of rank 2
+    orientation_terms = np.stack([np.cos(beta), np.sin(beta) * np.cos(gamma), np.sin(beta) * np.sin(gamma)],
+                                 axis=1).astype(np.float32)
+    sun_terms = np.stack([np.cos(zenith), np.sin(zenith) * np.cos(sun_azimuth),
+                          np.sin(zenith) * np.sin(sun_azimuth)]).astype(np.float32)
+    sky_terms = np.stack([(1 + np.cos(beta)) / 2, (1 - np.cos(beta)) / 2], axis=1).astype(np.float32)
+    sky_hours = np.stack([dhi, ghi * SOLAR_ALBEDO]).astype(np.float32)
+    dni = dni.astype(np.float32)
+
+    system_kwp = np.asarray(system_kwp, dtype=np.float32)
+    load_kwh = np.asarray(load_kwh, dtype=np.float32)
+    scale = np.float32(SOLAR_PERFORMANCE_RATIO / 1000)
+
+    # Worked in orientation chunks, so memory stays at a few (256, hours) float32 arrays per request
+    annual_yield = np.empty(len(beta))
+    self_consumed = np.empty((len(system_kwp), len(beta)))
+    for start in range(0, len(beta), 256):
+        stop = min(start + 256, len(beta))
+        # kWh per kWp for each orientation in the chunk, (orientations, hours)
+        yield_per_kwp = np.clip(orientation_terms[start:stop] @ sun_terms, 0, None)
+        yield_per_kwp *= dni
+        yield_per_kwp += sky_terms[start:stop] @ sky_hours
+        yield_per_kwp *= scale
+
+        annual_yield[start:stop] = yield_per_kwp.sum(axis=1, dtype=np.float64)
+        # Self-consumption is min(generation, load) each hour
+        for size_index, size in enumerate(system_kwp):
+            self_consumed[size_index, start:stop] = np.minimum(size * yield_per_kwp, load_kwh).sum(axis=1)
+
+    shape = (len(system_kwp), len(tilts), len(azimuths))
+    generation = system_kwp[:, None].astype(np.float64) * annual_yield[None, :]
+
+    return generation.reshape(shape), self_consumed.reshape(shape)
+
+
+def parse_sweep_values(values, default, lower, upper):
+    # Accepts a single number or a list, returning a validated float array
+    values = default if values is None else values
+    values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+    if values.ndim != 1 or not len(values) or not np.all(np.isfinite(values)):
+        raise ValueError("Sweep values must be numbers")
+    if np.any(values < lower) or np.any(values > upper):
+        raise ValueError(f"Values must be between {lower} and {upper}")
+
+    return values
+
+
+@app.route("/api/solar-estimate", methods=["POST"])
+def solar_estimate():
+    data = request.get_json(silent=True) or {}
+
+    try:
+        latitude = float(data.get("latitude", UK_CENTRE[0]))
+        longitude = float(data.get("longitude", UK_CENTRE[1]))
+        system_kwp = parse_sweep_values(data.get("system_kwp"), [4.0], 0.5, 50)
+        tilts = parse_sweep_values(data.get("tilt"), [35.0], 0, 90)
+        azimuths = parse_sweep_values(data.get("azimuth"), [180.0], 0, 360)
+        import_price = float(data.get("import_price", SOLAR_IMPORT_PRICE))
+        export_price = float(data.get("export_price", SOLAR_EXPORT_PRICE))
+        cost_per_kwp = float(data.get("cost_per_kwp", SOLAR_COST_PER_KWP))
+    except (TypeError, ValueError) as error:
+        return jsonify({"success": False, "error": f"Invalid input - {error}"}), 400
+
+    if not (49 <= latitude <= 61 and -9 <= longitude <= 2):
+        return jsonify({"success": False, "error": "Location must be within the UK"}), 400
+
+    if not all(np.isfinite(value) and value >= 0 for value in (import_price, export_price, cost_per_kwp)):
+        return jsonify({"success": False,
+                        "error": "import_price, export_price and cost_per_kwp must be numbers of 0 or more"}), 400
+
+    if len(system_kwp) * len(tilts) * len(azimuths) > SOLAR_MAX_CONFIGURATIONS:
+        return jsonify({"success": False, "error": f"At most {SOLAR_MAX_CONFIGURATIONS} configurations"}), 400
+
+    factors = get_emission_factors(data.get("factors_version"))
+    if factors is None:
+        return jsonify({"success": False, "error": "Unknown emission factors version"}), 400
+
+    # Use the customer's own usage when they are logged in and have enough history
+    load_kwh, measured = typical_load_profile(), False
+    if "user" in session:
+        database = sqlite3.connect("database.db")
+        try:
+            customer_id = get_session_customer_id(database.cursor())
+            if customer_id is not None:
+                load_kwh, measured = customer_hourly_profile(database.cursor(), customer_id)
+        finally:
+            database.close()
+
+    generation, self_consumed = simulate_solar(latitude, longitude, system_kwp, tilts, azimuths, load_kwh)
+    exported = generation - self_consumed
+    savings = self_consumed * import_price + exported * export_price
+    cost = system_kwp[:, None, None] * cost_per_kwp
+    with np.errstate(divide="ignore"):
+        payback = np.where(savings > 0, cost / savings, np.inf)
+    co2_avoided = generation * factors.individual.electricity_kwh
+
+    best = np.unravel_index(np.argmin(payback), payback.shape)
+
+    # Axis values plus flat arrays in size, tilt, azimuth order
+    return jsonify({
+        "success": True,
+        "measured_usage": measured,
+        "annual_usage_kwh": round(float(load_kwh.sum())),
+        "axes": {"system_kwp": system_kwp.tolist(), "tilt": tilts.tolist(), "azimuth": azimuths.tolist()},
+        "generation_kwh": generation.round(1).ravel().tolist(),
+        "self_consumed_kwh": self_consumed.round(1).ravel().tolist(),
+        "exported_kwh": exported.round(1).ravel().tolist(),
+        "annual_savings_gbp": savings.round(2).ravel().tolist(),
+        "payback_years": np.where(np.isfinite(payback), payback.round(1), -1).ravel().tolist(),
+        "co2_avoided_kg": co2_avoided.round(1).ravel().tolist(),
+        "factors_version": factors.version,
+        "best": {"system_kwp": float(system_kwp[best[0]]), "tilt": float(tilts[best[1]]),
+                 "azimuth": float(azimuths[best[2]]),
+                 "payback_years": round(float(payback[best]), 1) if np.isfinite(payback[best]) else -1}
+    })
+
+
+#   EV Charging Optimiser
+# Minimising cost (or carbon) over half-hour slots, subject to each slot's spare capacity and the
+# energy needed by departure, is solved exactly by filling the cheapest slots first. That greedy
+# fill is done for many customers at once with a sort and a cumulative sum
+EV_DEFAULT_CHARGER_KW = 7.4
+EV_DEFAULT_MAX_IMPORT_KW = 23.0  # 100 A single-phase supply
+EV_MAX_SLOTS = 96
+EV_OFF_PEAK_PRICE = 0.075  # GBP per kWh, 00:30 to 04:30
+EV_PEAK_PRICE = 0.245
+EV_BASELINE_DAYS = 28
+
+
+def default_slot_prices(slot_times):
+    # Time-of-use tariff with a cheap overnight window
+    minutes = np.array([datetime.fromtimestamp(slot).hour * 60 + datetime.fromtimestamp(slot).minute
+                        for slot in slot_times.tolist()])
+
+    return np.where((minutes >= 30) & (minutes < 270), EV_OFF_PEAK_PRICE, EV_PEAK_PRICE)
+
+
+def default_slot_carbon(slot_times):
+    return grid_intensity_at(slot_times)[0]
+
+
+def plan_ev_charging(costs, baseline_kw, charger_kw, required_kwh, max_import_kw):
+    # Cheapest-first fill; costs (slots,) or (customers, slots), baseline_kw (customers, slots)
+    baseline_kw = np.atleast_2d(baseline_kw)
+    costs = np.broadcast_to(costs, baseline_kw.shape)
+    charger_kw = np.asarray(charger_kw, dtype=np.float64).reshape(-1, 1)
+    required_kwh = np.asarray(required_kwh, dtype=np.float64).reshape(-1, 1)
+
+    capacity_kwh = np.clip(np.minimum(charger_kw, max_import_kw - baseline_kw), 0, None) * 0.5
+    order = np.argsort(costs, axis=1, kind="stable")
+    sorted_capacity = np.take_along_axis(capacity_kwh, order, axis=1)
+    filled_before = np.cumsum(sorted_capacity, axis=1) - sorted_capacity
+    sorted_energy = np.clip(required_kwh - filled_before, 0, sorted_capacity)
+
+    energy_kwh = np.empty_like(sorted_energy)
+    np.put_along_axis(energy_kwh, order, sorted_energy, axis=1)
+
+    return energy_kwh
+
+
+def plan_immediate_charging(baseline_kw, charger_kw, required_kwh, max_import_kw):
+    # Plug in and charge at full rate straight away, the comparison for savings
+    return plan_ev_charging(np.arange(baseline_kw.shape[-1], dtype=np.float64), baseline_kw, charger_kw,
+                            required_kwh, max_import_kw)
+
+
+def baseline_by_slot_of_day(half_hours):
+    # Average kW in each half hour of the day from a customers x days x slots Wh matrix
+    with np.errstate(all="ignore"):
+        average_wh = np.nanmean(half_hours, axis=1)
+
+    return np.nan_to_num(average_wh / 1000 / 0.5, nan=0.0)
+
+
+@app.route("/api/ev-charging-plan", methods=["POST"])
+def ev_charging_plan():
+    data = request.get_json(silent=True) or {}
+
+    try:
+        required_kwh = float(data.get("required_kwh") or 0)
+        charger_kw = float(data.get("charger_kw") or EV_DEFAULT_CHARGER_KW)
+        max_import_kw = float(data.get("max_import_kw") or EV_DEFAULT_MAX_IMPORT_KW)
+        plug_in = datetime.fromisoformat(data["plug_in"]) if data.get("plug_in") else datetime.now()
+        departure = datetime.fromisoformat(data.get("departure") or "")
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "error": "Give required_kwh and charger_kw as numbers and "
+                                                   "plug_in/departure as ISO date times"}), 400
+
+    objective = data.get("objective", "cost")
+    if objective not in ("cost", "carbon"):
+        return jsonify({"success": False, "error": "Objective must be cost or carbon"}), 400
+
+    if required_kwh <= 0 or charger_kw <= 0 or max_import_kw <= 0:
+        return jsonify({"success": False, "error": "Energy and power values must be positive"}), 400
+
+    first_slot = int(plug_in.timestamp()) // 1800 * 1800
+    slot_times = np.arange(first_slot, int(departure.timestamp()), 1800, dtype=np.int64)
+    if not 0 < len(slot_times) <= EV_MAX_SLOTS:
+        return jsonify({"success": False, "error": "Departure must be after plug in and within 48 hours"}), 400
+
+    prices = default_slot_prices(slot_times)
+    if data.get("prices") is not None:
+        prices = np.asarray(data["prices"], dtype=np.float64)
+        if prices.shape != slot_times.shape or not np.all(np.isfinite(prices)):
+            return jsonify({"success": False, "error": "Give one price per half hour until departure"}), 400
+    carbon = default_slot_carbon(slot_times)
+
+    # Household baseline from the customer's recent readings, typical profile otherwise
+    slot_of_day = (slot_times % READING_BLOCK_SECONDS) // READING_INTERVAL_SECONDS
+    baseline_kw = np.repeat(typical_load_profile()[:24], 2)[slot_of_day]
+    if "user" in session:
+        database = sqlite3.connect("database.db")
+        try:
+            cursor = database.cursor()
+            customer_id = get_session_customer_id(cursor)
+            if customer_id is not None:
+                end = int(time.time()) // READING_BLOCK_SECONDS * READING_BLOCK_SECONDS
+                start = end - EV_BASELINE_DAYS * READING_BLOCK_SECONDS
+                day_starts, blocks = fetch_reading_blocks(cursor, customer_id, start, end)
+                if len(day_starts):
+                    baseline_kw = baseline_by_slot_of_day(
+                        np.where(blocks == MISSING_WH, np.nan, blocks)[None].astype(np.float64))[0][slot_of_day]
+        finally:
+            database.close()
+
+    costs = prices if objective == "cost" else carbon
+    energy_kwh = plan_ev_charging(costs, baseline_kw, charger_kw, required_kwh, max_import_kw)[0]
+    immediate_kwh = plan_immediate_charging(baseline_kw[None], charger_kw, required_kwh, max_import_kw)[0]
+    delivered = float(energy_kwh.sum())
+
+    return jsonify({
+        "success": True,
+        "objective": objective,
+        "slots": [{
+            "start": datetime.fromtimestamp(slot).strftime("%d/%m %H:%M"),
+            "price": round(float(price), 4),
+            "carbon_g_per_kwh": int(intensity),
+            "baseline_kw": round(float(baseline), 2),
+            "charge_kw": round(float(energy) / 0.5, 2)
+        } for slot, price, intensity, baseline, energy in zip(slot_times.tolist(), prices, carbon, baseline_kw,
+                                                              energy_kwh)],
+        "delivered_kwh": round(delivered, 2),
+        "shortfall_kwh": round(max(required_kwh - delivered, 0), 2),
+        "cost_gbp": round(float(energy_kwh @ prices), 2),
+        "immediate_cost_gbp": round(float(immediate_kwh @ prices), 2),
+        "carbon_kg": round(float(energy_kwh @ carbon) / 1000, 2),
+        "immediate_carbon_kg": round(float(immediate_kwh @ carbon) / 1000, 2)
+    })
+
+
+@app.cli.command("ev-fleet-report")
+@click.option("--required-kwh", default=30.0, show_default=True, help="Energy each car needs")
+@click.option("--charger-kw", default=EV_DEFAULT_CHARGER_KW, show_default=True, help="Charger power")
+@click.option("--plug-in", "plug_in_hour", default=18, show_default=True, help="Hour cars are plugged in")
+@click.option("--departure", "departure_hour", default=7, show_default=True, help="Hour cars leave next day")
+def ev_fleet_report_command(required_kwh, charger_kw, plug_in_hour, departure_hour):
+    """Plan tonight's cheapest charging for every customer with an EV charger installed."""
+    today = datetime.now().date()
+    plug_in = datetime.combine(today, datetime.min.time()) + timedelta(hours=plug_in_hour)
+    departure = datetime.combine(today + timedelta(days=1), datetime.min.time()) + timedelta(hours=departure_hour)
+    slot_times = np.arange(int(plug_in.timestamp()), int(departure.timestamp()), 1800, dtype=np.int64)
+
+    database = analytics_connection()
+    try:
+        cursor = database.cursor()
+        cursor.execute("""
+            SELECT DISTINCT b.customer_id FROM bookings b
+            JOIN consultations c ON b.consultation_id = c.id
+            JOIN products p ON c.product_id = p.id
+            WHERE p.type = 'EV charging stations' AND NOT b.maintenance
+        """)
+        ev_customers = np.array(sorted(row[0] for row in cursor.fetchall()), dtype=np.int64)
+
+        end = int(time.time()) // READING_BLOCK_SECONDS * READING_BLOCK_SECONDS
+        customer_ids, half_hours = load_half_hourly_matrix(cursor, 0, 1, end - EV_BASELINE_DAYS * 86400, end)
+    finally:
+        database.close()
+
+    # Customers without readings get the typical profile
+    baseline = np.tile(np.repeat(typical_load_profile()[:24], 2), (len(ev_customers), 1))
+    has_readings = np.isin(ev_customers, customer_ids)
+    baseline[has_readings] = baseline_by_slot_of_day(
+        half_hours[np.searchsorted(customer_ids, ev_customers[has_readings])])
+    baseline_kw = baseline[:, (slot_times % READING_BLOCK_SECONDS) // READING_INTERVAL_SECONDS]
+
+    prices = default_slot_prices(slot_times)
+    planned = plan_ev_charging(prices, baseline_kw, charger_kw, required_kwh, EV_DEFAULT_MAX_IMPORT_KW)
+    immediate = plan_immediate_charging(baseline_kw, charger_kw, required_kwh, EV_DEFAULT_MAX_IMPORT_KW)
+
+    planned_cost = planned @ prices
+    immediate_cost = immediate @ prices
+    click.echo(f"Customers: {len(ev_customers)}")
+    click.echo(f"Planned cost: {planned_cost.sum():.2f} GBP, charging on arrival: {immediate_cost.sum():.2f} GBP")
+    click.echo(f"Saving: {(immediate_cost - planned_cost).sum():.2f} GBP, "
+               f"short of target: {(planned.sum(axis=1) < required_kwh - 1e-6).sum()} customers")
+
+
+#   Background Jobs
+# A durable queue in database.db. Work is enqueued on the caller's cursor so it commits or rolls back
+# with the change that caused it. Workers claim due jobs in batches by pushing run_at past a
+# visibility timeout, so jobs held by a worker that dies become due again; failures retry with
+# exponential backoff and move to dead_jobs once their attempts are used up
+JOB_BATCH_SIZE = 200
+JOB_VISIBILITY_SECONDS = 300
+JOB_BACKOFF_SECONDS = 5
+JOB_MAX_BACKOFF_SECONDS = 3600
+JOB_IDLE_SECONDS = 0.2
+JOB_COMMIT_ATTEMPTS = 5
+
+job_handlers = {}  # kind -> (handler, max attempts, visibility seconds)
+# Kinds the workers enqueue themselves, every so many seconds
+periodic_jobs = {
+    "sweep_sessions": 3600,
+    "visit_reminders": 86400,
+    "plan_routes": 86400,
+    "detect_anomalies": 86400,
+    "run_forecasts": 86400,
+    "archive_readings": 7 * 86400,
+    "refresh_rollups": 7 * 86400,
+    "reconcile_reports": 86400,
+    "refresh_replica": 900,
+    "regional_baselines": 86400,
+}
+
+
+def job_handler(kind, max_attempts=5, visibility=JOB_VISIBILITY_SECONDS):
+    def register(handler):
+        job_handlers[kind] = (handler, max_attempts, visibility)
+        return handler
+
+    return register
+
+
+def enqueue_job(cursor, kind, payload=None, delay=0):
+    # Nothing runs until the caller's transaction commits
+    now = time.time()
+    cursor.execute("INSERT INTO job_queue (kind, payload, run_at, enqueued_time) VALUES (?, ?, ?, ?)",
+                   (kind, msgspec.json.encode(payload or {}), now + delay, now))
+
+    return cursor.lastrowid
+
+
+def schedule_periodic_jobs(cursor, now):
+    # Runs inside the claim transaction, so each interval is enqueued by exactly one worker
+    cursor.executemany("INSERT OR IGNORE INTO periodic_jobs (kind, next_run) VALUES (?, ?)",
+                       [(kind, now) for kind in periodic_jobs])
+    cursor.execute("SELECT kind FROM periodic_jobs WHERE next_run <= ?", (now,))
+    for (kind,) in cursor.fetchall():
+        if kind in periodic_jobs:
+            cursor.execute("UPDATE periodic_jobs SET next_run = ? WHERE kind = ?", (now + periodic_jobs[kind], kind))
+            enqueue_job(cursor, kind)
+
+
+def claim_jobs(cursor, worker, batch_size, periodic):
+    now = time.time()
+    cursor.execute("BEGIN IMMEDIATE")
+    if periodic:
+        schedule_periodic_jobs(cursor, now)
+    cursor.execute("""
+        UPDATE job_queue SET run_at = ?, attempts = attempts + 1, claimed_by = ?
+        WHERE id IN (SELECT id FROM job_queue WHERE run_at <= ? ORDER BY run_at LIMIT ?)
+        RETURNING id, kind, payload, enqueued_time, attempts
+    """, (now + JOB_VISIBILITY_SECONDS, worker, now, batch_size))
+    jobs = sorted(cursor.fetchall())
+    cursor.connection.commit()
+
+    return jobs, now
+
+
+def finish_jobs(cursor, worker, outcomes, released):
+    # Acknowledges a batch in one transaction: deletes successes, reschedules or buries failures
+    now = time.time()
+    done, retries, dead, stats = [], [], [], {}
+    for job_id, kind, enqueued_time, attempts, started, finished, error in outcomes:
+        kind_stats = stats.setdefault(kind, [0, 0, 0, 0.0, 0.0, 0.0])
+        if error is None:
+            done.append((job_id, worker))
+            kind_stats[0] += 1
+            kind_stats[3] += started - enqueued_time
+            kind_stats[4] = max(kind_stats[4], started - enqueued_time)
+        elif attempts < job_handlers.get(kind, (None, 1))[1]:
+            backoff = min(JOB_BACKOFF_SECONDS * 2 ** (attempts - 1), JOB_MAX_BACKOFF_SECONDS)
+            retries.append((now + backoff * (0.5 + np.random.random()), error, job_id, worker))
+            kind_stats[1] += 1
+        else:
+            dead.append((now, error, job_id, worker))
+            kind_stats[2] += 1
+        kind_stats[5] += finished - started
+
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.executemany("DELETE FROM job_queue WHERE id = ? AND claimed_by = ?", done)
+    cursor.executemany("""
+        UPDATE job_queue SET run_at = ?, claimed_by = NULL, last_error = ? WHERE id = ? AND claimed_by = ?
+    """, retries)
+    cursor.executemany("""
+        INSERT INTO dead_jobs (id, kind, payload, enqueued_time, attempts, failed_time, error)
+        SELECT id, kind, payload, enqueued_time, attempts, ?, ? FROM job_queue WHERE id = ? AND claimed_by = ?
+    """, dead)
+    cursor.executemany("DELETE FROM job_queue WHERE id = ? AND claimed_by = ?", [row[2:] for row in dead])
+    # Jobs left unstarted when the batch ran long go back without using an attempt
+    cursor.executemany("""
+        UPDATE job_queue SET run_at = ?, attempts = attempts - 1, claimed_by = NULL WHERE id = ? AND claimed_by = ?
+    """, [(now, job_id, worker) for job_id in released])
+    cursor.executemany("""
+        INSERT INTO job_stats (kind, completed, retried, dead, wait_seconds, max_wait_seconds, run_seconds)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (kind) DO UPDATE SET
+            completed = completed + excluded.completed, retried = retried + excluded.retried,
+            dead = dead + excluded.dead, wait_seconds = wait_seconds + excluded.wait_seconds,
+            max_wait_seconds = MAX(max_wait_seconds, excluded.max_wait_seconds),
+            run_seconds = run_seconds + excluded.run_seconds
+    """, [(kind, *kind_stats) for kind, kind_stats in stats.items()])
+    cursor.connection.commit()
+
+
+def run_job_worker(batch_size, burst):
+    # Claims, runs and acknowledges batches until stopped, or until nothing is due in burst mode
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    database = sqlite3.connect("database.db", timeout=30)
+    database.execute("PRAGMA synchronous = NORMAL")
+    cursor = database.cursor()
+    processed = 0
+
+    try:
+        while True:
+            jobs, claimed_time = claim_jobs(cursor, worker, batch_size, periodic=not burst)
+            if not jobs:
+                if burst:
+                    return processed
+                time.sleep(JOB_IDLE_SECONDS)
+                continue
+
+            outcomes, released = [], []
+            for job_id, kind, payload, enqueued_time, attempts in jobs:
+                # Hand back the rest of a batch that is running into its visibility timeout
+                if time.time() - claimed_time > JOB_VISIBILITY_SECONDS / 2:
+                    released.append(job_id)
+                    continue
+
+                started = time.time()
+                try:
+                    handler, _, visibility = job_handlers[kind]
+                    if visibility != JOB_VISIBILITY_SECONDS:
+                        cursor.execute("UPDATE job_queue SET run_at = ? WHERE id = ? AND claimed_by = ?",
+                                       (started + visibility, job_id, worker))
+                        database.commit()
+                    handler(**msgspec.json.decode(payload))
+                    error = None
+                except Exception as exception:
+                    error = f"{type(exception).__name__}: {exception}"
+                outcomes.append((job_id, kind, enqueued_time, attempts, started, time.time(), error))
+
+            for attempt in range(JOB_COMMIT_ATTEMPTS):
+                try:
+                    finish_jobs(cursor, worker, outcomes, released)
+                    break
+                except sqlite3.OperationalError as error:
+                    database.rollback()
+                    app.logger.warning("Job acknowledgement failed, retrying: %s", error)
+                    time.sleep(0.1 * 2 ** attempt)
+            else:
+                app.logger.error("Couldn't acknowledge %d jobs; they run again after their visibility timeout",
+                                 len(outcomes))
+            processed += len(outcomes)
+    finally:
+        database.close()
+
+
+@job_handler("notify_customer")
+def notify_customer_job(customer_id, subject, body):
+    # Mail goes out through SMTP_HOST when it is configured
+    if not os.getenv("SMTP_HOST") or not os.getenv("MAIL_FROM"):
+        return
+
+    database = sqlite3.connect("database.db")
+    try:
+        customer = database.execute("SELECT email, full_name FROM customers WHERE id = ?", (customer_id,)).fetchone()
+    finally:
+        database.close()
+    if not customer:
+        return
+
+    message = EmailMessage()
+    message["From"] = os.getenv("MAIL_FROM")
+    message["To"] = customer[0]
+    message["Subject"] = subject
+    message.set_content(f"Hello {customer[1] or 'there'},\n\n{html.unescape(body)}\n\nRolsa Technologies")
+
+    with smtplib.SMTP(os.getenv("SMTP_HOST"), int(os.getenv("SMTP_PORT", "587")), timeout=30) as smtp:
+        if os.getenv("SMTP_USER"):
+            smtp.starttls()
+            smtp.login(os.getenv("SMTP_USER"), os.getenv("SMTP_PASSWORD", ""))
+        smtp.send_message(message)
+
+
+@job_handler("visit_reminders")
+def visit_reminders_job():
+    # One reminder per visit tomorrow, each sent and retried as its own job
+    tomorrow = datetime.now().date() + timedelta(days=1)
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            SELECT c.customer_id, c.status, p.type FROM consultations c
+            JOIN products p ON p.id = c.product_id
+            WHERE c.preferred_date = ?
+        """, (tomorrow.isoformat(),))
+        for customer_id, status, product_type in cursor.fetchall():
+            request_type = get_request_type(status).lower()
+            enqueue_job(cursor, "notify_customer", {
+                "customer_id": customer_id,
+                "subject": f"Reminder: your {request_type} is tomorrow",
+                "body": f"Your {product_type.lower()} {request_type} is tomorrow, {tomorrow:%d %B %Y}."
+            })
+        database.commit()
+    finally:
+        database.close()
+
+
+@job_handler("sweep_sessions")
+def sweep_sessions_job():
+    # Session files start with their expiry time; zero means they never expire
+    now = time.time()
+    if os.path.isdir(app.config["SESSION_FILE_DIR"]):
+        for entry in os.scandir(app.config["SESSION_FILE_DIR"]):
+            try:
+                with open(entry.path, "rb") as file:
+                    expires = struct.unpack("I", file.read(4))[0]
+                if 0 < expires < now:
+                    os.remove(entry.path)
+            except (OSError, struct.error):
+                continue
+
+    # Every poller has long since read these
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        database.execute("DELETE FROM change_events WHERE created_time < ?", (now - EVENT_RETENTION_SECONDS,))
+        database.commit()
+    finally:
+        database.close()
+
+
+@job_handler("plan_routes", visibility=1800)
+def plan_routes_job(day=None):
+    plan_day_routes(date.fromisoformat(day) if day else datetime.now().date() + timedelta(days=1),
+                    os.cpu_count() or 1)
+
+
+@job_handler("detect_anomalies", max_attempts=3, visibility=3600)
+def detect_anomalies_job():
+    detect_anomalies(os.cpu_count() or 1)
+
+
+@job_handler("run_forecasts", max_attempts=3, visibility=3600)
+def run_forecasts_job():
+    # Nothing to run until train-forecasts has produced the fallback model
+    if os.path.exists(forecast_model_path("all")):
+        run_forecasts()
+
+
+@job_handler("archive_readings", max_attempts=3, visibility=3600)
+def archive_readings_job():
+    archive_readings(ARCHIVE_AFTER_DAYS)
+
+
+@job_handler("refresh_rollups")
+def refresh_rollups_job():
+    # Fans out one rebuild per customer so a large estate spreads across the workers
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("SELECT DISTINCT customer_id FROM meter_readings")
+        customer_ids = sorted({row[0] for row in cursor.fetchall()} | archived_customer_ids())
+        cursor.execute("BEGIN IMMEDIATE")
+        for customer_id in customer_ids:
+            enqueue_job(cursor, "rebuild_rollups", {"customer_id": customer_id})
+        database.commit()
+    finally:
+        database.close()
+
+
+@job_handler("rebuild_rollups")
+def rebuild_rollups_job(customer_id):
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        rebuild_rollups(cursor, customer_id)
+        database.commit()
+    finally:
+        database.close()
+
+
+@job_handler("reconcile_reports", visibility=1800)
+def reconcile_reports_job():
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        corrected = reconcile_report_stats(cursor)
+        database.commit()
+    finally:
+        database.close()
+
+    if corrected:
+        app.logger.info("Report reconciliation corrected %d summary rows", corrected)
+
+
+@job_handler("refresh_replica", max_attempts=3, visibility=1800)
+def refresh_replica_job():
+    refresh_replica()
+
+
+@job_handler("regional_baselines", max_attempts=3, visibility=1800)
+def regional_baselines_job():
+    refresh_regional_baselines()
+
+
+@app.route("/api/jobs/metrics", methods=["GET"])
+def job_metrics():
+    if not staff_authorised():
+        return jsonify({"success": False, "error": "Invalid staff API key"}), 401
+
+    try:
+        database = sqlite3.connect("database.db")
+        cursor = database.cursor()
+        now = time.time()
+
+        # Queue depth and how long the oldest due job has been waiting, per kind
+        cursor.execute("""
+            SELECT kind, COUNT(*), SUM(run_at <= ?), SUM(claimed_by IS NOT NULL AND run_at > ?),
+                   MIN(CASE WHEN run_at <= ? THEN run_at END)
+            FROM job_queue GROUP BY kind
+        """, (now, now, now))
+        kinds = {kind: {"queued": queued, "due": due, "running": running,
+                        "oldest_due_seconds": round(now - oldest_due, 3) if oldest_due else 0.0}
+                 for kind, queued, due, running, oldest_due in cursor.fetchall()}
+
+        cursor.execute("SELECT kind, COUNT(*) FROM dead_jobs GROUP BY kind")
+        dead = dict(cursor.fetchall())
+
+        cursor.execute("""
+            SELECT kind, completed, retried, dead, wait_seconds, max_wait_seconds, run_seconds FROM job_stats
+        """)
+        for kind, completed, retried, buried, wait_seconds, max_wait_seconds, run_seconds in cursor.fetchall():
+            kinds.setdefault(kind, {"queued": 0, "due": 0, "running": 0, "oldest_due_seconds": 0.0}).update({
+                "completed": completed,
+                "retried": retried,
+                "dead_lettered": buried,
+                "mean_wait_seconds": round(wait_seconds / completed, 3) if completed else 0.0,
+                "max_wait_seconds": round(max_wait_seconds, 3),
+                "mean_run_seconds": round(run_seconds / (completed + retried + buried), 4)
+                if completed + retried + buried else 0.0
+            })
+        for kind, count in dead.items():
+            kinds.setdefault(kind, {"queued": 0, "due": 0, "running": 0, "oldest_due_seconds": 0.0})["dead"] = count
+
+        return jsonify({"success": True, "metrics": {
+            "queued": sum(metrics["queued"] for metrics in kinds.values()),
+            "dead": sum(dead.values()),
+            "oldest_due_seconds": max((metrics["oldest_due_seconds"] for metrics in kinds.values()), default=0.0),
+            "kinds": kinds
+        }})
+    except Exception as error:
+        return jsonify({"success": False, "error": f"An error occurred: {error}"}), 500
+    finally:
+        database.close()
+
+
+@app.cli.command("run-workers")
+@click.option("--processes", default=os.cpu_count() or 1, show_default=True, help="Worker processes")
+@click.option("--batch-size", default=JOB_BATCH_SIZE, show_default=True, help="Jobs claimed per transaction")
+@click.option("--burst", is_flag=True, help="Exit once no jobs are due, without scheduling periodic jobs")
+def run_workers_command(processes, batch_size, burst):
+    """Run background jobs from the queue."""
+    if processes == 1:
+        click.echo(f"Processed {run_job_worker(batch_size, burst)} jobs")
+        return
+
+    workers = [multiprocessing.Process(target=run_job_worker, args=(batch_size, burst)) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+@app.cli.command("requeue-dead-jobs")
+@click.option("--kind", default=None, help="Only requeue jobs of this kind")
+def requeue_dead_jobs_command(kind):
+    """Move dead-lettered jobs back onto the queue with fresh attempts."""
+    database = sqlite3.connect("database.db", timeout=30)
+    try:
+        cursor = database.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("""
+            INSERT INTO job_queue (kind, payload, run_at, enqueued_time)
+            SELECT kind, payload, ?, enqueued_time FROM dead_jobs WHERE ? IS NULL OR kind = ?
+        """, (time.time(), kind, kind))
+        requeued = cursor.rowcount
+        cursor.execute("DELETE FROM dead_jobs WHERE ? IS NULL OR kind = ?", (kind, kind))
+        database.commit()
+    finally:
+        database.close()
+
+    click.echo(f"Requeued {requeued} jobs")
 
 
 #   About Page
@@ -720,6 +5613,7 @@ def about():
 @app.route("/logout")
 def logout():
     session.pop("user", None)
+    session.pop("customer_id", None)
     return redirect(url_for("home"))
 
 
@@ -9,6 +9,7 @@ CREATE TABLE IF NOT EXISTS consultations (
     product_id INTEGER NOT NULL,
     preferred_date DATE NOT NULL,
     postcode TEXT NOT NULL,
+    region TEXT,
     property_type TEXT NOT NULL,
     status TEXT NOT NULL,
     customer_id INTEGER NOT NULL
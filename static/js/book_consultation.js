@@ -3,6 +3,49 @@
     book_consultation.js
 */
 
+// Availability bitmaps by product, postcode and month, so moving around the calendar reuses them
+const availability = {};
+
+// Whether installers are free on a YYYY-MM-DD date, or null when it can't be checked
+async function date_available(product, postcode, date_value) {
+    const month = date_value.slice(0, 7);
+    const key = `${product}|${postcode}|${month}`;
+
+    if (!(key in availability)) {
+        const response = await fetch(`/api/availability?product=${encodeURIComponent(product)}` +
+            `&postcode=${encodeURIComponent(postcode)}&month=${month}`);
+        const result = await response.json();
+        if (!result.success) return null;
+        availability[key] = result.bitmap;
+    }
+
+    return ((availability[key] >> (parseInt(date_value.slice(8, 10), 10) - 1)) & 1) === 1;
+}
+
+// Warn about unavailable dates as soon as product, postcode and date are all filled in
+async function check_date() {
+    const error_message = document.querySelector(".error-message");
+    const product_type = document.getElementById("product").value;
+    const postcode = document.getElementById("postcode").value;
+    const preferred_date = document.getElementById("date").value;
+    if (!product_type || !postcode || !preferred_date) return true;
+
+    const unavailable = "No installers are free on that date, please pick another";
+    try {
+        if (await date_available(product_type, postcode, preferred_date) === false) {
+            error_message.textContent = unavailable;
+            return false;
+        }
+        if (error_message.textContent === unavailable) error_message.textContent = "";
+    } catch (error) {
+        console.error("Error checking availability:", error);
+    }
+    return true;
+}
+
+document.getElementById("date").addEventListener("change", check_date);
+document.getElementById("product").addEventListener("change", check_date);
+
 // Dynamically add to the Product Type dropdown and parameter product
 document.addEventListener("DOMContentLoaded", async () => {
     const product_dropdown = document.getElementById("product");
@@ -36,6 +79,30 @@ document.addEventListener("DOMContentLoaded", async () => {
     }
 });
 
+// Check the postcode as soon as it is entered
+document.getElementById("postcode").addEventListener("change", async (event) => {
+    const error_message = document.querySelector(".error-message");
+    const postcode = event.target.value;
+    if (!postcode) return;
+
+    try {
+        const response = await fetch(`/api/postcode?postcode=${encodeURIComponent(postcode)}`);
+        const result = await response.json();
+
+        if (!result.success) {
+            error_message.textContent = result.error;
+        } else if (!result.covered) {
+            error_message.textContent = `Sorry, we don't cover ${result.postcode} yet`;
+        } else {
+            event.target.value = result.postcode;
+            error_message.textContent = "";
+            check_date();
+        }
+    } catch (error) {
+        console.error("Error checking postcode:", error);
+    }
+});
+
 // Submit consultation to app
 document.querySelector(".confirm-button").addEventListener("click", async () => {
     const error_message = document.querySelector(".error-message");
@@ -84,6 +151,8 @@ document.querySelector(".confirm-button").addEventListener("click", async () =>
         return;
     }
 
+    if (!await check_date()) return;
+
     const consultation_data = {
         full_name: fullname,
         product_type: product_type,
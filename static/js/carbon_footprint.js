@@ -4,6 +4,89 @@
 */
 
 let current_type = null;
+let emission_factors = null;
+let sensitivity_chart = null;
+
+// Each input is swept from none to double its current value, in quarters
+const sensitivity_steps = [0, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 1.75, 2];
+const sensitivity_inputs = {
+    individual: { transport_miles: "Driving", electricity_kwh: "Electricity", meat_meals: "Meat meals" },
+    commercial: { electricity_kwh: "Electricity", gas_kwh: "Gas", waste_tonnes: "Waste" }
+};
+
+// Current factors are cached by the browser, so estimates need no round trip once loaded
+fetch("/api/emission-factors")
+    .then(response => response.json())
+    .then(factors => { emission_factors = factors; })
+    .catch(error => console.error("Couldn't load emission factors:", error));
+
+function estimate_footprint(data, factors) {
+    if (data.type === "individual") {
+        return (data.transport_miles * factors.individual.transport_miles +
+                data.electricity_kwh * 12 * factors.individual.electricity_kwh +
+                data.meat_meals * 52 * factors.individual.meat_meals) / 1000;
+    }
+    return (data.electricity_kwh * 12 * factors.commercial.electricity_kwh +
+            data.gas_kwh * 12 * factors.commercial.gas_kwh +
+            data.waste_tonnes * factors.commercial.waste_tonnes) / 1000;
+}
+
+function show_results(footprint, average) {
+    document.getElementById("user-impact").textContent = footprint;
+    document.getElementById("avg-impact").textContent = average;
+    document.getElementById("results-section").style.display = "block";
+    document.getElementById("error-message").style.display = "none";
+}
+
+// One request returns the whole grid; each line is read along one axis with the others at today's values
+function draw_sensitivity(data) {
+    const labels = sensitivity_inputs[data.type];
+    const axes = {};
+    Object.keys(labels).forEach(name => {
+        axes[name] = sensitivity_steps.map(step => data[name] * step);
+    });
+
+    fetch("/get-carbon/scenarios", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ type: data.type, axes: axes, factors_version: data.factors_version })
+    })
+    .then(response => response.json())
+    .then(result => {
+        if (!result.success) {
+            console.error("Couldn't get scenarios:", result.error);
+            return;
+        }
+
+        const strides = result.shape.map((_, axis) =>
+            result.shape.slice(axis + 1).reduce((product, size) => product * size, 1));
+        const current = sensitivity_steps.indexOf(1);
+        const base_index = strides.reduce((index, stride) => index + current * stride, 0);
+
+        const datasets = result.axes.map((axis, position) => ({
+            label: labels[axis.name],
+            data: sensitivity_steps.map((_, step) =>
+                result.footprints[base_index + (step - current) * strides[position]]),
+            fill: false,
+            tension: 0.2
+        }));
+
+        if (sensitivity_chart) sensitivity_chart.destroy();
+        sensitivity_chart = new Chart(document.getElementById("sensitivity-chart").getContext("2d"), {
+            type: "line",
+            data: { labels: sensitivity_steps.map(step => `${step * 100}%`), datasets: datasets },
+            options: {
+                animation: false,
+                scales: {
+                    x: { title: { display: true, text: "Share of your current amount" } },
+                    y: { beginAtZero: true, title: { display: true, text: "Tonnes CO₂e" } }
+                }
+            }
+        });
+        document.getElementById("sensitivity-section").style.display = "block";
+    })
+    .catch(error => console.error("Scenario fetch failed:", error));
+}
 
 function show_form(type) {
     current_type = type;
@@ -79,6 +162,15 @@ function calculate_footprint(type) {
         return;
     }
 
+    // Show the estimate straight away, then let the server confirm it and add any smart meter figures
+    if (emission_factors) {
+        data.factors_version = emission_factors.version;
+        show_results(Math.round(estimate_footprint(data, emission_factors) * 100) / 100,
+            emission_factors.averages[type]);
+    }
+
+    draw_sensitivity(data);
+
     fetch("/get-carbon", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
@@ -91,10 +183,17 @@ function calculate_footprint(type) {
         return response.json();
     })
     .then(result => {
-        document.getElementById("user-impact").textContent = result.footprint;
-        document.getElementById("avg-impact").textContent = result.average;
-        document.getElementById("results-section").style.display = "block";
-        document.getElementById("error-message").style.display = "none";
+        show_results(result.footprint, result.average);
+
+        // Shown when the customer has meter readings to base a time-resolved figure on
+        const metered = document.getElementById("metered-impact");
+        if (result.metered_electricity) {
+            document.getElementById("metered-footprint").textContent = result.metered_electricity.footprint;
+            document.getElementById("metered-days").textContent = result.metered_electricity.days;
+            metered.style.display = "block";
+        } else {
+            metered.style.display = "none";
+        }
     })
     .catch(error => {
         document.getElementById("error-message").textContent = error.message;
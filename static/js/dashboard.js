@@ -4,6 +4,129 @@
 */
 
 let energy_chart = null;
+let event_source = null;
+
+// Escapes text before it is placed into patched markup
+function escape_html(text) {
+    const div = document.createElement("div");
+    div.textContent = text == null ? "" : String(text);
+    return div.innerHTML;
+}
+
+// Availability bitmaps by product, postcode and month, so moving around the calendar reuses them
+const availability = {};
+
+// Whether installers are free on a YYYY-MM-DD date, or null when it can't be checked
+async function date_available(product, postcode, date_value) {
+    const month = date_value.slice(0, 7);
+    const key = `${product}|${postcode}|${month}`;
+
+    if (!(key in availability)) {
+        const response = await fetch(`/api/availability?product=${encodeURIComponent(product)}` +
+            `&postcode=${encodeURIComponent(postcode)}&month=${month}`);
+        const result = await response.json();
+        if (!result.success) return null;
+        availability[key] = result.bitmap;
+    }
+
+    return ((availability[key] >> (parseInt(date_value.slice(8, 10), 10) - 1)) & 1) === 1;
+}
+
+// Matches the Jinja capitalize filter used by the dashboard template
+function capitalize(text) {
+    return text ? text.charAt(0).toUpperCase() + text.slice(1).toLowerCase() : "";
+}
+
+// Builds a consultations table row matching the server-rendered markup
+function build_consultation_row(consultation) {
+    const row = document.createElement("tr");
+    const id = escape_html(consultation.consultation_id);
+    const is_booking = ["Installation", "Maintenance"].includes(consultation.request_type);
+    const status_class = consultation.status.toLowerCase().replaceAll(" ", "-");
+    row.dataset.consultationId = consultation.consultation_id;
+    row.dataset.date = consultation.date_iso;
+
+    let actions = `<a href="#" class="interactive-button cancel-button" data-consultation-id="${id}"
+        role="button" aria-label="Cancel consultation"><div class="interactive-title">Cancel</div></a>`;
+    if (consultation.status === "approved" && consultation.request_type === "Enquiry") {
+        actions += `<a href="#" class="interactive-button schedule-service-button" data-consultation-id="${id}"
+            data-service-type="installation" role="button" aria-label="Schedule installation">
+            <div class="interactive-title">Schedule Installation</div></a>`;
+    }
+
+    row.innerHTML = `
+        <td>${escape_html(consultation.product_id)}</td>
+        <td${is_booking ? ' class="bold"' : ""}>${escape_html(consultation.request_type)}</td>
+        <td>${escape_html(capitalize(consultation.property_type))}</td>
+        <td>${escape_html(consultation.date_scheduled)}</td>
+        <td class="status ${escape_html(status_class)}">${escape_html(capitalize(consultation.status))}</td>
+        <td class="action-cell">${actions}</td>`;
+    return row;
+}
+
+// Inserts, replaces or removes the affected row, keeping date order
+function patch_consultation_row(event_data) {
+    const body = document.getElementById("consultations-body");
+    const existing = body.querySelector(`tr[data-consultation-id="${event_data.consultation_id}"]`);
+    if (existing) existing.remove();
+
+    if (event_data.consultation) {
+        const row = build_consultation_row(event_data.consultation);
+        const after = Array.from(body.querySelectorAll("tr[data-date]"))
+            .find((other) => other.dataset.date > row.dataset.date);
+        body.insertBefore(row, after || null);
+    }
+
+    const empty_row = body.querySelector(".empty-row");
+    const has_rows = body.querySelector("tr[data-consultation-id]") !== null;
+    if (has_rows && empty_row) {
+        empty_row.remove();
+    } else if (!has_rows && !empty_row) {
+        body.innerHTML = '<tr class="empty-row"><td colspan="6">No consultations scheduled yet.</td></tr>';
+    }
+}
+
+// Re-renders the next appointment and latest activity panels
+function patch_activity_panels(event_data) {
+    const next = event_data.next_consultation;
+    const latest = event_data.latest_consultation;
+    const cancellation = event_data.last_cancellation;
+
+    const next_desc = document.getElementById("next-appointment-desc");
+    if (next) {
+        const request_type = escape_html(next.request_type.toLowerCase());
+        next_desc.innerHTML = `Your next appointment is for a
+            <a href="#" class="consultation-link" data-consultation-id="${escape_html(next.consultation_id)}"
+               aria-label="View consultation details for ${request_type} on ${escape_html(next.date_scheduled)}">
+                <b class="installation">${request_type}</b>,
+                scheduled for <b class="b">${escape_html(next.date_scheduled)}</b></a>`;
+    } else {
+        next_desc.textContent = "No upcoming appointments scheduled.";
+    }
+
+    const latest_desc = document.getElementById("latest-activity-desc");
+    if (cancellation) {
+        latest_desc.innerHTML = `The <b class="installation">${escape_html(cancellation.request_type.toLowerCase())}</b>
+            consultation for product <b class="installation">${escape_html(cancellation.product_type.toLowerCase())}</b>
+            was cancelled today at<b class="b"> ${escape_html(cancellation.timestamp)}</b>.`;
+    } else if (latest) {
+        const request_type = escape_html(latest.request_type.toLowerCase());
+        latest_desc.innerHTML = `Your status for a
+            <a href="#" class="consultation-link" data-consultation-id="${escape_html(latest.consultation_id)}"
+               aria-label="View consultation details for ${request_type}">
+                <b class="installation">${request_type}</b></a>
+            has been updated to <b class="b">${escape_html(latest.status)}</b>.`;
+    } else {
+        latest_desc.textContent = "No recent activity.";
+    }
+}
+
+// Only reload when live updates are unavailable
+function refresh_if_offline() {
+    if (!event_source || event_source.readyState !== EventSource.OPEN) {
+        window.location.reload();
+    }
+}
 
 function close_popup() {
     const popup = document.getElementById("popup-container");
@@ -34,6 +157,10 @@ document.addEventListener("DOMContentLoaded", () => {
                 const daily_usage_elem = document.getElementById("tab-daily-usage");
                 if (data.success) {
                     daily_usage_elem.textContent = `${data.daily_usage} kWh`;
+                    if (data.anomalies.length > 0) {
+                        document.getElementById("tab-usage-alert").textContent =
+                            "Unusual usage detected this week";
+                    }
                 } else {
                     console.error("Couldn't get energy data:", data.error);
                     daily_usage_elem.textContent = "N/A";
@@ -48,50 +175,62 @@ document.addEventListener("DOMContentLoaded", () => {
     // Run this when the page loads
     fetch_daily_usage();
 
-    // Highlight a consultation row when clicked from activity
-    document.querySelectorAll(".consultation-link").forEach((link) => {
-        link.addEventListener("click", (e) => {
-            e.preventDefault();
-            const consultation_id = link.dataset.consultationId;
-            const row = document.querySelector(`tr[data-consultation-id="${consultation_id}"]`);
-
-            if (row) {
-                row.scrollIntoView({ behavior: "smooth" });
-                row.querySelectorAll("td").forEach((cell) => {
-                    cell.classList.add("highlight");
-                    // Remove highlight after a couple seconds
-                    setTimeout(() => cell.classList.remove("highlight"), 2000);
-                });
-            }
+    // Subscribe to live consultation changes for this customer
+    if (window.EventSource) {
+        event_source = new EventSource("/api/events");
+        event_source.addEventListener("consultation", (e) => {
+            const event_data = JSON.parse(e.data);
+            patch_consultation_row(event_data);
+            patch_activity_panels(event_data);
         });
+    }
+
+    // Highlight a consultation row when clicked from activity
+    document.addEventListener("click", (e) => {
+        const link = e.target.closest(".consultation-link");
+        if (!link) return;
+
+        e.preventDefault();
+        const consultation_id = link.dataset.consultationId;
+        const row = document.querySelector(`tr[data-consultation-id="${consultation_id}"]`);
+
+        if (row) {
+            row.scrollIntoView({ behavior: "smooth" });
+            row.querySelectorAll("td").forEach((cell) => {
+                cell.classList.add("highlight");
+                // Remove highlight after a couple seconds
+                setTimeout(() => cell.classList.remove("highlight"), 2000);
+            });
+        }
     });
 
     // Handle consultation cancellations
-    document.querySelectorAll(".cancel-button").forEach((btn) => {
-        btn.addEventListener("click", (e) => {
-            e.preventDefault();
-            const consultation_id = btn.dataset.consultationId;
+    document.getElementById("consultations-body").addEventListener("click", (e) => {
+        const btn = e.target.closest(".cancel-button");
+        if (!btn) return;
 
-            fetch("/cancel-consultation", {
-                method: "POST",
-                headers: { "Content-Type": "application/x-www-form-urlencoded" },
-                body: `consultation_id=${consultation_id}`,
+        e.preventDefault();
+        const consultation_id = btn.dataset.consultationId;
+
+        fetch("/cancel-consultation", {
+            method: "POST",
+            headers: { "Content-Type": "application/x-www-form-urlencoded" },
+            body: `consultation_id=${consultation_id}`,
+        })
+            .then((res) => res.json())
+            .then((data) => {
+                if (data.success) {
+                    // Live events patch the table, reload only as a fallback
+                    refresh_if_offline();
+                } else {
+                    console.error("Cancellation failed:", data.error);
+                    alert("Couldn't cancel the consultation: " + data.error);
+                }
             })
-                .then((res) => res.json())
-                .then((data) => {
-                    if (data.success) {
-                        // Refresh to show updated activity
-                        window.location.reload();
-                    } else {
-                        console.error("Cancellation failed:", data.error);
-                        alert("Couldn't cancel the consultation: " + data.error);
-                    }
-                })
-                .catch((err) => {
-                    console.error("Error during cancellation:", err);
-                    alert("Something went wrong while canceling");
-                });
-        });
+            .catch((err) => {
+                console.error("Error during cancellation:", err);
+                alert("Something went wrong while canceling");
+            });
     });
 
     // Open schedule popup for service/installation
@@ -120,6 +259,26 @@ document.addEventListener("DOMContentLoaded", () => {
             service_type === "maintenance" ? "Schedule Maintenance" : "Schedule Installation";
         service_input.value = service_type;
 
+        // Product and postcode of each consultation, for checking the picked date
+        const consultations = {};
+        const check_date = async () => {
+            const consult = consultations[select_consult.value];
+            if (!consult || !date_input.value) return true;
+
+            try {
+                if (await date_available(consult.product_type, consult.postcode, date_input.value) === false) {
+                    error_message.textContent = "No installers are free on that date, please pick another";
+                    return false;
+                }
+            } catch (err) {
+                console.error("Error checking availability:", err);
+            }
+            error_message.textContent = "";
+            return true;
+        };
+        date_input.onchange = check_date;
+        select_consult.onchange = check_date;
+
         // Populate consultation dropdown
         fetch("/api/consultations")
             .then((res) => {
@@ -134,6 +293,7 @@ document.addEventListener("DOMContentLoaded", () => {
                     select_consult.disabled = true;
                 } else {
                     data.consultations.forEach((consult) => {
+                        consultations[consult.id] = consult;
                         const date_section = consult.date_scheduled.split("-");
                         const date_formatted = `${date_section[2]}/${date_section[1]}/${date_section[0]}`;
                         const status = consult.status.charAt(0).toUpperCase() + consult.status.slice(1);
@@ -159,7 +319,7 @@ document.addEventListener("DOMContentLoaded", () => {
         popup.style.display = "flex";
 
         // Handle form submission
-        form.onsubmit = (e) => {
+        form.onsubmit = async (e) => {
             e.preventDefault();
             success_message.textContent = "";
             error_message.textContent = "";
@@ -177,6 +337,7 @@ document.addEventListener("DOMContentLoaded", () => {
                 error_message.textContent = "Date must be in the future";
                 return;
             }
+            if (!await check_date()) return;
 
             const form_data = new FormData(form);
             fetch("/schedule-request", {
@@ -192,7 +353,7 @@ document.addEventListener("DOMContentLoaded", () => {
                         success_message.textContent = "Scheduled successfully!";
                         setTimeout(() => {
                             close_popup();
-                            window.location.reload();
+                            refresh_if_offline();
                         }, 1500);
                     } else {
                         error_message.textContent = data.error || "Scheduling failed";
@@ -205,27 +366,103 @@ document.addEventListener("DOMContentLoaded", () => {
         };
     }
 
-    // Handle schedule service buttons
-    document.querySelectorAll(".schedule-service-button, .consultation-button.maintenance")
-        .forEach((btn) => {
-            btn.addEventListener("click", (e) => {
-                e.preventDefault();
-                const consultation_id = btn.dataset.consultationId || null;
-                const service_type = btn.dataset.serviceType || "maintenance";
-                const status = consultation_id
-                    ? btn.closest("tr").querySelector(".status").textContent.trim().toLowerCase()
-                    : null;
-
-                if (service_type === "installation" && status !== "approved") {
-                    const popup = document.getElementById("popup-container");
-                    popup.querySelector(".error-message").textContent =
-                        "Only approved consultations can be scheduled for installation";
-                    popup.style.display = "flex";
-                } else {
-                    show_schedule(consultation_id, service_type);
+    // Handle schedule service buttons, including rows patched in by live events
+    document.addEventListener("click", (e) => {
+        const btn = e.target.closest(".schedule-service-button, .consultation-button.maintenance");
+        if (!btn) return;
+
+        e.preventDefault();
+        const consultation_id = btn.dataset.consultationId || null;
+        const service_type = btn.dataset.serviceType || "maintenance";
+        const status = consultation_id
+            ? btn.closest("tr").querySelector(".status").textContent.trim().toLowerCase()
+            : null;
+
+        if (service_type === "installation" && status !== "approved") {
+            const popup = document.getElementById("popup-container");
+            popup.querySelector(".error-message").textContent =
+                "Only approved consultations can be scheduled for installation";
+            popup.style.display = "flex";
+        } else {
+            show_schedule(consultation_id, service_type);
+        }
+    });
+
+    // Number of days shown by each chart range, ending today
+    const energy_ranges = { day: 1, week: 7, month: 30, year: 365 };
+    const resolution_units = { half_hour: "half hour", hour: "hour", day: "day", month: "month" };
+
+    function local_date(date) {
+        const month = String(date.getMonth() + 1).padStart(2, "0");
+        const day = String(date.getDate()).padStart(2, "0");
+        return `${date.getFullYear()}-${month}-${day}`;
+    }
+
+    // Draws the usage chart for a range, downsampled by the server to a few hundred points
+    function draw_energy_chart(range) {
+        const end = new Date();
+        end.setDate(end.getDate() + 1);
+        const start = new Date();
+        start.setDate(start.getDate() - energy_ranges[range] + 1);
+
+        document.querySelectorAll(".energy-range").forEach((btn) =>
+            btn.classList.toggle("active", btn.dataset.range === range));
+
+        fetch(`/api/energy-usage/series?start=${local_date(start)}&end=${local_date(end)}&points=300`)
+            .then((res) => res.json())
+            .then((data) => {
+                if (!data.success) {
+                    console.error("Couldn't get energy series:", data.error);
+                    return;
                 }
-            });
-        });
+                const unit = `kWh per ${resolution_units[data.resolution]}`;
+
+                if (energy_chart) energy_chart.destroy();
+
+                const ctx = document.getElementById("energy-usage-chart").getContext("2d");
+                energy_chart = new Chart(ctx, {
+                    type: "line",
+                    data: {
+                        labels: data.labels,
+                        datasets: [
+                            {
+                                label: "Your Usage",
+                                data: data.user_values,
+                                borderColor: "#006837",
+                                fill: false,
+                                tension: 0.3,
+                                pointRadius: data.labels.length > 60 ? 0 : 3,
+                            },
+                            {
+                                label: data.baseline_label,
+                                data: data.national_average,
+                                borderColor: "#8bc349",
+                                fill: false,
+                                tension: 0.3,
+                                pointRadius: 0,
+                            },
+                        ],
+                    },
+                    options: {
+                        responsive: true,
+                        animation: false,
+                        scales: {
+                            y: { beginAtZero: true, title: { display: true, text: unit } },
+                            x: { title: { display: true, text: "Date" }, ticks: { maxTicksLimit: 12 } },
+                        },
+                        plugins: {
+                            legend: { position: "top" },
+                            tooltip: {
+                                callbacks: {
+                                    label: (ctx) => `${ctx.dataset.label}: ${ctx.parsed.y} kWh`,
+                                },
+                            },
+                        },
+                    },
+                });
+            })
+            .catch((err) => console.error("Energy series fetch failed:", err));
+    }
 
     // Open energy usage popup
     function show_energy_popup() {
@@ -240,52 +477,55 @@ document.addEventListener("DOMContentLoaded", () => {
                     document.getElementById("weekly-usage").textContent = `${data.weekly_usage} kWh`;
                     document.getElementById("monthly-usage").textContent = `${data.monthly_usage} kWh`;
                     document.getElementById("avg-daily-usage").textContent = `${data.avg_daily_usage} kWh`;
+                    document.getElementById("forecast-week").textContent =
+                        data.forecast.next_week_kwh === null ? "N/A" : `${data.forecast.next_week_kwh} kWh`;
+                    document.getElementById("forecast-month").textContent =
+                        data.forecast.next_month_kwh === null ? "N/A" : `${data.forecast.next_month_kwh} kWh`;
 
-                    if (energy_chart) energy_chart.destroy();
-
-                    const ctx = document.getElementById("energy-usage-chart").getContext("2d");
-                    energy_chart = new Chart(ctx, {
-                        type: "line",
-                        data: {
-                            labels: data.graph_data.labels,
-                            datasets: [
-                                {
-                                    label: "Your Usage",
-                                    data: data.graph_data.user_values,
-                                    borderColor: "#006837",
-                                    fill: false,
-                                    tension: 0.3,
-                                },
-                                {
-                                    label: "UK Average",
-                                    data: data.graph_data.national_average,
-                                    borderColor: "#8bc349",
-                                    fill: false,
-                                    tension: 0.3,
-                                },
-                            ],
-                        },
-                        options: {
-                            responsive: true,
-                            scales: {
-                                y: { beginAtZero: true, title: { display: true, text: "kWh" } },
-                                x: { title: { display: true, text: "Date" } },
-                            },
-                            plugins: {
-                                legend: { position: "top" },
-                                tooltip: {
-                                    callbacks: {
-                                        label: (ctx) => `${ctx.dataset.label}: ${ctx.parsed.y} kWh`,
-                                    },
-                                },
-                            },
-                        },
+                    // List unusual usage periods found by the anomaly job
+                    const anomaly_list = document.getElementById("energy-anomalies");
+                    anomaly_list.innerHTML = "";
+                    data.anomalies.forEach((anomaly) => {
+                        const item = document.createElement("li");
+                        const direction = anomaly.kind === "high" ? "Higher" : "Lower";
+                        item.textContent = `${direction} than usual from ${anomaly.start} to ${anomaly.end} ` +
+                            `(${Math.abs(anomaly.excess_kwh)} kWh ${anomaly.kind === "high" ? "extra" : "less"})`;
+                        anomaly_list.appendChild(item);
                     });
                 }
             })
             .catch((err) => console.error("Energy data fetch failed:", err));
+
+        // Rank the tariff catalogue against the customer's own readings
+        fetch("/api/tariff-comparison")
+            .then((res) => res.json())
+            .then((data) => {
+                const tariff_list = document.getElementById("tariff-comparison");
+                tariff_list.innerHTML = "";
+                if (!data.success) {
+                    tariff_list.innerHTML = `<li>${escape_html(data.error)}</li>`;
+                    return;
+                }
+                data.tariffs.forEach((tariff) => {
+                    const item = document.createElement("li");
+                    item.textContent = `${tariff.name}: £${tariff.annual_cost.toFixed(2)} a year` +
+                        (tariff.extra_cost > 0 ? ` (£${tariff.extra_cost.toFixed(2)} more)` : " (cheapest)");
+                    tariff_list.appendChild(item);
+                });
+            })
+            .catch((err) => console.error("Tariff comparison fetch failed:", err));
+
+        draw_energy_chart("week");
     }
 
+    // Switch chart range
+    document.querySelectorAll(".energy-range").forEach((btn) => {
+        btn.addEventListener("click", (e) => {
+            e.preventDefault();
+            draw_energy_chart(btn.dataset.range);
+        });
+    });
+
     // Attach energy tracking button
     document.querySelector(".track-button").addEventListener("click", (e) => {
         e.preventDefault();
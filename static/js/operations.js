@@ -0,0 +1,109 @@
+/*
+    Rolsa Technologies
+    operations.js
+*/
+
+let report_chart = null;
+
+const column_names = {
+    week: "Week",
+    product: "Product",
+    status: "Status",
+    property_type: "Property Type",
+    area: "Area",
+    kind: "Kind",
+    count: "Count"
+};
+
+// Escapes text before it is placed into table markup
+function escape_html(text) {
+    const div = document.createElement("div");
+    div.textContent = text == null ? "" : String(text);
+    return div.innerHTML;
+}
+
+function fill_table(name, rows, group_by) {
+    const columns = group_by.filter(column => column !== "kind" || name === "bookings").concat(["count"]);
+
+    document.getElementById(`${name}-head`).innerHTML =
+        `<tr>${columns.map(column => `<th scope="col">${column_names[column]}</th>`).join("")}</tr>`;
+    document.getElementById(`${name}-body`).innerHTML = rows.length ? rows.map(row =>
+        `<tr>${columns.map(column =>
+            `<td${column === "count" ? ' class="count"' : ""}>${escape_html(row[column])}</td>`).join("")}</tr>`
+    ).join("") : `<tr><td colspan="${columns.length}">Nothing in this range.</td></tr>`;
+}
+
+// Consultations per week, one stacked series for each value of the other grouping
+function draw_chart(rows, group_by) {
+    if (report_chart) report_chart.destroy();
+    report_chart = null;
+    if (!group_by.includes("week")) return;
+
+    const series = group_by.find(column => column !== "week");
+    const weeks = [...new Set(rows.map(row => row.week))];
+    const totals = {};
+    rows.forEach(row => {
+        const label = series ? row[series] : "Consultations";
+        totals[label] = totals[label] || new Array(weeks.length).fill(0);
+        totals[label][weeks.indexOf(row.week)] += row.count;
+    });
+
+    report_chart = new Chart(document.getElementById("report-chart").getContext("2d"), {
+        type: "bar",
+        data: {
+            labels: weeks,
+            datasets: Object.entries(totals).map(([label, counts]) => ({ label: String(label), data: counts }))
+        },
+        options: {
+            animation: false,
+            maintainAspectRatio: false,
+            scales: { x: { stacked: true }, y: { stacked: true, beginAtZero: true } }
+        }
+    });
+}
+
+function load_report(event) {
+    if (event) event.preventDefault();
+
+    const key = document.getElementById("staff-key").value;
+    const error = document.getElementById("report-error");
+    if (!key) {
+        error.textContent = "Enter your staff key";
+        return;
+    }
+    sessionStorage.setItem("staff_key", key);
+
+    const parameters = new URLSearchParams({ group_by: document.getElementById("group-by").value });
+    const from = document.getElementById("report-from").value;
+    const to = document.getElementById("report-to").value;
+    if (from) parameters.set("from", from);
+    if (to) parameters.set("to", to);
+
+    fetch(`/api/reports/operations?${parameters}`, { headers: { "Authorization": `Bearer ${key}` } })
+        .then(response => response.json())
+        .then(result => {
+            if (!result.success) throw new Error(result.error);
+
+            error.textContent = "";
+            draw_chart(result.consultations, result.group_by);
+            fill_table("consultations", result.consultations, result.group_by);
+            fill_table("bookings", result.bookings, result.group_by);
+            document.getElementById("reconciled").textContent = result.reconciled_time
+                ? `Last checked against live data ${new Date(result.reconciled_time * 1000).toLocaleString()}`
+                : "Not yet checked against live data";
+        })
+        .catch(problem => {
+            error.textContent = problem.message;
+            console.error("Report failed:", problem);
+        });
+}
+
+document.addEventListener("DOMContentLoaded", () => {
+    document.getElementById("report-form").addEventListener("submit", load_report);
+
+    const key = sessionStorage.getItem("staff_key");
+    if (key) {
+        document.getElementById("staff-key").value = key;
+        load_report();
+    }
+});
@@ -0,0 +1,55 @@
+import importlib
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def copy_database(directory):
+    # The app opens database.db, data/, archive/ and .sessions/ relative to the working directory
+    shutil.copy(os.path.join(ROOT, "database.db"), directory)
+    shutil.copytree(os.path.join(ROOT, "data"), os.path.join(directory, "data"))
+    os.makedirs(os.path.join(directory, ".sessions"))
+
+
+@pytest.fixture(scope="session")
+def app_module(tmp_path_factory):
+    # Importing app creates its tables, so it happens in a copy rather than the checked in database
+    directory = tmp_path_factory.mktemp("import")
+    copy_database(directory)
+    working_directory = os.getcwd()
+    os.chdir(directory)
+    try:
+        module = importlib.import_module("app")
+    finally:
+        os.chdir(working_directory)
+
+    module.app.config["TESTING"] = True
+    return module
+
+
+@pytest.fixture
+def app_module_in(tmp_path, monkeypatch, app_module):
+    # A fresh copy of the database for each test, with the module's caches emptied
+    copy_database(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    app_module.init_database()
+    app_module.archive_shards.clear()
+    app_module.device_customers.clear()
+
+    return app_module
+
+
+@pytest.fixture
+def client(app_module_in):
+    # A test client logged in as a newly registered customer
+    client = app_module_in.app.test_client()
+    password = "Passw0rd!"
+    client.post("/signup", data={"email": "meter@example.com", "password": password, "repeat_password": password})
+    client.post("/login", data={"email": "meter@example.com", "password": password})
+
+    return client
@@ -0,0 +1,135 @@
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+CUSTOMER_ID = 90001
+DAY = 86400
+
+
+@pytest.fixture
+def old_readings(app_module_in):
+    # Sixty days of half-hourly readings from well before the archive cutoff
+    today = int(time.time()) // DAY * DAY
+    timestamps = np.arange(today - 700 * DAY, today - 640 * DAY, 1800, dtype=np.int64)
+    wh_values = (timestamps // 1800) % 97 + 1
+
+    database = sqlite3.connect("database.db")
+    database.execute("BEGIN IMMEDIATE")
+    app_module_in.store_meter_readings(database.cursor(), CUSTOMER_ID, timestamps, wh_values)
+    database.commit()
+    database.close()
+
+    return timestamps, wh_values
+
+
+def store(app_module, timestamp, wh):
+    database = sqlite3.connect("database.db")
+    database.execute("BEGIN IMMEDIATE")
+    app_module.store_meter_readings(database.cursor(), CUSTOMER_ID, [timestamp], [wh])
+    database.commit()
+    database.close()
+
+
+def snapshot(app_module):
+    # Readings as served, the hot rows left and the daily rollup totals
+    database = sqlite3.connect("database.db")
+    cursor = database.cursor()
+    try:
+        timestamps, wh_values = app_module.fetch_meter_readings(cursor, CUSTOMER_ID, 0, time.time())
+        hot_rows = cursor.execute("SELECT COUNT(*) FROM meter_readings WHERE customer_id = ?",
+                                  (CUSTOMER_ID,)).fetchone()[0]
+        _, rollup_wh, rollup_readings = app_module.fetch_rollups(cursor, CUSTOMER_ID, "day", 0, time.time())
+    finally:
+        database.close()
+
+    return timestamps, wh_values, hot_rows, (int(rollup_wh.sum()), int(rollup_readings.sum()))
+
+
+def archive(app_module):
+    return app_module.archive_readings(app_module.ARCHIVE_AFTER_DAYS)
+
+
+def test_archive_round_trip(app_module_in, old_readings):
+    timestamps, wh_values = old_readings
+    _, _, hot_rows, rollups = snapshot(app_module_in)
+    assert hot_rows == 60
+    assert rollups == (int(wh_values.sum()), len(wh_values))
+
+    assert archive(app_module_in) == {CUSTOMER_ID % app_module_in.ARCHIVE_SHARDS: 60}
+
+    archived_timestamps, archived_wh, hot_rows, archived_rollups = snapshot(app_module_in)
+    assert hot_rows == 0
+    np.testing.assert_array_equal(archived_timestamps, timestamps)
+    np.testing.assert_array_equal(archived_wh, wh_values)
+    assert archived_rollups == rollups
+
+
+def test_late_corrections_to_archived_days(app_module_in, old_readings):
+    timestamps, wh_values = old_readings
+    archive(app_module_in)
+    slot = 100
+
+    # Each correction is read back before and after it is archived again, the latest run winning
+    for correction in (5000, 42):
+        store(app_module_in, timestamps[slot], correction)
+        for _ in range(2):
+            corrected_timestamps, corrected_wh, _, rollups = snapshot(app_module_in)
+            expected = wh_values.copy()
+            expected[slot] = correction
+            np.testing.assert_array_equal(corrected_timestamps, timestamps)
+            np.testing.assert_array_equal(corrected_wh, expected)
+            assert rollups == (int(expected.sum()), len(expected))
+            archive(app_module_in)
+
+        assert snapshot(app_module_in)[2] == 0
+
+
+def test_reading_stored_during_archive_run_survives(app_module_in, old_readings, monkeypatch):
+    timestamps, wh_values = old_readings
+    encode = app_module_in.encode_archive_chunk
+    stored = []
+
+    def store_while_encoding(day_starts, blocks):
+        # A late reading commits after its day was read for the archive but before the rows are deleted
+        if not stored:
+            stored.append(True)
+            store(app_module_in, timestamps[3], 777)
+        return encode(day_starts, blocks)
+
+    monkeypatch.setattr(app_module_in, "encode_archive_chunk", store_while_encoding)
+    archive(app_module_in)
+    monkeypatch.setattr(app_module_in, "encode_archive_chunk", encode)
+
+    expected = wh_values.copy()
+    expected[3] = 777
+    _, served_wh, hot_rows, rollups = snapshot(app_module_in)
+    assert hot_rows == 1
+    np.testing.assert_array_equal(served_wh, expected)
+    assert rollups == (int(expected.sum()), len(expected))
+
+    archive(app_module_in)
+    _, served_wh, hot_rows, _ = snapshot(app_module_in)
+    assert hot_rows == 0
+    np.testing.assert_array_equal(served_wh, expected)
+
+
+def test_correction_to_day_archived_early(app_module_in):
+    # archive-readings --days can archive days newer than ARCHIVE_AFTER_DAYS, which a late correction
+    # must still find in the archive rather than count as a new reading
+    today = int(time.time()) // DAY * DAY
+    timestamps = np.arange(today - 100 * DAY, today - 90 * DAY, 1800, dtype=np.int64)
+    database = sqlite3.connect("database.db")
+    database.execute("BEGIN IMMEDIATE")
+    app_module_in.store_meter_readings(database.cursor(), CUSTOMER_ID, timestamps, np.full(len(timestamps), 10))
+    database.commit()
+    database.close()
+
+    assert app_module_in.archive_readings(30) == {CUSTOMER_ID % app_module_in.ARCHIVE_SHARDS: 10}
+    store(app_module_in, timestamps[5], 20)
+
+    _, served_wh, _, rollups = snapshot(app_module_in)
+    assert rollups == (480 * 10 + 10, 480)
+    assert len(served_wh) == 480
+    assert served_wh[5] == 20
@@ -0,0 +1,114 @@
+import json
+import queue
+import sqlite3
+import time
+
+import numpy as np
+import pytest
+
+INGEST_KEY = "test-ingest-key"
+
+
+@pytest.fixture
+def meter(client, app_module_in, monkeypatch):
+    # A registered device, returned with its customer id. A writer left from an earlier test holds a
+    # connection to that test's database, so this test gets its own queue and writer
+    monkeypatch.setenv("INGEST_API_KEY", INGEST_KEY)
+    monkeypatch.setattr(app_module_in, "ingest_queue", queue.Queue())
+    monkeypatch.setattr(app_module_in, "ingest_writer", None)
+    monkeypatch.setattr(app_module_in, "ingest_metrics", dict(app_module_in.ingest_metrics, pending_readings=0,
+                                                              oldest_pending_time=None))
+    assert client.post("/api/devices", data={"device_id": "meter-1"}).get_json()["success"]
+
+    database = sqlite3.connect("database.db")
+    customer_id = database.execute("SELECT customer_id FROM devices WHERE device_id = 'meter-1'").fetchone()[0]
+    database.close()
+
+    return customer_id
+
+
+def post_readings(client, readings):
+    body = "\n".join(json.dumps({"device": "meter-1", "timestamp": timestamp, "wh": wh})
+                     for timestamp, wh in readings)
+    return client.post("/api/readings", data=body, content_type="application/x-ndjson",
+                       headers={"Authorization": f"Bearer {INGEST_KEY}"})
+
+
+def wait_for_writer(app_module):
+    deadline = time.time() + 30
+    while app_module.ingest_metrics["pending_readings"] and time.time() < deadline:
+        time.sleep(0.05)
+    assert app_module.ingest_metrics["pending_readings"] == 0
+
+
+def rollup_totals(app_module, customer_id, resolution):
+    database = sqlite3.connect("database.db")
+    try:
+        _, wh, readings = app_module.fetch_rollups(database.cursor(), customer_id, resolution, 0, time.time() + 86400)
+    finally:
+        database.close()
+
+    return int(wh.sum()), int(readings.sum())
+
+
+def test_ingested_readings_match_rollups(client, app_module_in, meter):
+    now = int(time.time()) // 1800 * 1800
+    readings = [(now - 1800 * slot, 100 + slot) for slot in range(1, 200)]
+
+    response = post_readings(client, readings)
+    assert response.status_code == 202
+    assert response.get_json()["accepted"] == len(readings)
+    wait_for_writer(app_module_in)
+
+    expected = (sum(wh for _, wh in readings), len(readings))
+    for resolution in app_module_in.ROLLUP_RESOLUTIONS:
+        assert rollup_totals(app_module_in, meter, resolution) == expected
+
+
+def test_corrections_net_out_of_rollups(client, app_module_in, meter):
+    now = int(time.time()) // 1800 * 1800
+    readings = {now - 1800 * slot: 500 for slot in range(1, 49)}
+    assert post_readings(client, readings.items()).status_code == 202
+    wait_for_writer(app_module_in)
+
+    # Resent half hours replace what was stored, and within a batch the last reading wins
+    corrections = [(timestamp, 20) for timestamp in list(readings)[:10]] + [(now - 1800, 7)]
+    response = post_readings(client, corrections)
+    assert response.get_json()["duplicates"] == 1
+    wait_for_writer(app_module_in)
+    readings.update(corrections)
+
+    database = sqlite3.connect("database.db")
+    timestamps, wh_values = app_module_in.fetch_meter_readings(database.cursor(), meter, 0, now + 1800)
+    database.close()
+    assert dict(zip(timestamps.tolist(), wh_values.tolist())) == readings
+
+    for resolution in app_module_in.ROLLUP_RESOLUTIONS:
+        assert rollup_totals(app_module_in, meter, resolution) == (sum(readings.values()), len(readings))
+
+
+def test_busy_group_is_retried_before_newer_readings(client, app_module_in, meter, monkeypatch):
+    # The first commit finds the database busy after a newer reading for the same half hour has been
+    # queued; the older reading must not overwrite it when the busy group is retried
+    timestamp = int(time.time()) // 1800 * 1800 - 1800
+    store = app_module_in.store_meter_readings
+    calls = []
+
+    def busy_once(cursor, customer_ids, timestamps, wh_values):
+        calls.append(wh_values.tolist())
+        if len(calls) == 1:
+            app_module_in.enqueue_readings(np.array([meter]), np.array([timestamp]), np.array([200]))
+            raise sqlite3.OperationalError("database is locked")
+        return store(cursor, customer_ids, timestamps, wh_values)
+
+    monkeypatch.setattr(app_module_in, "INGEST_COMMIT_ATTEMPTS", 1)
+    monkeypatch.setattr(app_module_in, "store_meter_readings", busy_once)
+    app_module_in.enqueue_readings(np.array([meter]), np.array([timestamp]), np.array([100]))
+    wait_for_writer(app_module_in)
+
+    database = sqlite3.connect("database.db")
+    _, wh_values = app_module_in.fetch_meter_readings(database.cursor(), meter, timestamp, timestamp + 1800)
+    database.close()
+    assert calls[0] == [100]
+    assert wh_values.tolist() == [200]
+    assert rollup_totals(app_module_in, meter, "day") == (200, 1)
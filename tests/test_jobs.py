@@ -0,0 +1,98 @@
+import sqlite3
+import time
+
+import pytest
+
+
+@pytest.fixture
+def jobs(app_module_in):
+    # An empty queue, so the worker only sees the jobs a test enqueues
+    database = sqlite3.connect("database.db")
+    database.execute("DELETE FROM job_queue")
+    database.execute("DELETE FROM dead_jobs")
+    database.execute("DELETE FROM job_stats")
+    database.commit()
+    yield database
+    database.close()
+
+
+def register(app_module, monkeypatch, kind, handler, max_attempts):
+    monkeypatch.setitem(app_module.job_handlers, kind,
+                        (handler, max_attempts, app_module.JOB_VISIBILITY_SECONDS))
+
+
+def enqueue(app_module, database, kind, payload):
+    cursor = database.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    job_id = app_module.enqueue_job(cursor, kind, payload)
+    database.commit()
+
+    return job_id
+
+
+def make_due(database):
+    # Skips the backoff so the next burst picks retries up straight away
+    database.execute("UPDATE job_queue SET run_at = 0")
+    database.commit()
+
+
+def test_failed_job_retries_with_backoff(app_module_in, jobs, monkeypatch):
+    calls = []
+
+    def flaky(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise RuntimeError("first attempt fails")
+
+    register(app_module_in, monkeypatch, "test_flaky", flaky, max_attempts=3)
+    job_id = enqueue(app_module_in, jobs, "test_flaky", {"value": 7})
+
+    before = time.time()
+    assert app_module_in.run_job_worker(batch_size=10, burst=True) == 1
+    run_at, attempts, claimed_by, last_error = jobs.execute(
+        "SELECT run_at, attempts, claimed_by, last_error FROM job_queue WHERE id = ?", (job_id,)).fetchone()
+    assert attempts == 1
+    assert claimed_by is None
+    assert last_error == "RuntimeError: first attempt fails"
+    assert run_at >= before + app_module_in.JOB_BACKOFF_SECONDS * 0.5
+
+    make_due(jobs)
+    assert app_module_in.run_job_worker(batch_size=10, burst=True) == 1
+    assert calls == [7, 7]
+    assert jobs.execute("SELECT COUNT(*) FROM job_queue").fetchone()[0] == 0
+    assert jobs.execute("SELECT completed, retried, dead FROM job_stats WHERE kind = 'test_flaky'").fetchone() \
+        == (1, 1, 0)
+
+
+def test_job_is_dead_lettered_after_its_attempts(app_module_in, jobs, monkeypatch):
+    def broken(value):
+        raise ValueError(f"cannot handle {value}")
+
+    register(app_module_in, monkeypatch, "test_broken", broken, max_attempts=2)
+    job_id = enqueue(app_module_in, jobs, "test_broken", {"value": 3})
+
+    app_module_in.run_job_worker(batch_size=10, burst=True)
+    make_due(jobs)
+    app_module_in.run_job_worker(batch_size=10, burst=True)
+
+    assert jobs.execute("SELECT COUNT(*) FROM job_queue").fetchone()[0] == 0
+    assert jobs.execute("SELECT id, kind, attempts, error FROM dead_jobs").fetchall() \
+        == [(job_id, "test_broken", 2, "ValueError: cannot handle 3")]
+    assert jobs.execute("SELECT completed, retried, dead FROM job_stats WHERE kind = 'test_broken'").fetchone() \
+        == (0, 1, 1)
+
+    # Requeued jobs start again with fresh attempts and their original payload
+    result = app_module_in.app.test_cli_runner().invoke(args=["requeue-dead-jobs", "--kind", "test_broken"])
+    assert result.output == "Requeued 1 jobs\n"
+    assert jobs.execute("SELECT COUNT(*) FROM dead_jobs").fetchone()[0] == 0
+    assert jobs.execute("SELECT kind, payload, attempts FROM job_queue").fetchall() \
+        == [("test_broken", b'{"value":3}', 0)]
+
+
+def test_unknown_kind_is_dead_lettered(app_module_in, jobs):
+    enqueue(app_module_in, jobs, "test_unregistered", {})
+
+    app_module_in.run_job_worker(batch_size=10, burst=True)
+
+    assert jobs.execute("SELECT kind, attempts, error FROM dead_jobs").fetchall() \
+        == [("test_unregistered", 1, "KeyError: 'test_unregistered'")]